@@ -0,0 +1,453 @@
+#!/usr/bin/env python
+"""Benchmarks of the Go linter and codeintel paths.
+
+Runs the linter, completions, go to definition and the section patterns on
+synthetic Go buffers of increasing size, with the stand-in go, gofmt,
+gocode and godef of bench/fakebin and the XPCOM stand-ins of bench/shims,
+so no Komodo (and no Go installation) is needed:
+
+    python bench/run_bench.py --sizes 1k,100k --iterations 20
+
+For each operation and buffer size the p50/p95/p99 latencies and the net
+number of objects allocated (objects tracked by the garbage collector) are
+reported.  Results can be saved with --json and compared with a saved run
+with --baseline, which exits with status 1 if an operation's median
+latency regressed by more than --max-regression.
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import tempfile
+import optparse
+import logging
+from timeit import default_timer as _clock
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+source_dir = os.path.dirname(bench_dir)
+fakebin_dir = os.path.join(bench_dir, "fakebin")
+sys.path[0:0] = [os.path.join(bench_dir, "shims"),
+                 os.path.join(source_dir, "pylib"),
+                 os.path.join(source_dir, "components")]
+os.environ["PATH"] = fakebin_dir + os.pathsep + os.environ.get("PATH", "")
+
+from xpcom import components
+
+components.services["@activestate.com/koAppInfoEx?app=Go;1"] = \
+    components.Service(executablePath=os.path.join(fakebin_dir, "go"),
+                       getVersionForBinary=lambda golangExe: "1.21.6")
+
+import go_catalog
+import go_gocode
+import go_largefile
+import go_sections
+import go_stats
+import go_syntax
+import go_warmup
+import langinfo_go
+import koGoLanguage
+
+log = logging.getLogger("go-bench")
+
+_size_suffixes = {"k": 1024, "m": 1024 * 1024}
+
+def parse_size(text):
+    text = text.strip().lower().rstrip("b")
+    scale = _size_suffixes.get(text[-1:], 1)
+    if scale != 1:
+        text = text[:-1]
+    return int(float(text) * scale)
+
+def format_size(size):
+    for suffix, scale in (("m", 1024 * 1024), ("k", 1024)):
+        if size >= scale and size % scale == 0:
+            return "%d%s" % (size // scale, suffix)
+    return str(size)
+
+#---- synthetic sources
+
+_unit_template = '''\
+// Record%(i)d is a record with a few fields. It is used by the helpers
+// below.
+type Record%(i)d struct {
+	Name  string
+	Count int
+	Tags  []string // tags, in order
+}
+
+// Total returns the count of r.
+func (r *Record%(i)d) Total() int {
+	if r == nil {
+		return 0
+	}
+	return r.Count + len(r.Tags)
+}
+
+/* Limit%(i)d is the largest count of a Record%(i)d. */
+const Limit%(i)d = %(i)d
+
+var registry%(i)d = map[string]int{"a": 1, "b": 2}
+
+// Helper%(i)d formats a Record%(i)d.
+func Helper%(i)d(name string, count int) string {
+	r := &Record%(i)d{Name: name, Count: count}
+	s := fmt.Sprintf("%%s: %%d {braces} // not a comment", r.Name, r.Total())
+	t := `raw
+string with "quotes" and /* no comment */`
+	for i := 0; i < count; i++ {
+		s += strings.Repeat("x", i) + t[:1]
+	}
+	return s
+}
+
+'''
+
+_target = '''\
+func benchTarget() {
+	value := Helper0("x", 1)
+	fmt.Pri
+	Pri
+	benchlib.Var
+	println(value)
+}
+'''
+
+class Source(object):
+    """A synthetic Go file and the positions the operations work at."""
+
+    def __init__(self, size, pkg_dir):
+        parts = ['package main\n\nimport (\n\t"fmt"\n\t"strings"\n\n'
+                 '\t"benchlib"\n)\n\n']
+        length = len(parts[0]) + len(_target)
+        i = 0
+        while length < size:
+            unit = _unit_template % {"i": i}
+            parts.append(unit)
+            length += len(unit)
+            i += 1
+        parts.append(_target)
+        self.text = "".join(parts)
+        self.size = size
+        self.path = os.path.join(pkg_dir, "main_%s.go" % format_size(size))
+        with open(self.path, "wb") as fout:
+            fout.write(self.text)
+        target = self.text.rindex(_target)
+        self.std_selector_pos = self.text.index("fmt.Pri\n", target) + 7
+        self.identifier_pos = self.text.index("\tPri\n", target) + 4
+        self.package_selector_pos = self.text.index("benchlib.Var\n",
+                                                    target) + 12
+        self.local_pos = self.text.index("(value)", target) + 3
+        self.package_level_pos = self.text.index("Helper0(", target) + 3
+        # An edit in the middle of the buffer, for incremental sections.
+        self.edit_pos = self.text.index("return s\n", len(self.text) // 2)
+
+def make_goroot(root):
+    """Create a small GOROOT source tree for the std catalog."""
+    packages = {
+        "fmt": "package fmt\n\n// Println prints.\nfunc Println(a ...interface{}) (n int, err error) { return }\n\n"
+               "// Printf formats.\nfunc Printf(format string, a ...interface{}) (n int, err error) { return }\n\n"
+               "// Sprintf formats to a string.\nfunc Sprintf(format string, a ...interface{}) string { return \"\" }\n",
+        "strings": "package strings\n\n// Repeat repeats s.\nfunc Repeat(s string, count int) string { return s }\n\n"
+                   "// Builder builds strings.\ntype Builder struct{ buf []byte }\n",
+    }
+    for name, text in packages.items():
+        pkg_dir = os.path.join(root, "src", name)
+        os.makedirs(pkg_dir)
+        with open(os.path.join(pkg_dir, name + ".go"), "wb") as fout:
+            fout.write(text)
+
+#---- operations
+
+class _Encoding(object):
+    python_encoding_name = "utf-8"
+
+class _File(object):
+    isLocal = True
+
+    def __init__(self, path):
+        self.path = path
+
+class _Document(object):
+    def __init__(self, path):
+        self.file = _File(path)
+        self.displayPath = path
+
+class LintRequest(object):
+    """The parts of a koILintRequest that the linter uses."""
+
+    def __init__(self, source):
+        self.content = source.text
+        self.encoding = _Encoding()
+        self.uid = source.path
+        self.cwd = os.path.dirname(source.path)
+        self.koDoc = _Document(source.path)
+
+class Operations(object):
+    """The benchmarked operations: name -> method(source)."""
+
+    names = ("lint", "syntax", "complete-std", "complete-package", "complete-gocode",
+             "definition-index",
+             "definition-godef", "sections-cold", "sections-edit", "build")
+
+    def __init__(self):
+        self.linter = koGoLanguage.KoGolangLinter()
+        self.intel = langinfo_go.GoLangIntel()
+        self.patterns = [pattern for kind, pattern in go_sections.section_regexes]
+        self._edits = 0
+
+    def get(self, name):
+        return getattr(self, "op_" + name.replace("-", "_"))
+
+    def op_lint(self, source):
+        self.linter._lint_cache.clear()
+        return self.linter.lint_with_text(LintRequest(source), source.text)
+
+    def op_syntax(self, source):
+        return go_syntax.check(source.text)
+
+    def _complete(self, source, pos):
+        # Don't let the completions of the last run be refined.
+        self.intel._last_completions = None
+        return self.intel.getCompletions(source.text, pos, source.path,
+                                         None, None)
+
+    def op_complete_std(self, source):
+        return self._complete(source, source.std_selector_pos)
+
+    def op_complete_package(self, source):
+        return self._complete(source, source.package_selector_pos)
+
+    def op_complete_gocode(self, source):
+        return self._complete(source, source.identifier_pos)
+
+    def op_definition_index(self, source):
+        return self.intel.getDefinition(source.text, source.package_level_pos,
+                                        source.path, None, None)
+
+    def op_definition_godef(self, source):
+        return self.intel.getDefinition(source.text, source.local_pos,
+                                        source.path, None, None)
+
+    def _sections(self, text):
+        return [pattern.findall(text) for pattern in self.patterns]
+
+    def op_sections_cold(self, source):
+        go_sections.section_scanner.clear()
+        return self._sections(source.text)
+
+    def op_sections_edit(self, source):
+        self._edits += 1
+        pos = source.edit_pos
+        edited = "%s%d;%s" % (source.text[:pos], self._edits,
+                              source.text[pos:])
+        return self._sections(edited)
+
+    def op_build(self, source):
+        build = self.linter.build_packages([source.path])
+        build.finished.wait()
+        return build
+
+    def check(self, name, source, result):
+        """Complain if an operation didn't do its job."""
+        if name == "complete-gocode" and go_largefile.is_large(source.text):
+            pass    # gocode isn't run for large files
+        elif name.startswith("complete") and not (result and result["entries"]):
+            log.warn("%s found no completions in %s", name, source.path)
+        elif name.startswith("definition") and not result:
+            log.warn("%s found no definition in %s", name, source.path)
+        elif name.startswith("sections") and not result[0]:
+            log.warn("%s found no sections in %s", name, source.path)
+        elif name == "syntax" and result:
+            log.warn("%s found problems in %s: %r", name, source.path,
+                     result[:3])
+        elif name == "build" and result.returncode is None:
+            log.warn("%s didn't run for %s", name, source.path)
+
+    def warm_up(self, source, timeout=30):
+        """Wait for the background std catalog build to finish."""
+        deadline = _clock() + timeout
+        go_exe = self.linter._go_exe
+        while go_catalog.std_catalogs.get(go_exe, dict(os.environ)) is None:
+            if _clock() > deadline:
+                log.warn("the std catalog wasn't built in %ds", timeout)
+                break
+            time.sleep(0.05)
+        for name in self.names:
+            self.check(name, source, self.get(name)(source))
+        # Don't measure while the background warm-up is still running.
+        while "workspace" not in go_warmup.warm_up.readiness():
+            if _clock() > deadline:
+                log.warn("the warm-up didn't finish in %ds", timeout)
+                break
+            time.sleep(0.05)
+        log.debug("warm-up: %r", go_warmup.warm_up.readiness())
+
+#---- measurement
+
+def _percentile(sorted_samples, fraction):
+    index = int(round(fraction * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+def measure(func, source, iterations, max_time):
+    """Run func(source) up to `iterations` times, for at most max_time
+    seconds (but at least 3 times).
+
+    Returns the p50/p95/p99 latencies in milliseconds and the median net
+    number of objects allocated.
+    """
+    times = []
+    allocations = []
+    started = _clock()
+    for i in range(iterations):
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.get_count()[0]
+            start = _clock()
+            func(source)
+            elapsed = _clock() - start
+            allocated = gc.get_count()[0] - before
+        finally:
+            gc.enable()
+        times.append(elapsed * 1000.0)
+        allocations.append(allocated)
+        if i >= 2 and _clock() - started > max_time:
+            break
+    times.sort()
+    allocations.sort()
+    return {
+        "iterations": len(times),
+        "p50": _percentile(times, 0.5),
+        "p95": _percentile(times, 0.95),
+        "p99": _percentile(times, 0.99),
+        "allocations": _percentile(allocations, 0.5),
+    }
+
+def format_results(results):
+    lines = ["%-18s %6s %5s %10s %10s %10s %11s" % (
+             "operation", "size", "runs", "p50 ms", "p95 ms", "p99 ms",
+             "allocs")]
+    for key in sorted(results, key=lambda k: (k.split("@")[0],
+                                              parse_size(k.split("@")[1]))):
+        name, size = key.split("@")
+        r = results[key]
+        lines.append("%-18s %6s %5d %10.2f %10.2f %10.2f %11d" % (
+            name, size, r["iterations"], r["p50"], r["p95"], r["p99"],
+            r["allocations"]))
+    return "\n".join(lines)
+
+def compare(results, baseline, max_regression, min_delta):
+    """Return descriptions of the median latencies that regressed."""
+    regressions = []
+    for key, r in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            continue
+        delta = r["p50"] - base["p50"]
+        if delta > min_delta and delta > base["p50"] * max_regression:
+            regressions.append("%s: p50 %.2fms -> %.2fms (+%d%%)" % (
+                key, base["p50"], r["p50"],
+                base["p50"] and 100 * delta / base["p50"] or 100))
+    return regressions
+
+def main(argv):
+    parser = optparse.OptionParser(usage="%prog [options]",
+                                   description=__doc__.split("\n\n")[0])
+    parser.add_option("--sizes", default="1k,10k,100k,1m,10m",
+                      help="comma separated buffer sizes (default %default)")
+    parser.add_option("--ops", default=",".join(Operations.names),
+                      help="comma separated operations (default %default)")
+    parser.add_option("-n", "--iterations", type="int", default=20,
+                      help="runs of each operation per size (default %default)")
+    parser.add_option("--max-time", type="float", default=10,
+                      help="seconds after which an operation stops being "
+                           "repeated (default %default)")
+    parser.add_option("--delay", type="float", default=0,
+                      help="seconds the stand-in tools take to answer")
+    parser.add_option("--gofmt-errors", type="int", default=0,
+                      help="syntax errors reported by the stand-in gofmt")
+    parser.add_option("--build-errors", type="int", default=0,
+                      help="compiler errors reported by the stand-in go build")
+    parser.add_option("--gocode-candidates", type="int", default=200,
+                      help="candidates returned by the stand-in gocode "
+                           "(default %default)")
+    parser.add_option("--json", dest="json_path",
+                      help="write the results to this file")
+    parser.add_option("--baseline",
+                      help="compare with the results saved in this file")
+    parser.add_option("--max-regression", type="float", default=0.25,
+                      help="allowed p50 slowdown relative to the baseline "
+                           "(default %default)")
+    parser.add_option("--min-delta", type="float", default=1.0,
+                      help="p50 slowdowns under this many milliseconds are "
+                           "ignored (default %default)")
+    parser.add_option("-v", "--verbose", action="store_true")
+    options, args = parser.parse_args(argv[1:])
+    logging.basicConfig(level=options.verbose and logging.DEBUG or logging.WARN)
+
+    names = [name.strip() for name in options.ops.split(",") if name.strip()]
+    for name in names:
+        if name not in Operations.names:
+            parser.error("unknown operation %r" % name)
+    sizes = [parse_size(size) for size in options.sizes.split(",")]
+
+    work_dir = tempfile.mkdtemp(prefix="go-bench-")
+    os.environ["FAKE_DELAY"] = str(options.delay)
+    os.environ["FAKE_GOFMT_ERRORS"] = str(options.gofmt_errors)
+    os.environ["FAKE_BUILD_ERRORS"] = str(options.build_errors)
+    os.environ["FAKE_GOCODE_COUNT"] = str(options.gocode_candidates)
+    os.environ["GOROOT"] = os.path.join(work_dir, "goroot")
+    os.environ["GOPATH"] = os.path.join(work_dir, "gopath")
+    make_goroot(os.environ["GOROOT"])
+    pkg_dir = os.path.join(os.environ["GOPATH"], "src", "bench")
+    os.makedirs(pkg_dir)
+    lib_dir = os.path.join(os.environ["GOPATH"], "src", "benchlib")
+    os.makedirs(lib_dir)
+    with open(os.path.join(lib_dir, "lib.go"), "wb") as fout:
+        fout.write("package benchlib\n\nvar VarName0 int\n")
+
+    results = {}
+    try:
+        operations = Operations()
+        for size in sizes:
+            source = Source(size, pkg_dir)
+            operations.warm_up(source)
+            for name in names:
+                key = "%s@%s" % (name, format_size(size))
+                results[key] = measure(operations.get(name), source,
+                                       options.iterations, options.max_time)
+                sys.stdout.write(format_results({key: results[key]})
+                                 .splitlines()[-1] + "\n")
+                sys.stdout.flush()
+            os.remove(source.path)
+    finally:
+        go_gocode.shutdown_all()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print
+    print format_results(results)
+    print
+    print go_stats.stats.format()
+
+    if options.json_path:
+        with open(options.json_path, "wb") as fout:
+            json.dump({"results": results, "tools": go_stats.stats.summary()},
+                      fout, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline, "rb") as fin:
+            baseline = json.load(fin)["results"]
+        regressions = compare(results, baseline, options.max_regression,
+                              options.min_delta)
+        if regressions:
+            print
+            print "Regressions against %s:" % options.baseline
+            for regression in regressions:
+                print "  " + regression
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
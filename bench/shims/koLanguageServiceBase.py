@@ -0,0 +1,36 @@
+"""Stand-in for Komodo's koLanguageServiceBase module."""
+
+class KoLanguageBase(object):
+    _com_interfaces_ = []
+
+    def __init__(self):
+        self._lexer = None
+
+    def getLanguageService(self, iid):
+        return None
+
+class KoLanguageBaseDedentMixin(object):
+    pass
+
+class KoLexerLanguageService(object):
+    supportsFolding = 0
+
+    def __init__(self):
+        self.properties = {}
+        self.keywords = {}
+
+    def setLexer(self, lexer):
+        self.lexer = lexer
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def setKeywords(self, index, keywords):
+        self.keywords[index] = keywords
+
+    def setCurrent(self, scimoz):
+        pass
+
+class FastCharData(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
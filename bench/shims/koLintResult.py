@@ -0,0 +1,15 @@
+"""Stand-in for Komodo's koLintResult module."""
+
+SEV_INFO = 0
+SEV_WARNING = 1
+SEV_ERROR = 2
+
+class KoLintResult(object):
+    def __init__(self, description="", severity=SEV_ERROR, lineStart=-1,
+                 lineEnd=-1, columnStart=-1, columnEnd=-1):
+        self.description = description
+        self.severity = severity
+        self.lineStart = lineStart
+        self.lineEnd = lineEnd
+        self.columnStart = columnStart
+        self.columnEnd = columnEnd
@@ -0,0 +1,14 @@
+"""Stand-in for Komodo's koLintResults module."""
+
+class koLintResults(object):
+    def __init__(self):
+        self._results = []
+
+    def addResult(self, result):
+        self._results.append(result)
+
+    def getResults(self):
+        return list(self._results)
+
+    def getNumResults(self):
+        return len(self._results)
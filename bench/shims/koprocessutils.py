@@ -0,0 +1,6 @@
+"""Stand-in for Komodo's koprocessutils module."""
+
+import os
+
+def getUserEnv():
+    return dict(os.environ)
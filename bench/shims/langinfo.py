@@ -0,0 +1,4 @@
+"""Stand-in for the langinfo module of Komodo's SDK."""
+
+class LangInfo(object):
+    pass
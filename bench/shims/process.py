@@ -0,0 +1,13 @@
+"""Stand-in for Komodo's process module."""
+
+from subprocess import Popen, PIPE
+
+class ProcessOpen(Popen):
+    def __init__(self, cmd, cwd=None, env=None, flags=None,
+                 stdin=PIPE, stdout=PIPE, stderr=PIPE,
+                 universal_newlines=True):
+        if flags is None:
+            flags = 0
+        Popen.__init__(self, cmd, cwd=cwd, env=env, creationflags=flags,
+                       stdin=stdin, stdout=stdout, stderr=stderr,
+                       universal_newlines=universal_newlines)
@@ -0,0 +1,6 @@
+"""Stand-in for Komodo's styles module."""
+
+StateMap = {"C++": {}}
+
+def addSharedStyles(state_map):
+    pass
@@ -0,0 +1,27 @@
+"""Stand-in for the which module bundled with Komodo."""
+
+import os
+import sys
+
+class WhichError(Exception):
+    pass
+
+def whichall(command, path=None, verbose=0, exts=None):
+    if path is None:
+        path = os.environ.get("PATH", "").split(os.pathsep)
+    if exts is None and sys.platform.startswith("win"):
+        exts = [".exe"]
+    found = []
+    for d in path:
+        for ext in [""] + (exts or []):
+            candidate = os.path.join(d, command + ext)
+            if os.path.isfile(candidate) and os.access(candidate, os.X_OK) \
+               and candidate not in found:
+                found.append(candidate)
+    return found
+
+def which(command, path=None, verbose=0, exts=None):
+    found = whichall(command, path, verbose, exts)
+    if not found:
+        raise WhichError("Could not find '%s' on the path." % command)
+    return found[0]
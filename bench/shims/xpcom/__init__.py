@@ -0,0 +1,14 @@
+"""Stand-ins for the parts of PyXPCOM used by the Go extension."""
+
+class ServerException(Exception):
+    def __init__(self, errno=None, msg=None):
+        Exception.__init__(self, errno, msg)
+        self.errno = errno
+
+class _NsError(object):
+    NS_ERROR_FAILURE = 0x80004005
+    NS_ERROR_FILE_NOT_FOUND = 0x80520012
+    NS_ERROR_UNEXPECTED = 0x8000ffff
+
+nsError = _NsError()
+COMException = ServerException
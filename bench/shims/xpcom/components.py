@@ -0,0 +1,104 @@
+"""Stand-in XPCOM services, with what the benchmarks need configured.
+
+Services and interfaces that aren't set up here are permissive dummies:
+any attribute or call on them gives another dummy.
+"""
+
+import os
+import tempfile
+
+class _Dummy(object):
+    def __init__(self, name="dummy"):
+        self._name = name
+
+    def __repr__(self):
+        return "<dummy %s>" % (self._name, )
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Dummy(name)
+
+    def __call__(self, *args, **kwargs):
+        return _Dummy(self._name + "()")
+
+    def keys(self):
+        return []
+
+    def __iter__(self):
+        return iter([])
+
+    def __contains__(self, key):
+        return False
+
+class Prefs(object):
+    """A prefset holding plain values."""
+
+    def __init__(self, **values):
+        self.values = values
+        self.id = "global"
+        self.prefObserverService = _Dummy("prefObserverService")
+
+    def hasPref(self, name):
+        return name in self.values
+
+    def getString(self, name, default=""):
+        return self.values.get(name, default)
+
+    def getLong(self, name, default=0):
+        return self.values.get(name, default)
+
+    def getBoolean(self, name, default=False):
+        return self.values.get(name, default)
+
+class Service(object):
+    """A service with the given attributes; others are dummies."""
+
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+    def getService(self, *args):
+        return self
+
+    def createInstance(self, *args):
+        return self
+
+    def QueryInterface(self, *args):
+        return self
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _Dummy(name)
+
+prefs = Prefs()
+services = {
+    "@activestate.com/koPrefService;1": Service(prefs=prefs),
+    "@activestate.com/koDirs;1": Service(
+        userCacheDir=tempfile.mkdtemp(prefix="go-bench-cache-")),
+    "@activestate.com/koPartService;1": Service(currentProject=None),
+    "@activestate.com/koViewService;1": Service(currentView=None),
+    "@activestate.com/koUserEnviron;1": Service(
+        GetEnvironmentStrings=lambda: ["%s=%s" % kv for kv in os.environ.items()]),
+    "@mozilla.org/file/directory_service;1": Service(
+        getFile=lambda key: [Service(path=os.path.join(tempfile.gettempdir(),
+                                                       "no-gre-dir"))]),
+    "@mozilla.org/observer-service;1": Service(
+        addObserver=lambda *args: None, notifyObservers=lambda *args: None),
+}
+
+class _Classes(dict):
+    def __getitem__(self, contract_id):
+        if contract_id not in services:
+            services[contract_id] = Service()
+        return services[contract_id]
+
+classes = _Classes()
+interfaces = _Dummy("interfaces")
+
+# There is no main thread to proxy to.
+def ProxyToMainThread(fn):
+    return fn
+
+def ProxyToMainThreadAsync(fn):
+    return fn
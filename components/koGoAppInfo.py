@@ -4,11 +4,15 @@
 
 import sys, os, re, string
 import os.path
+import time
+import threading
 from xpcom import components, ServerException, nsError
 
-import process
-import koprocessutils
 import logging
+import which
+import go_cache
+import go_env
+import go_process
 #from zope.cachedescriptors.property import LazyClassAttribute
 
 log = logging.getLogger('koGoAppInfo')
@@ -28,7 +32,178 @@ except ImportError:
         pass
 sys.path.pop()
 
-class KoGolangInfoEx(KoAppInfoEx):
+_version_pattern = re.compile("go version\s+go\s*(\d+(?:\.\d+){0,2})")
+
+def _probe_version(golangExe):
+    """Run `go version`, returning the version or raising ServerException."""
+    argv = [golangExe, "version"]
+    # Set GOROOT to point to this instance of go
+    env = go_env.get_user_env().copy()
+    env["GOROOT"] = os.path.dirname(os.path.dirname(golangExe))
+    stdout, stderr = go_process.run(argv, env=env, priority=go_process.PROBE)
+    match = _version_pattern.search(stdout)
+    if match:
+        return match.group(1)
+    else:
+        msg = "Can't find a version in `%s -v` output of '%s'/'%s'" % (golangExe, stdout, stderr)
+        raise ServerException(nsError.NS_ERROR_UNEXPECTED, msg)
+
+class _VersionCache(object):
+    """Go versions by binary, kept on disk across sessions.
+
+    An entry is only trusted while the binary's size and mtime are
+    unchanged.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = None   # path -> [mtime, size, version]
+
+    def _path(self):
+        return os.path.join(go_cache.get_cache_dir(), "versions.json")
+
+    def _stamp(self, golangExe):
+        st = os.stat(golangExe)
+        return [st.st_mtime, st.st_size]
+
+    def _load(self):
+        if self._versions is None:
+            self._versions = go_cache.read_json(self._path()) or {}
+        return self._versions
+
+    def get(self, golangExe):
+        try:
+            stamp = self._stamp(golangExe)
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._load().get(golangExe)
+        if entry is not None and entry[:2] == stamp:
+            return entry[2]
+        return None
+
+    def set(self, golangExe, version):
+        try:
+            stamp = self._stamp(golangExe)
+        except OSError:
+            return
+        with self._lock:
+            versions = self._load()
+            versions[golangExe] = stamp + [version]
+            go_cache.write_json(self._path(), versions)
+
+version_cache = _VersionCache()
+
+def get_version(golangExe):
+    """Return the version of the go binary, probing it only if needed."""
+    version = version_cache.get(golangExe)
+    if version is None:
+        version = _probe_version(golangExe)
+        version_cache.set(golangExe, version)
+    return version
+
+def _run_concurrently(func, items, name):
+    """Call func(item) for each item on its own thread, and wait."""
+    threads = [threading.Thread(target=func, args=(item, ), name=name)
+               for item in items]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    for t in threads:
+        t.join()
+
+class _ToolDiscovery(object):
+    """Finds the installed go, gocode and godef binaries concurrently.
+
+    The prefs panel asks for all three tools in a row; the first request
+    searches for all of them at once (and probes the version of each go
+    found), and the others reuse its results.
+    """
+
+    exe_names = ("go", "gocode", "godef")
+    # Seconds for which results are reused.
+    max_age = 10
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._time = 0
+        self._done = None       # threading.Event
+        self._results = {}      # exe name -> [path, ...]
+
+    def _search_path(self, exe_name, env):
+        paths = [d for d in env.get("PATH", "").split(os.pathsep) if d]
+        # Where Go and `go get` put binaries, even if they aren't on PATH.
+        if exe_name == "go":
+            if env.get("GOROOT"):
+                paths.append(os.path.join(env["GOROOT"], "bin"))
+            if sys.platform.startswith("win"):
+                paths.append("C:\\Go\\bin")
+            else:
+                paths.append("/usr/local/go/bin")
+        else:
+            gopaths = [d for d in env.get("GOPATH", "").split(os.pathsep) if d]
+            gopaths.append(os.path.join(os.path.expanduser("~"), "go"))
+            paths += [os.path.join(d, "bin") for d in gopaths]
+        return paths
+
+    def _find(self, exe_name, env):
+        exts = sys.platform.startswith("win") and [".exe"] or None
+        try:
+            found = which.whichall(exe_name, exts=exts,
+                                   path=self._search_path(exe_name, env))
+        except Exception:
+            log.exception("Unable to search for %r", exe_name)
+            found = []
+        executables = []
+        for exe in found:
+            if exe not in executables:
+                executables.append(exe)
+        if exe_name == "go":
+            def probe(exe):
+                try:
+                    get_version(exe)
+                except Exception, e:
+                    log.debug("Unable to get the version of %r: %s", exe, e)
+            _run_concurrently(probe, executables, "Go version probe")
+        self._results[exe_name] = executables
+
+    def find(self, exe_name):
+        """Return the paths of the `exe_name` binaries found."""
+        with self._lock:
+            if self._done is None or time.time() - self._time > self.max_age:
+                env = go_env.get_user_env()
+                self._time = time.time()
+                done = self._done = threading.Event()
+                def discover():
+                    try:
+                        _run_concurrently(lambda name: self._find(name, env),
+                                          self.exe_names, "Go tool discovery")
+                    finally:
+                        done.set()
+                t = threading.Thread(target=discover, name="Go tool discovery")
+                t.setDaemon(True)
+                t.start()
+            done = self._done
+        done.wait()
+        return list(self._results.get(exe_name, []))
+
+tool_discovery = _ToolDiscovery()
+
+class _GoToolInfoMixin:
+    def FindExecutables(self):
+        """The discovered binaries, with the one set in the prefs first."""
+        executables = tool_discovery.find(self.exenames[0])
+        prefs = components.classes["@activestate.com/koPrefService;1"].\
+                    getService(components.interfaces.koIPrefService).prefs
+        if prefs.hasPref(self.defaultInterpreterPrefName):
+            prefExe = prefs.getString(self.defaultInterpreterPrefName, "")
+            if prefExe and os.path.exists(prefExe):
+                if prefExe in executables:
+                    executables.remove(prefExe)
+                executables.insert(0, prefExe)
+        return executables
+
+class KoGolangInfoEx(_GoToolInfoMixin, KoAppInfoEx):
     _reg_clsid_ = "{9ef3a4c9-1834-4040-9c30-9481704ab967}"
     _reg_contractid_ = "@activestate.com/koAppInfoEx?app=Go;1"
     _reg_desc_ = "Go Information"
@@ -40,22 +215,9 @@ class KoGolangInfoEx(KoAppInfoEx):
     def getVersionForBinary(self, golangExe):
         if not os.path.exists(golangExe):
             raise ServerException(nsError.NS_ERROR_FILE_NOT_FOUND)
-        argv = [golangExe, "version"]
-        # Set GOROOT to point to this instance of go
-        env = koprocessutils.getUserEnv()
-        goRoot = env.get("GOROOT", None)
-        env["GOROOT"] = os.path.dirname(os.path.dirname(golangExe))
-        p = process.ProcessOpen(argv, stdin=None, env=env)
-        stdout, stderr = p.communicate()
-        pattern = re.compile("go version\s+go\s*(\d+(?:\.\d+){0,2})")
-        match = pattern.search(stdout)
-        if match:
-            return match.group(1)
-        else:
-            msg = "Can't find a version in `%s -v` output of '%s'/'%s'" % (golangExe, stdout, stderr)
-            raise ServerException(nsError.NS_ERROR_UNEXPECTED, msg)
+        return get_version(golangExe)
 
-class KoGocodeInfoEx(KoAppInfoEx):
+class KoGocodeInfoEx(_GoToolInfoMixin, KoAppInfoEx):
     _reg_clsid_ = "{b73ce971-799d-456f-8ed0-eab3377f20d5}"
     _reg_contractid_ = "@activestate.com/koAppInfoEx?app=Gocode;1"
     _reg_desc_ = "Gocode Information"
@@ -64,9 +226,9 @@ class KoGocodeInfoEx(KoAppInfoEx):
     defaultInterpreterPrefName = "gocodeDefaultLocation"
 
     def FindInstallationPaths(self):
-        return self._locateExecutables('godef', 'godefDefaultLocation')
-    
-class KoGodefInfoEx(KoAppInfoEx):
+        return self.FindExecutables()
+
+class KoGodefInfoEx(_GoToolInfoMixin, KoAppInfoEx):
     _reg_clsid_ = "{a6f9a47e-d3dc-404a-bc1b-b6918e2f1f09}"
     _reg_contractid_ = "@activestate.com/koAppInfoEx?app=Godef;1"
     _reg_desc_ = "Godef Information"
@@ -75,5 +237,5 @@ class KoGodefInfoEx(KoAppInfoEx):
     defaultInterpreterPrefName = "godefDefaultLocation"
 
     def FindInstallationPaths(self):
-        return self._locateExecutables('godef', 'godefDefaultLocation')
+        return self.FindExecutables()
     
@@ -4,19 +4,29 @@
 
 """Go-specific Language Services implementations."""
 
-import tempfile
 import logging
 import os
 from os.path import exists
-import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
 
-import koprocessutils
-import process
-from xpcom import components, ServerException
+from xpcom import components, ServerException, nsError
 from langinfo_go import GoLangInfo
+import go_build
+import go_env
+import go_format
+import go_largefile
+import go_lint
+import go_process
+import go_stats
+import go_syntax
+import go_vet
+import go_warmup
 from koLanguageServiceBase import KoLanguageBase, KoLexerLanguageService, \
                                   FastCharData, KoLanguageBaseDedentMixin
-from koLintResult import KoLintResult, SEV_ERROR
+from koLintResult import KoLintResult, SEV_ERROR, SEV_WARNING
 from koLintResults import koLintResults
 
 log = logging.getLogger('koGoLanguage')
@@ -24,6 +34,24 @@ log = logging.getLogger('koGoLanguage')
 
 sci_constants = components.interfaces.ISciMoz
 
+class KoGoLexerLanguageService(KoLexerLanguageService):
+    """The Go lexer; large buffers are not folded by syntax.
+
+    Whether a view is folded by syntax is decided from the buffer's size
+    when the lexer is set on the view.  When an edit takes the buffer in or
+    out of large-file mode, the linter has content/golang.js change it.
+    """
+
+    def setCurrent(self, scimoz):
+        KoLexerLanguageService.setCurrent(self, scimoz)
+        try:
+            large = go_largefile.is_large_size(scimoz.length, scimoz.lineCount)
+        except Exception:
+            return
+        if large:
+            log.debug("large-file mode: syntax-based folding disabled")
+            scimoz.setProperty('fold.cpp.syntax.based', '0')
+
 class koGoLanguage(KoLanguageBase, KoLanguageBaseDedentMixin):
     name = "Go"
     _reg_desc_ = "%s Language" % name
@@ -83,6 +111,7 @@ on these two lines */
             _variable_styles = [components.interfaces.ISciMoz.SCE_C_IDENTIFIER]
             )
         self._setupIndentCheckSoftChar()
+        go_largefile.watch_prefs()
         self._fastCharData = \
             FastCharData(trigger_char=";",
                          style_list=(sci_constants.SCE_C_OPERATOR,),
@@ -111,7 +140,7 @@ on these two lines */
 
     def get_lexer(self):
         if self._lexer is None:
-            self._lexer = KoLexerLanguageService()
+            self._lexer = KoGoLexerLanguageService()
             self._lexer.setLexer(components.interfaces.ISciMoz.SCLEX_CPP)
             self._lexer.supportsFolding = 1
             self._lexer.setProperty('lexer.cpp.allow.dollars', '0')
@@ -127,6 +156,18 @@ on these two lines */
             self._lexer.setKeywords(1, other_words)
         return self._lexer
 
+def get_fmt_cmd_start(goLocation):
+    """Return the gofmt command next to the go tool, or None."""
+    if not goLocation:
+        return None
+    if goLocation.lower().endswith(".exe"):
+        go_format_tool_path = goLocation[0:-4] + "fmt.exe"
+    else:
+        go_format_tool_path = goLocation + "fmt"
+    if exists(go_format_tool_path):
+        return [go_format_tool_path, '-e']
+    return None
+
 class KoGolangLinter(object):
     _com_interfaces_ = [components.interfaces.koILinter,
                         components.interfaces.nsIObserver]
@@ -135,6 +176,15 @@ class KoGolangLinter(object):
     _reg_categories_ = [
          ("category-komodo-linter", 'Go'),
          ]
+
+    # Maximum number of buffers whose lint results are remembered.
+    _lint_cache_size = 64
+    # Buffers up to this size (in bytes) are linted with the in-process
+    # syntax check (about 0.2ms a KB); larger ones are linted by gofmt.
+    _syntax_check_max_size = 256 * 1024
+    # Seconds a buffer the syntax check passes must go unedited before
+    # gofmt confirms it.
+    _confirm_delay = 1.0
     
     def __init__(self):
         self.golangInfoEx = components.classes["@activestate.com/koAppInfoEx?app=Go;1"].\
@@ -143,6 +193,14 @@ class KoGolangLinter(object):
             getService(components.interfaces.koIPrefService)
         self._prefs = self.prefService.prefs
         self._update_go_tools(self.golangInfoEx.executablePath)
+        go_stats.register_observer()
+        # Content hash + gofmt path -> problems found, least recent first.
+        self._lint_cache = OrderedDict()
+        self._lint_lock = threading.Lock()
+        # Document key -> the Timer of its pending gofmt confirmation.
+        self._confirm_timers = {}
+        # The display paths of the documents last linted in large-file mode.
+        self._large_docs = set()
         
         try:
             self._prefs.prefObserverService.addObserver(self, "golangDefaultLocation", 0)
@@ -152,79 +210,426 @@ class KoGolangLinter(object):
     def observe(self, subject, topic, data):
         if topic == "golangDefaultLocation":
             self._update_go_tools(self._prefs.getString("golangDefaultLocation"))
+        elif topic == "golang_scan_project":
+            # Sent by the "Check Go Files in Project" command, with the
+            # directories to scan one a line; see content/golang.js.
+            roots = [root for root in (data or "").split("\n") if root]
+            t = threading.Thread(target=self._scan_and_notify, args=(roots, ),
+                                 name="Go project scan")
+            t.setDaemon(True)
+            t.start()
 
     def _update_go_tools(self, goLocation):
-        self._fmt_cmd_start = None
-        #self._vet_cmd_start = None
-        if goLocation:
-            if goLocation.lower().endswith(".exe"):
-                go_format_tool_path = goLocation[0:-4] + "fmt.exe"
-            else:
-                go_format_tool_path = goLocation + "fmt"
-            if exists(go_format_tool_path):
-                self._fmt_cmd_start = [go_format_tool_path, '-e']
-            #if exists(goLocation):
-            #    self._vet_cmd_start = [goLocation, 'vet']
+        self._fmt_cmd_start = get_fmt_cmd_start(goLocation)
+        self._go_exe = None
+        if goLocation and exists(goLocation):
+            self._go_exe = goLocation
     
     def lint(self, request):
-        if self._fmt_cmd_start is None:
-            return
         text = request.content.encode(request.encoding.python_encoding_name)
-        return self.lint_with_text(request, text)
+        self._warm_up(request, text)
+        large = go_largefile.is_large(text)
+        self._update_large_mode(request, large)
+        # Large buffers are only linted once saved.
+        if large and self._is_dirty(request):
+            log.debug("large-file mode: not linting unsaved changes")
+            return
+        results = self.lint_with_text(request, text)
+        # go vet needs code that parses; don't bother until it does.
+        if results is not None and not results.getNumResults():
+            self._add_vet_results(request, text, results)
+        if results is not None:
+            self._add_build_results(request, text, results)
+        return results
+
+    def _add_vet_results(self, request, text, results):
+        """Add the results of the background go vet tier to `results`.
+
+        Vet runs per package on a worker thread.  When it finishes, the
+        package's open files are linted again (see content/golang.js), and
+        the results are added then.
+        """
+        if self._go_exe is None or \
+           not self._prefs.getBoolean("golangLintVet", True):
+            return
+        try:
+            koFile = request.koDoc.file
+            path = koFile and koFile.isLocal and koFile.path
+        except Exception:
+            path = None
+        if not path or not exists(path):
+            return
+        build_check = self._prefs.getBoolean("golangLintBuildCheck", False)
+        go_vet.vet_runner.request(os.path.dirname(path), self._go_exe,
+                                  self._get_env(), build_check)
+        problems = go_vet.vet_runner.get_problems(path, text, build_check)
+        for desc, lineNo, columnStart, columnEnd in problems or []:
+            result = KoLintResult(description=desc,
+                                   severity=SEV_WARNING,
+                                   lineStart=lineNo,
+                                   lineEnd=lineNo,
+                                   columnStart=columnStart,
+                                   columnEnd=columnEnd)
+            results.addResult(result)
         
-    _ptn_err = re.compile(r'^(.*?):(\d+):(\d+):\s*(.*)')
-    _problem_token = re.compile(r"found\s+'.*?'\s+((?:\".*?\")|\S+)")
+    def _add_build_results(self, request, text, results):
+        """Add the problems found by the latest `go build` or `go test` to
+        `results`.
+
+        With the golangBuildOnSave pref set to "build" or "test", saving a
+        Go file starts a build of the packages of the files saved since the
+        last one.  Its problems are streamed in as it runs, and each one
+        has the open file it was found in linted again (see
+        content/golang.js), which adds it here.
+        """
+        kind = self._prefs.getString("golangBuildOnSave", "")
+        if self._go_exe is None or kind not in (go_build.BUILD, go_build.TEST):
+            return
+        try:
+            koFile = request.koDoc.file
+            path = koFile and koFile.isLocal and koFile.path
+        except Exception:
+            path = None
+        if not path or not exists(path):
+            return
+        if not self._is_dirty(request):
+            go_build.build_runner.note_saved(path)
+            go_build.build_runner.build_edited(kind, self._go_exe,
+                                               self._get_env())
+        problems = go_build.build_runner.get_problems(path, text)
+        for desc, lineNo, columnStart, columnEnd in problems or []:
+            result = KoLintResult(description=desc,
+                                   severity=SEV_ERROR,
+                                   lineStart=lineNo,
+                                   lineEnd=lineNo,
+                                   columnStart=columnStart,
+                                   columnEnd=columnEnd)
+            results.addResult(result)
+
+    def _get_env(self):
+        return go_env.get_user_env()
+
+    def _warm_up(self, request, text):
+        """Warm up the Go tools the first time a file is linted."""
+        try:
+            koFile = request.koDoc.file
+            path = koFile and koFile.isLocal and koFile.path
+        except Exception:
+            return
+        if path:
+            go_warmup.warm_up.request(path, text)
+
+    def _is_dirty(self, request):
+        try:
+            return request.koDoc.isDirty
+        except Exception:
+            return False
+
+    def _update_large_mode(self, request, large):
+        """Have the folding of the document's views follow it in or out of
+        large-file mode (see content/golang.js)."""
+        try:
+            display_path = request.koDoc.displayPath
+        except Exception:
+            return
+        with self._lint_lock:
+            if large == (display_path in self._large_docs):
+                return
+            if large:
+                self._large_docs.add(display_path)
+            else:
+                self._large_docs.discard(display_path)
+        log.debug("large-file mode %s for %r", large and "on" or "off",
+                  display_path)
+        _notify("golang_large_file", json.dumps({"path": display_path,
+                                                 "large": large}))
+
+    def _doc_key(self, request):
+        """Return the key identifying the document being linted."""
+        uid = getattr(request, "uid", None)
+        if uid:
+            return uid
+        try:
+            return request.koDoc.displayPath
+        except Exception:
+            return None
+
+    def _make_results(self, problems):
+        results = koLintResults()
+        for desc, lineNo, columnStart, columnEnd in problems:
+            result = KoLintResult(description=desc,
+                                   severity=SEV_ERROR,
+                                   lineStart=lineNo,
+                                   lineEnd=lineNo,
+                                   columnStart=columnStart,
+                                   columnEnd=columnEnd)
+            results.addResult(result)
+        return results
+
+    _ptn_err = go_lint.ptn_err
+    _problem_token = go_lint.problem_token
+    _stdin_name = "<standard input>"
+    def _parse_problem(self, line):
+        """Parse one of gofmt's diagnostics.
+
+        Returns a (description, line, columnStart, columnEnd) tuple, or
+        None if `line` isn't a diagnostic of the buffer.
+        """
+        parsed = go_lint.parse_error_line(line)
+        if parsed and parsed[0] == self._stdin_name:
+            return parsed[1]
+        return None
+
+    def _check_syntax(self, text):
+        with go_stats.parse_timer("go_syntax"):
+            return go_syntax.check(text)
+
     def lint_with_text(self, request, text):
+        # Without gofmt, the in-process syntax check is all there is.
         if self._fmt_cmd_start is None:
-            return
+            return self._make_results(self._check_syntax(text))
+        # Identical buffers (e.g. after an undo, or re-linting an unchanged
+        # file) give identical results.
+        cache_key = (hashlib.sha1(text).hexdigest(), self._fmt_cmd_start[0])
+        with self._lint_lock:
+            problems = self._lint_cache.pop(cache_key, None)
+            if problems is not None:
+                self._lint_cache[cache_key] = problems
+        if problems is not None:
+            return self._make_results(problems)
+
         cwd = request.cwd or None
-        results = koLintResults()
-        tmpfilename = tempfile.mktemp() + ".go"
-        fout = open(tmpfilename, 'wb')
-        fout.write(text)
-        fout.close()
-        cmd = self._fmt_cmd_start + [tmpfilename]
-        env = koprocessutils.getUserEnv()
-        bad_keys = []
-        for k, v in env.items():
-            if not isinstance(v, (str, unicode)):
-                bad_keys.append(k)
-        for k in bad_keys:
-            del env[k]
+        doc_key = self._doc_key(request)
+        # Edits are linted in-process, without running gofmt.  gofmt has the
+        # final say on the buffers the syntax check passes, but only once
+        # the buffer has been left alone for a moment; its result is cached,
+        # and the document linted again if it finds anything.
+        if len(text) <= self._syntax_check_max_size:
+            problems = self._check_syntax(text)
+            if problems:
+                self._cancel_confirmation(doc_key)
+            else:
+                self._schedule_confirmation(request, doc_key, text,
+                                            cache_key, cwd)
+            return self._make_results(problems)
+
         try:
-            p = process.ProcessOpen(cmd, cwd=cwd, env=env, stdin=None)
-            stdout, stderr = p.communicate()
-            if not stderr:
-                return results
+            problems = self._run_gofmt(text, cwd, doc_key)
+        except go_process.ToolCancelled:
+            log.debug("dropping superseded lint of %r", doc_key)
+            return None
         except:
-            log.exception("Failed to run %s, cwd %r", cmd, cwd)
-            return results
-        finally:
-            os.unlink(tmpfilename)
-        errLines = stderr.splitlines(0) # Don't need the newlines.
-        textLines = text.splitlines(0)
-        for line in errLines:
-            m = self._ptn_err.match(line)
-            if m:
-                fname = m.group(1)
-                if tmpfilename not in fname:
-                    continue
-                lineNo = int(m.group(2))
-                columnStart = int(m.group(3))
-                desc = m.group(4)
-                m1 = self._problem_token.search(desc)
-                if m1:
-                    columnEnd = columnStart + len(m1.group(1))
-                else:
-                    columnEnd = columnStart + 1
-                result = KoLintResult(description=desc,
-                                       severity=SEV_ERROR,
-                                       lineStart=lineNo,
-                                       lineEnd=lineNo,
-                                       columnStart=columnStart,
-                                       columnEnd=columnEnd)
-                results.addResult(result)
-        return results
+            log.exception("Failed to run gofmt, cwd %r", cwd)
+            return koLintResults()
+        self._cache_problems(cache_key, problems)
+        with go_stats.parse_timer(go_stats.tool_name(self._fmt_cmd_start)):
+            return self._make_results(problems)
+
+    def _run_gofmt(self, text, cwd, doc_key):
+        """Return the problems gofmt finds in `text`.
+
+        Raises go_process.ToolCancelled if a newer lint of the document
+        superseded this one.
+        """
+        # gofmt reads the buffer from stdin (no temp file) and, with -l, only
+        # names the input on stdout rather than echoing it back.
+        cmd = self._fmt_cmd_start + ['-l']
+        # Diagnostics are parsed as gofmt writes them, while it runs.
+        problems = []
+        def on_line(line, stream):
+            if stream == "stderr":
+                problem = self._parse_problem(line)
+                if problem is not None:
+                    problems.append(problem)
+        # Only the newest lint of a document is worth finishing: a newer
+        # request cancels (or kills the gofmt run of) the one it supersedes.
+        go_process.runner.submit(
+            go_process.ToolRequest(cmd, input=text, cwd=cwd,
+                                   env=self._get_env(),
+                                   slot=("lint", doc_key),
+                                   priority=go_process.LINT,
+                                   on_line=on_line)).wait()
+        return problems
+
+    def _cache_problems(self, cache_key, problems):
+        with self._lint_lock:
+            self._lint_cache[cache_key] = problems
+            while len(self._lint_cache) > self._lint_cache_size:
+                self._lint_cache.popitem(last=False)
+
+    def _schedule_confirmation(self, request, doc_key, text, cache_key, cwd):
+        """Have gofmt check `text` once the document has gone unedited for
+        _confirm_delay seconds."""
+        try:
+            display_path = request.koDoc.displayPath
+        except Exception:
+            display_path = None
+        timer = threading.Timer(self._confirm_delay, self._confirm,
+                                (doc_key, display_path, text, cache_key, cwd))
+        timer.setDaemon(True)
+        with self._lint_lock:
+            previous = self._confirm_timers.get(doc_key)
+            self._confirm_timers[doc_key] = timer
+        if previous is not None:
+            previous.cancel()
+        timer.start()
+
+    def _cancel_confirmation(self, doc_key):
+        with self._lint_lock:
+            timer = self._confirm_timers.pop(doc_key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _confirm(self, doc_key, display_path, text, cache_key, cwd):
+        with self._lint_lock:
+            if self._confirm_timers.get(doc_key) is not threading.currentThread():
+                return      # the document was edited since
+            del self._confirm_timers[doc_key]
+        try:
+            problems = self._run_gofmt(text, cwd, doc_key)
+        except go_process.ToolCancelled:
+            return
+        except Exception:
+            log.exception("Failed to confirm the lint of %r with gofmt", doc_key)
+            return
+        self._cache_problems(cache_key, problems)
+        if problems and display_path:
+            # Have the document linted again, which finds these in the cache;
+            # see content/golang.js.
+            _notify("golang_lint_results", display_path)
+
+    def build_packages(self, paths, test=False, callback=None):
+        """Run `go build` (or `go test`) over the packages of the Go files
+        `paths`, cancelling any build in flight.
+
+        `callback(path, results)`, if given, is called from a worker thread
+        with the koLintResults of a file's problems so far each time a new
+        one is found. Returns the go_build.Build, or None if there is no go
+        tool.
+        """
+        if self._go_exe is None:
+            return None
+        def on_problem(build, path, problem):
+            callback(path, self._make_results(build.problems[path]))
+        return go_build.build_runner.start(
+            test and go_build.TEST or go_build.BUILD, paths, self._go_exe,
+            self._get_env(), callback and on_problem)
+
+    def scan_project(self, roots, callback=None):
+        """Syntax check all the Go files below the directories `roots`.
+
+        Only files changed since the last scan of these roots are run
+        through gofmt. `callback(results)` is called with a dict mapping
+        paths to koLintResults for the unchanged files and then for each
+        batch of files checked, as they become available (possibly from
+        worker threads). Returns a dict mapping paths to koLintResults.
+        """
+        if self._fmt_cmd_start is None:
+            return {}
+        scanner = go_lint.ProjectLintScanner(self._fmt_cmd_start,
+                                             go_lint.get_scan_cache_path(roots),
+                                             env=self._get_env())
+        def on_results(problems_by_path):
+            callback(dict((path, self._make_results(problems))
+                          for path, problems in problems_by_path.iteritems()))
+        problems_by_path = scanner.scan(roots, callback and on_results)
+        return dict((path, self._make_results(problems))
+                    for path, problems in problems_by_path.iteritems())
+
+    def _scan_and_notify(self, roots):
+        """Scan `roots`, notifying "golang_scan_results" as each batch of
+        files is checked, then "golang_scan_done".
+
+        The batch's data is JSON: the number of files in it and, for each
+        file with problems, a [line, column, description] list of them.
+        The final summary has the roots, the number of files checked and
+        the number of problems found in each file that has any.
+        """
+        def on_batch(results):
+            problems = {}
+            for path, file_results in results.iteritems():
+                problems_found = [[r.lineStart, r.columnStart, r.description]
+                                  for r in file_results.getResults()]
+                if problems_found:
+                    problems[path] = problems_found
+            _notify("golang_scan_results", json.dumps({"files": len(results),
+                                                       "problems": problems}))
+        try:
+            results = self.scan_project(roots, on_batch)
+        except Exception:
+            log.exception("Error scanning %r", roots)
+            results = {}
+        problems = {}
+        for path, file_results in results.iteritems():
+            num_results = file_results.getNumResults()
+            if num_results:
+                problems[path] = num_results
+        _notify("golang_scan_done", json.dumps({"roots": roots,
+                                                "files": len(results),
+                                                "problems": problems}))
+
+@components.ProxyToMainThreadAsync
+def _notify(topic, data):
+    try:
+        obsSvc = components.classes["@mozilla.org/observer-service;1"].\
+                    getService(components.interfaces.nsIObserverService)
+        obsSvc.notifyObservers(None, topic, data)
+    except Exception, e:
+        log.debug("Unable to notify %s: %s", topic, e)
+
+class KoGolangFormatter(object):
+    """Formats Go code with gofmt.
+
+    When a whole buffer is formatted, only the lines gofmt changes are
+    replaced in the editor (see go_format), keeping the undo history,
+    markers and folds of the rest.
+    """
+    _com_interfaces_ = [components.interfaces.koIFormatter]
+    _reg_clsid_ = "{b642824d-4bbf-4963-8264-f5dc1e1266b9}"
+    _reg_contractid_ = "@activestate.com/koFormatter?name=gofmt;1"
+    _reg_desc_ = "gofmt Go formatter"
+    _reg_categories_ = [
+         ("category-komodo-formatter", 'gofmt'),
+         ]
+
+    name = "gofmt"
+    prettyName = "gofmt"
+    supported_languages = ["Go"]
+
+    def __init__(self):
+        self.golangInfoEx = components.classes["@activestate.com/koAppInfoEx?app=Go;1"].\
+                    getService(components.interfaces.koIAppInfoEx)
+
+    def getSupportedLanguages(self):
+        return self.supported_languages
+
+    def supportsLanguage(self, lang):
+        return lang in self.supported_languages
+
+    def format(self, context):
+        fmt_cmd_start = get_fmt_cmd_start(self.golangInfoEx.executablePath)
+        if fmt_cmd_start is None:
+            raise ServerException(nsError.NS_ERROR_FAILURE,
+                                  "gofmt was not found next to the go tool")
+        try:
+            scimoz = context.scimoz
+        except Exception:
+            scimoz = None
+        env = go_env.get_user_env()
+        try:
+            if scimoz is not None and scimoz.text == context.text:
+                # The changed hunks are the only edit: context.text is left
+                # as it was, so the caller sees nothing left to replace (a
+                # whole-buffer replace would undo what the hunks keep).
+                go_format.format_scimoz(scimoz, fmt_cmd_start, env)
+            else:
+                formatted = go_format.run_gofmt(fmt_cmd_start,
+                                                context.text.encode("utf-8"),
+                                                env)
+                context.text = formatted.decode("utf-8")
+        except go_format.FormatError, e:
+            raise ServerException(nsError.NS_ERROR_FAILURE,
+                                  "gofmt: %s" % (e, ))
 
 # Komodo 8 and earlier registration call:
 def registerLanguage(registry):
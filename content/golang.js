@@ -0,0 +1,212 @@
+/* Copyright (c) 2000-2014 ActiveState Software Inc.
+   See the file LICENSE.txt for licensing information. */
+
+// The Go linter's background tiers (gofmt's confirmation of the in-process
+// syntax check, go vet and builds, see components/koGoLanguage.py,
+// pylib/go_vet.py and pylib/go_build.py) finish after the lint that started
+// them has been reported.  When they do, they notify an observer topic, and
+// the open Go files they have results for are linted again here so that the
+// results are shown straight away.
+//
+// When an edit takes a document in or out of large-file mode, the linter
+// notifies that here, and its views' folding by syntax is switched.
+//
+// The "Check Go Files in Project" command has the linter syntax check all
+// the Go files of the current project (see scan_project in
+// components/koGoLanguage.py), and reports its progress and the problems
+// found as each batch of files is checked.  "Write Go Tool Statistics" has
+// the tools' latency statistics written out.
+
+if (typeof(ko.golang) == 'undefined') {
+    ko.golang = {};
+}
+
+(function() {
+
+var log = ko.logging.getLogger("golang");
+var _obsSvc = Components.classes["@mozilla.org/observer-service;1"]
+              .getService(Components.interfaces.nsIObserverService);
+// The topics, and the data they are notified with.
+var _topics = [
+    "golang_lint_results",      // the display path of the document gofmt
+                                // found problems in
+    "golang_vet_results",       // the directory of the package vetted
+    "golang_build_results",     // the file a problem was found in
+    "golang_build_done",        // the package directories built, one a line
+    "golang_scan_results",      // JSON: the problems of a batch of files
+                                // checked by the project scan
+    "golang_scan_done",         // a JSON summary of the project scan
+    "golang_large_file",        // JSON: the display path of a document
+                                // that entered or left large-file mode
+];
+
+/**
+ * Lint the open Go documents for which `matches(koDoc)` is true again.
+ */
+this.relint = function golang_relint(matches) {
+    var views = ko.views.manager.getAllViews();
+    for (var i = 0; i < views.length; i++) {
+        var view = views[i];
+        var koDoc = view.koDoc;
+        if (!koDoc || koDoc.language != "Go" || !view.lintBuffer) {
+            continue;
+        }
+        if (matches(koDoc)) {
+            view.lintBuffer.request("golang results");
+        }
+    }
+};
+
+/**
+ * Return a relint() test of the local file of a document.
+ */
+function _fileMatches(matches) {
+    return function(koDoc) {
+        var koFile = koDoc.file;
+        return koFile && koFile.isLocal && matches(koFile);
+    };
+}
+
+/**
+ * Syntax check the Go files of the current project (or, without one, of
+ * the current file's directory) in the background.
+ */
+this.scanProject = function golang_scanProject() {
+    var root = null;
+    var project = ko.projects.manager.currentProject;
+    if (project) {
+        root = project.liveDirectory;
+    } else {
+        var view = ko.views.manager.currentView;
+        if (view && view.koDoc && view.koDoc.file && view.koDoc.file.isLocal) {
+            root = view.koDoc.file.dirName;
+        }
+    }
+    if (!root) {
+        ko.statusBar.AddMessage("No project to check the Go files of",
+                                "golang", 5000, true);
+        return;
+    }
+    _scanProgress = {files: 0, problems: 0};
+    ko.statusBar.AddMessage("Checking the Go files in " + root + "...",
+                            "golang", 0, false);
+    // The linter runs the scan on its own thread.
+    Components.classes["@activestate.com/koLinter?language=Go;1"]
+              .getService(Components.interfaces.nsIObserver)
+              .observe(null, "golang_scan_project", root);
+};
+
+/**
+ * Write the latency statistics of the Go tools run (see pylib/go_stats.py)
+ * to tool-stats.json in the extension's cache directory, and to the log.
+ */
+this.writeToolStats = function golang_writeToolStats() {
+    // The linter registers the statistics observer.
+    Components.classes["@activestate.com/koLinter?language=Go;1"]
+              .getService(Components.interfaces.nsIObserver);
+    _obsSvc.notifyObservers(null, "golang_tool_stats", "");
+    ko.statusBar.AddMessage("Go tool statistics written to " +
+                            "tool-stats.json and the log",
+                            "golang", 5000, false);
+};
+
+/**
+ * Fold the views of a document by syntax, unless it is large (see
+ * pylib/go_largefile.py).  Changing the property has the lexer refold.
+ */
+function _setSyntaxFolding(displayPath, large) {
+    var views = ko.views.manager.getAllViews();
+    for (var i = 0; i < views.length; i++) {
+        var view = views[i];
+        if (view.koDoc && view.koDoc.displayPath == displayPath &&
+            view.scimoz) {
+            view.scimoz.setProperty("fold.cpp.syntax.based",
+                                    large ? "0" : "1");
+        }
+    }
+}
+
+// The number of files checked and problems found so far by the scan.
+var _scanProgress = {files: 0, problems: 0};
+
+function _reportScanBatch(batch) {
+    _scanProgress.files += batch.files;
+    for (var path in batch.problems) {
+        var problems = batch.problems[path];
+        _scanProgress.problems += problems.length;
+        for (var i = 0; i < problems.length; i++) {
+            // [line, column, description]
+            log.info(path + ":" + problems[i][0] + ":" + problems[i][1] +
+                     ": " + problems[i][2]);
+        }
+    }
+    ko.statusBar.AddMessage("Checking Go files: " + _scanProgress.files +
+                            " checked, " + _scanProgress.problems +
+                            " problem(s) so far...", "golang", 0, false);
+}
+
+function _reportScan(summary) {
+    var numProblems = 0;
+    var numFiles = 0;
+    for (var path in summary.problems) {
+        numProblems += summary.problems[path];
+        numFiles += 1;
+    }
+    var msg;
+    if (numProblems) {
+        msg = ("Checked " + summary.files + " Go files: " + numProblems +
+               " problem(s) in " + numFiles + " file(s)");
+    } else {
+        msg = "Checked " + summary.files + " Go files: no problems found";
+    }
+    ko.statusBar.AddMessage(msg, "golang", 10000, numProblems > 0);
+}
+
+var _observer = {
+    observe: function(subject, topic, data) {
+        try {
+            if (topic == "golang_lint_results") {
+                ko.golang.relint(function(koDoc) {
+                    return koDoc.displayPath == data;
+                });
+            } else if (topic == "golang_vet_results") {
+                ko.golang.relint(_fileMatches(function(koFile) {
+                    return koFile.dirName == data;
+                }));
+            } else if (topic == "golang_build_results") {
+                ko.golang.relint(_fileMatches(function(koFile) {
+                    return koFile.path == data;
+                }));
+            } else if (topic == "golang_build_done") {
+                // Clear the problems of the previous build.
+                var pkgDirs = data.split("\n");
+                ko.golang.relint(_fileMatches(function(koFile) {
+                    return pkgDirs.indexOf(koFile.dirName) >= 0;
+                }));
+            } else if (topic == "golang_scan_results") {
+                _reportScanBatch(JSON.parse(data));
+            } else if (topic == "golang_scan_done") {
+                _reportScan(JSON.parse(data));
+            } else if (topic == "golang_large_file") {
+                var state = JSON.parse(data);
+                _setSyntaxFolding(state.path, state.large);
+            }
+        } catch (ex) {
+            log.exception(ex, "Error handling " + topic);
+        }
+    }
+};
+
+window.addEventListener("load", function() {
+    for (var i = 0; i < _topics.length; i++) {
+        _obsSvc.addObserver(_observer, _topics[i], false);
+    }
+}, false);
+
+window.addEventListener("unload", function() {
+    for (var i = 0; i < _topics.length; i++) {
+        _obsSvc.removeObserver(_observer, _topics[i]);
+    }
+}, false);
+
+}).apply(ko.golang);
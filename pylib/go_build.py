@@ -0,0 +1,270 @@
+
+"""Building and testing the Go packages affected by edits.
+
+`go build` (or `go test`) is only run for the packages of the files saved
+since the last build; the go build cache makes rebuilding the packages they
+depend on cheap.  The tool's output is read a line at a time as it is
+written, and each compiler error or test failure is parsed (as gofmt's
+diagnostics are, see go_lint) into a problem for its file straight away,
+so problems show up while the build is still running.  Starting a build
+cancels, and kills, the one in flight.
+
+Problems are (description, line, columnStart, columnEnd) tuples.  They are
+only reported for a file while its text is the one that was built.
+"""
+
+import os
+import re
+import hashlib
+import threading
+import logging
+
+import go_lint
+import go_process
+from xpcom import components
+
+log = logging.getLogger("koGoLanguage.build")
+
+BUILD = "build"
+TEST = "test"
+
+# A failed test's message: "    file_test.go:12: message".
+_ptn_test_failure = re.compile(r'^\s+(\S+?\.go):(\d+):\s*(.*)')
+
+def affected_packages(paths):
+    """Return the sorted directories of the packages of the Go files
+    `paths`."""
+    return sorted(set(os.path.dirname(os.path.abspath(path))
+                      for path in paths if path.endswith(".go")))
+
+def _hash_sources(pkg_dirs):
+    """Return {path: content sha1} for the Go files of pkg_dirs."""
+    hashes = {}
+    for pkg_dir in pkg_dirs:
+        try:
+            names = os.listdir(pkg_dir)
+        except OSError:
+            continue
+        for name in names:
+            if not name.endswith(".go"):
+                continue
+            path = os.path.join(pkg_dir, name)
+            try:
+                with open(path, "rb") as fin:
+                    hashes[path] = hashlib.sha1(fin.read()).hexdigest()
+            except IOError:
+                continue
+    return hashes
+
+def build_command(go_exe, kind, pkg_dirs):
+    """Return the (command, cwd) building or testing pkg_dirs."""
+    if len(pkg_dirs) == 1:
+        cwd = pkg_dirs[0]
+    else:
+        cwd = os.path.dirname(os.path.commonprefix(
+            [pkg_dir + os.sep for pkg_dir in pkg_dirs]))
+    packages = []
+    for pkg_dir in pkg_dirs:
+        rel = os.path.relpath(pkg_dir, cwd)
+        packages.append(rel == os.curdir and "." or
+                        "./" + rel.replace(os.sep, "/"))
+    cmd = [go_exe, kind]
+    if kind == BUILD and len(packages) == 1:
+        # Building a single main package would write out its binary.
+        cmd += ["-o", os.devnull]
+    return cmd + packages, cwd
+
+class Build(object):
+    """One run of `go build` or `go test` over some packages."""
+
+    def __init__(self, kind, pkg_dirs, go_exe, env, on_problem=None,
+                 on_done=None):
+        self.kind = kind
+        self.pkg_dirs = pkg_dirs
+        self.cmd, self.cwd = build_command(go_exe, kind, pkg_dirs)
+        self.env = env
+        self.on_problem = on_problem
+        self.on_done = on_done
+        self.file_hashes = {}
+        self.problems = {}      # path -> [problem, ...]
+        self.output = []
+        self.returncode = None
+        self.cancelled = False
+        self.finished = threading.Event()
+        self._request = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<Build %r in %r>" % (self.cmd, self.cwd)
+
+    @property
+    def succeeded(self):
+        return self.finished.isSet() and not self.cancelled and \
+               self.returncode == 0
+
+    def _resolve(self, name, test_failure):
+        if os.path.isabs(name):
+            return os.path.normpath(name)
+        if test_failure:
+            # Tests report the base name of the file, within its package.
+            for pkg_dir in self.pkg_dirs:
+                path = os.path.join(pkg_dir, name)
+                if path in self.file_hashes:
+                    return path
+        return os.path.normpath(os.path.join(self.cwd, name))
+
+    def _parse_line(self, line):
+        """Return the (path, problem) reported by an output line, or None."""
+        parsed = go_lint.parse_error_line(line.strip())
+        if parsed is not None:
+            return self._resolve(parsed[0], False), parsed[1]
+        m = _ptn_test_failure.match(line)
+        if m is not None:
+            lineNo = int(m.group(2))
+            return self._resolve(m.group(1), True), (m.group(3), lineNo, 1, 2)
+        return None
+
+    def _on_line(self, line, stream):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.output.append(line)
+        parsed = self._parse_line(line)
+        if parsed is None:
+            return
+        path, problem = parsed
+        with self._lock:
+            problems = self.problems.setdefault(path, [])
+            if problem in problems:
+                return
+            problems.append(problem)
+        if self.on_problem is not None:
+            try:
+                self.on_problem(self, path, problem)
+            except Exception:
+                log.exception("Error reporting a problem of %r", self)
+
+    def run(self):
+        self.file_hashes = _hash_sources(self.pkg_dirs)
+        try:
+            with self._lock:
+                if self.cancelled:
+                    return
+                self._request = go_process.runner.submit(
+                    go_process.ToolRequest(self.cmd, env=self.env,
+                                           cwd=self.cwd,
+                                           priority=go_process.BACKGROUND,
+                                           on_line=self._on_line))
+            self._request.wait()
+            self.returncode = self._request.returncode
+        except go_process.ToolCancelled:
+            log.debug("%r was cancelled", self)
+        except OSError, e:
+            log.error("Failed to run %s: %s", self.cmd, e)
+        finally:
+            self.finished.set()
+        log.debug("%r finished: %r", self, self.returncode)
+        if self.on_done is not None and not self.cancelled:
+            try:
+                self.on_done(self)
+            except Exception:
+                log.exception("Error reporting the end of %r", self)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            request = self._request
+        if request is not None:
+            request.cancel()
+
+    def get_problems(self, path, text):
+        """Return the problems found so far in the file at `path`, or None
+        if `text` isn't the version of the file that was built."""
+        path = os.path.normpath(path)
+        digest = self.file_hashes.get(path)
+        if digest is None or digest != hashlib.sha1(text).hexdigest():
+            return None
+        with self._lock:
+            return list(self.problems.get(path, []))
+
+class BuildRunner(object):
+    """Builds the packages of the files saved since the last build, one
+    build at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build = None
+        self._edited = set()
+        self._built_stamps = {}     # path -> (mtime, size) when last built
+
+    def note_saved(self, path):
+        """Note that the Go file at `path` was saved: it needs building if
+        it changed since it was last built (or first noted)."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        stamp = (st.st_mtime, st.st_size)
+        with self._lock:
+            previous = self._built_stamps.get(path)
+            if previous is None:
+                self._built_stamps[path] = stamp
+            elif previous != stamp:
+                self._edited.add(path)
+
+    def start(self, kind, paths, go_exe, env, on_problem=None, on_done=None):
+        """Build (or test) the packages of `paths`, cancelling the build in
+        flight.  Returns the Build."""
+        build = Build(kind, affected_packages(paths), go_exe, env,
+                      on_problem, on_done)
+        with self._lock:
+            previous = self._build
+            self._build = build
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                self._built_stamps[path] = (st.st_mtime, st.st_size)
+        if previous is not None and not previous.finished.isSet():
+            log.debug("cancelling %r for %r", previous, build)
+            previous.cancel()
+        t = threading.Thread(target=build.run, name="Go build")
+        t.setDaemon(True)
+        t.start()
+        return build
+
+    def build_edited(self, kind, go_exe, env):
+        """Build the packages of the files saved since they were last built,
+        if any.  Returns the Build, or None."""
+        with self._lock:
+            paths = sorted(self._edited)
+            self._edited.clear()
+        if not paths:
+            return None
+        return self.start(kind, paths, go_exe, env, _notify_problem,
+                          _notify_done)
+
+    def get_problems(self, path, text):
+        """Return the latest build's problems in `path`, or None."""
+        build = self._build
+        if build is None or build.cancelled:
+            return None
+        return build.get_problems(path, text)
+
+@components.ProxyToMainThreadAsync
+def _notify(topic, data):
+    try:
+        obsSvc = components.classes["@mozilla.org/observer-service;1"].\
+                    getService(components.interfaces.nsIObserverService)
+        obsSvc.notifyObservers(None, topic, data)
+    except Exception, e:
+        log.debug("Unable to notify %s: %s", topic, e)
+
+def _notify_problem(build, path, problem):
+    _notify("golang_build_results", path)
+
+def _notify_done(build):
+    _notify("golang_build_done", "\n".join(build.pkg_dirs))
+
+build_runner = BuildRunner()
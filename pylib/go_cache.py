@@ -0,0 +1,45 @@
+
+"""On-disk caches of the Go extension."""
+
+import os
+import json
+import logging
+
+from xpcom.components import interfaces as ci
+from xpcom.components import classes as cc
+
+log = logging.getLogger("codeintel-go.cache")
+
+def get_cache_dir():
+    """Return the directory used for the Go extension's on-disk caches."""
+    try:
+        base = cc["@activestate.com/koDirs;1"].getService(ci.koIDirs).userCacheDir
+    except Exception:
+        import tempfile
+        base = tempfile.gettempdir()
+    cache_dir = os.path.join(base, "golang")
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+    return cache_dir
+
+def write_json(path, data):
+    """Atomically replace the cache file at `path` with `data`."""
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as fout:
+            json.dump(data, fout)
+        if os.path.exists(path):
+            os.remove(path)   # os.rename can't replace on Windows
+        os.rename(tmp_path, path)
+    except (IOError, OSError), e:
+        log.warn("Unable to write cache file %r: %s", path, e)
+
+def read_json(path):
+    try:
+        with open(path, "rb") as fin:
+            return json.load(fin)
+    except (IOError, OSError, ValueError):
+        return None
@@ -0,0 +1,358 @@
+
+"""A precomputed catalog of the Go standard library's exported API.
+
+The catalog lists the exported package-level identifiers of every std
+package with their kind, signature and the first sentence of their doc
+comment.  It is generated from a GOROOT's sources with go_scanner (no Go
+tool is run), once per GOROOT and Go version, and stored in a compact
+binary file that is memory-mapped and searched in place, so member
+completions for std packages need no gocode process and opening the
+catalog doesn't parse it.
+
+File layout (little-endian):
+
+    header      magic, package count, and the offsets of the package
+                table, the entry table, the string data and the metadata
+    packages    (path, name, first entry, entry count) records, sorted by
+                import path
+    entries     (name, kind, signature, doc) records, sorted by name
+                within each package
+    strings     UTF-8 string data referenced by (offset, length) pairs
+    metadata    JSON: the GOROOT and Go version the catalog was built from
+
+The catalog can also be built ahead of time:
+
+    python go_catalog.py GOROOT VERSION OUTPUT
+"""
+
+import os
+import sys
+import json
+import mmap
+import struct
+import bisect
+import hashlib
+import threading
+import logging
+
+import go_scanner
+
+log = logging.getLogger("codeintel-go.catalog")
+
+# The last two bytes are the version of the contents: catalogs built by
+# an older version are rebuilt.
+MAGIC = "GOCAT\x00\x02\x00"
+_header = struct.Struct("<8s6I")
+_package = struct.Struct("<6I")
+_entry = struct.Struct("<IHBxIIII")
+
+kinds = ("func", "type", "const", "var")
+
+# Doc snippets are cut at the end of the first sentence, or at this length.
+max_doc_length = 200
+max_signature_length = 300
+
+class CatalogEntry(object):
+    """An exported package-level identifier of a std package."""
+    __slots__ = ("name", "kind", "signature", "doc")
+
+    def __init__(self, name, kind, signature, doc):
+        self.name = name
+        self.kind = kind
+        self.signature = signature
+        self.doc = doc
+
+    def __repr__(self):
+        return "<CatalogEntry %s %s>" % (self.kind, self.name)
+
+    @property
+    def typehint(self):
+        """The signature without the keyword and name, as gocode shows it.
+
+        A var or const shows its declared type, without the initializer;
+        None if it has no declared type.
+        """
+        rest = self.signature.split(self.name, 1)[-1].strip()
+        if self.kind == "func":
+            return "func" + rest
+        if self.kind in ("var", "const"):
+            return rest.split("=", 1)[0].strip() or None
+        return rest
+
+def _doc_snippet(doc):
+    lines = []
+    for line in doc.splitlines():
+        line = line.strip()
+        if line.startswith("//"):
+            line = line[2:]
+        elif line.startswith("/*"):
+            line = line[2:]
+        if line.endswith("*/"):
+            line = line[:-2]
+        lines.append(line.strip())
+    text = " ".join(line for line in lines if line)
+    end = text.find(". ")
+    if end >= 0:
+        text = text[:end+1]
+    if len(text) > max_doc_length:
+        text = text[:max_doc_length-3] + "..."
+    return text
+
+def _signature(decl):
+    signature = decl.signature
+    if decl.kind == "type":
+        # Leave out struct and interface bodies.
+        signature = signature.split("{", 1)[0].rstrip()
+    if not signature.startswith(decl.kind):
+        signature = "%s %s" % (decl.kind, signature)
+    if len(signature) > max_signature_length:
+        signature = signature[:max_signature_length-3] + "..."
+    return signature
+
+def _is_std_package_dir(rel):
+    parts = rel.split("/")
+    # "builtin" only documents the predeclared identifiers; it can't be
+    # imported.
+    return parts[0] not in ("cmd", "builtin") and "internal" not in parts \
+           and "vendor" not in parts and "testdata" not in parts
+
+def iter_std_packages(goroot):
+    """Generate the (import path, directory) of std packages in goroot."""
+    src = os.path.join(goroot, "src")
+    for dirpath, dirnames, filenames in os.walk(src):
+        dirnames.sort()
+        rel = os.path.relpath(dirpath, src).replace(os.sep, "/")
+        dirnames[:] = [d for d in dirnames if not d.startswith((".", "_"))
+                       and _is_std_package_dir(rel == "." and d or rel + "/" + d)]
+        if rel != "." and any(name.endswith(".go") for name in filenames):
+            yield rel, dirpath
+
+def scan_package(pkg_dir):
+    """Return the (package name, [CatalogEntry]) of a package directory."""
+    package_name = None
+    entries = {}
+    for name in sorted(os.listdir(pkg_dir)):
+        if not name.endswith(".go") or name.endswith("_test.go"):
+            continue
+        try:
+            with open(os.path.join(pkg_dir, name), "rb") as fin:
+                text = fin.read().decode("utf-8", "replace")
+        except (IOError, OSError):
+            continue
+        for decl in go_scanner.scan_declarations(text):
+            if decl.kind == "package":
+                if decl.name in ("main", "documentation"):
+                    break
+                package_name = decl.name
+            elif decl.kind != "method" and decl.name[:1].isupper() \
+                 and decl.name not in entries:
+                # Files for other platforms may declare the same names.
+                entries[decl.name] = CatalogEntry(decl.name, decl.kind,
+                                                  _signature(decl),
+                                                  _doc_snippet(decl.doc))
+    return package_name, entries.values()
+
+def build_catalog(goroot, version, out_path):
+    """Generate the catalog of `goroot`'s std library into out_path."""
+    strings = []
+    string_offsets = {}
+    string_size = [0]
+
+    def add_string(s):
+        data = s.encode("utf-8")
+        offset = string_offsets.get(data)
+        if offset is None:
+            offset = string_offsets[data] = string_size[0]
+            strings.append(data)
+            string_size[0] += len(data)
+        return offset, len(data)
+
+    packages = []
+    entries = []
+    for import_path, pkg_dir in iter_std_packages(goroot):
+        package_name, pkg_entries = scan_package(pkg_dir)
+        if package_name is None:
+            continue
+        pkg_entries.sort(key=lambda e: (e.name.lower(), e.name))
+        path_ref = add_string(import_path)
+        name_ref = add_string(package_name)
+        packages.append(_package.pack(path_ref[0], path_ref[1], name_ref[0],
+                                      name_ref[1], len(entries),
+                                      len(pkg_entries)))
+        for entry in pkg_entries:
+            name_offset, name_length = add_string(entry.name)
+            entries.append(_entry.pack(name_offset, name_length,
+                                       kinds.index(entry.kind),
+                                       *(add_string(entry.signature) +
+                                         add_string(entry.doc))))
+    meta = json.dumps({"goroot": goroot, "version": version})
+    packages_offset = _header.size
+    entries_offset = packages_offset + len(packages) * _package.size
+    strings_offset = entries_offset + len(entries) * _entry.size
+    meta_offset = strings_offset + string_size[0]
+    tmp_path = "%s.%d.tmp" % (out_path, os.getpid())
+    with open(tmp_path, "wb") as fout:
+        fout.write(_header.pack(MAGIC, len(packages), packages_offset,
+                                entries_offset, strings_offset, meta_offset,
+                                len(meta)))
+        fout.write("".join(packages))
+        fout.write("".join(entries))
+        fout.write("".join(strings))
+        fout.write(meta)
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    os.rename(tmp_path, out_path)
+    log.info("catalogued %d std packages, %d identifiers", len(packages),
+             len(entries))
+
+class Catalog(object):
+    """A memory-mapped std library catalog file."""
+
+    def __init__(self, path):
+        with open(path, "rb") as fin:
+            self._mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self._package_count, self._packages_offset,
+         self._entries_offset, self._strings_offset, meta_offset,
+         meta_length) = _header.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError("%r is not a Go catalog" % (path, ))
+        self.meta = json.loads(self._mm[meta_offset:meta_offset+meta_length])
+        self._members = {}
+
+    def close(self):
+        self._mm.close()
+
+    def _string(self, offset, length):
+        offset += self._strings_offset
+        return self._mm[offset:offset+length].decode("utf-8")
+
+    def _read_package(self, i):
+        return _package.unpack_from(self._mm,
+                                    self._packages_offset + i * _package.size)
+
+    def _find_package(self, import_path):
+        """Return the package record of import_path, or None."""
+        lo, hi = 0, self._package_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            record = self._read_package(mid)
+            path = self._string(record[0], record[1])
+            if path == import_path:
+                return record
+            if path < import_path:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def has_package(self, import_path):
+        return self._find_package(import_path) is not None
+
+    def package_name(self, import_path):
+        record = self._find_package(import_path)
+        return record and self._string(record[2], record[3])
+
+    def members(self, import_path):
+        """Return the CatalogEntries of a std package, sorted by name."""
+        members = self._members.get(import_path)
+        if members is None:
+            record = self._find_package(import_path)
+            if record is None:
+                return None
+            members = []
+            offset = self._entries_offset + record[4] * _entry.size
+            for i in range(record[5]):
+                (name_offset, name_length, kind, sig_offset, sig_length,
+                 doc_offset, doc_length) = _entry.unpack_from(self._mm, offset)
+                members.append(CatalogEntry(
+                    self._string(name_offset, name_length), kinds[kind],
+                    self._string(sig_offset, sig_length),
+                    self._string(doc_offset, doc_length)))
+                offset += _entry.size
+            self._members[import_path] = members
+        return members
+
+    def lookup(self, import_path, name):
+        """Return the CatalogEntry of `name` in a std package, or None."""
+        members = self.members(import_path)
+        if not members:
+            return None
+        keys = [(member.name.lower(), member.name) for member in members]
+        i = bisect.bisect_left(keys, (name.lower(), name))
+        if i < len(members) and members[i].name == name:
+            return members[i]
+        return None
+
+class StdCatalogs(object):
+    """Catalogs of std libraries, built on demand per GOROOT and version."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catalogs = {}     # (goroot, version) -> Catalog
+        self._building = set()
+
+    def _catalog_path(self, key):
+        import go_cache
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(go_cache.get_cache_dir(), "stdlib-%s.gocat" % digest)
+
+    def _open(self, key, path):
+        try:
+            catalog = Catalog(path)
+        except (IOError, OSError, ValueError, struct.error), e:
+            log.warn("Unable to open catalog %r: %s", path, e)
+            return None
+        if [catalog.meta.get("goroot"), catalog.meta.get("version")] != list(key):
+            catalog.close()
+            return None
+        return catalog
+
+    def _build_in_background(self, key, path):
+        def build():
+            try:
+                build_catalog(key[0], key[1], path)
+                catalog = self._open(key, path)
+            except Exception:
+                log.exception("Unable to build the std catalog of %r", key[0])
+                catalog = None
+            with self._lock:
+                self._building.discard(key)
+                if catalog is not None:
+                    self._catalogs[key] = catalog
+        with self._lock:
+            if key in self._building:
+                return
+            self._building.add(key)
+        t = threading.Thread(target=build, name="Go std catalog")
+        t.setDaemon(True)
+        t.start()
+
+    def get(self, go_exe, env):
+        """Return the Catalog for this go binary's std library.
+
+        Returns None (and starts building it) if it isn't available yet.
+        """
+        import go_pkgindex
+        key = go_pkgindex.std_indexes.toolchain_key(go_exe, env)
+        if key is None:
+            return None
+        catalog = self._catalogs.get(key)
+        if catalog is not None:
+            return catalog
+        path = self._catalog_path(key)
+        if os.path.exists(path):
+            catalog = self._open(key, path)
+            if catalog is not None:
+                with self._lock:
+                    self._catalogs[key] = catalog
+                return catalog
+        self._build_in_background(key, path)
+        return None
+
+std_catalogs = StdCatalogs()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        sys.exit("usage: %s GOROOT VERSION OUTPUT" % sys.argv[0])
+    logging.basicConfig(level=logging.INFO)
+    build_catalog(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -0,0 +1,127 @@
+
+"""What the cursor is on, for deciding which completions to offer.
+
+analyze() classifies the cursor position by tokenizing from the start of
+the enclosing top-level declaration (a line starting with func, type, var,
+const, import or package, found by looking back line by line) up to the
+cursor, so comments, strings and raw strings are recognised exactly and
+the cost is bounded by the size of that declaration.
+"""
+
+import re
+
+import go_scanner
+
+# Context kinds.
+NONE = "none"               # nothing to complete here
+COMMENT = "comment"
+STRING = "string"
+IMPORT = "import"           # an import path in an import declaration
+SELECTOR = "selector"       # a name after "x."
+IDENTIFIER = "identifier"   # any other name
+
+_decl_start_re = re.compile(r"(?:func|type|var|const|import|package)\b")
+
+# Operators that end an operand, so no name can follow them.
+_operand_end_ops = frozenset([")", "]", "}", "++", "--"])
+
+# How far back to look for the start of the enclosing declaration.
+max_lookback = 200000
+
+class CursorContext(object):
+    __slots__ = ("kind", "query", "start", "qualifier")
+
+    def __init__(self, kind, query="", start=None, qualifier=None):
+        self.kind = kind
+        # The text typed so far, and where it starts.
+        self.query = query
+        self.start = start
+        # For selectors, the identifier before the ".", if any.
+        self.qualifier = qualifier
+
+    def __repr__(self):
+        return "<CursorContext %s %r>" % (self.kind, self.query)
+
+def _find_scan_start(text, pos):
+    """Return the start of the top-level declaration containing pos."""
+    limit = max(0, pos - max_lookback)
+    i = pos
+    while True:
+        i = text.rfind("\n", limit, i)
+        if i < 0:
+            break
+        if _decl_start_re.match(text, i + 1):
+            return i + 1
+    if limit == 0:
+        return 0
+    # Give up and hope for the best from the next line on.
+    return text.find("\n", limit, pos) + 1 or pos
+
+def analyze(text, pos):
+    """Return the CursorContext of the position `pos` in `text`."""
+    tokens = []
+    in_import = False
+    for token in go_scanner.tokenize(text, _find_scan_start(text, pos), pos):
+        kind, start, end = token
+        if kind == go_scanner.KEYWORD:
+            in_import = text[start:end] == "import"
+        elif kind == go_scanner.COMMENT:
+            # Closed block comments end before the cursor; only a line
+            # comment can run up to it.
+            if end == pos and text[start+1] == "/":
+                return CursorContext(COMMENT)
+            continue
+        tokens.append(token)
+    if not tokens:
+        return CursorContext(NONE)
+    kind, start, end = tokens[-1]
+
+    if kind == go_scanner.UNTERMINATED:
+        # tokenize() stops at pos, so an unterminated token is one the
+        # cursor is in.
+        if text[start] == "/":
+            return CursorContext(COMMENT)
+        if in_import and text[start] == '"':
+            return CursorContext(IMPORT, text[start+1:pos], start + 1)
+        return CursorContext(STRING)
+    if end < pos:
+        # Whitespace between the last token and the cursor.
+        if kind == go_scanner.NEWLINE or in_import:
+            return CursorContext(NONE)
+        if kind == go_scanner.OP and text[start:end] == ".":
+            return _selector(text, tokens, len(tokens) - 1, pos)
+        return CursorContext(IDENTIFIER, "", pos)
+    if kind in (go_scanner.STRING, go_scanner.RAW_STRING, go_scanner.CHAR):
+        return CursorContext(NONE)
+    if kind in (go_scanner.IDENT, go_scanner.KEYWORD):
+        if len(tokens) > 1:
+            prev_kind, prev_start, prev_end = tokens[-2]
+            if prev_kind == go_scanner.OP and text[prev_start:prev_end] == ".":
+                return _selector(text, tokens, len(tokens) - 2, pos)
+        if in_import or kind == go_scanner.KEYWORD:
+            # A keyword just typed ("return", "func") is complete.
+            return CursorContext(NONE)
+        return CursorContext(IDENTIFIER, text[start:pos], start)
+    if kind == go_scanner.OP and not in_import:
+        op = text[start:end]
+        if op == ".":
+            return _selector(text, tokens, len(tokens) - 1, pos)
+        if op not in _operand_end_ops:
+            # An operand may follow, e.g. after "(" or "=".
+            return CursorContext(IDENTIFIER, "", pos)
+    return CursorContext(NONE)
+
+def _selector(text, tokens, dot_index, pos):
+    """The context of a selector whose "." is tokens[dot_index]."""
+    dot_end = tokens[dot_index][2]
+    # The name may be separated from the "." by whitespace ("fmt. Pr").
+    query_start = dot_end
+    while query_start < pos and text[query_start].isspace():
+        query_start += 1
+    qualifier = None
+    if dot_index > 0:
+        kind, start, end = tokens[dot_index - 1]
+        if kind == go_scanner.IDENT and end == tokens[dot_index][1]:
+            qualifier = text[start:end]
+    return CursorContext(SELECTOR, text[query_start:pos], query_start,
+                         qualifier)
@@ -0,0 +1,260 @@
+
+"""Resolution of the environment and tool locations used to run Go tools.
+
+Working out the environment for a Go buffer means asking the main thread for
+the view's prefs, reading every user environment string and parsing the
+environment override pref; finding a tool may walk the whole PATH.  The
+results are cached per file here, and thrown away when one of the relevant
+prefs or the user environment changes, so that the codeintel hot paths only
+pay those costs once.
+
+get_user_env() likewise keeps a snapshot of Komodo's user environment,
+with the values the process module can't pass on removed, for the tools
+run for the linter and the prefs panel.
+"""
+
+import os
+import sys
+import threading
+import logging
+
+import which
+import koprocessutils
+from xpcom import components
+from xpcom.components import interfaces as ci
+from xpcom.components import classes as cc
+
+log = logging.getLogger("codeintel-go.env")
+
+# The prefs that hold the location of each tool.
+tool_pref_names = {
+    "golang": "golangDefaultLocation",
+    "gocode": "gocodeDefaultLocation",
+    "godef": "godefDefaultLocation",
+}
+# Request deadlines, in milliseconds: pref name -> default.
+timeout_prefs = {
+    "golangCompletionTimeout": 3000,
+    "golangDefinitionTimeout": 5000,
+}
+# The prefs whose change invalidates the cache.
+watched_pref_names = tool_pref_names.values() + timeout_prefs.keys() + \
+                     ["userEnvironmentStartupOverride"]
+
+class GoEnvironment(object):
+    """The environment and tool locations to use for one Go file."""
+
+    def __init__(self, env, tool_prefs, timeouts=None):
+        self.env = env
+        self._tool_prefs = tool_prefs
+        self._tools = {}
+        # Timeout pref name -> timeout in seconds.
+        self._timeouts = timeouts or {}
+
+    def get_timeout(self, pref_name):
+        """Return the request deadline set by `pref_name`, in seconds.
+
+        Returns None, for no deadline, if the pref disables it.
+        """
+        if pref_name in self._timeouts:
+            return self._timeouts[pref_name]
+        return timeout_prefs[pref_name] / 1000.0
+
+    def get_tool(self, tool):
+        """Return the path of `tool` ("golang", "gocode" or "godef")."""
+        tool_path = self._tools.get(tool)
+        if tool_path is None:
+            tool_path = self._tools[tool] = self._locate_tool(tool)
+        return tool_path
+
+    def _locate_tool(self, tool):
+        tool_path = self._tool_prefs.get(tool)
+        if tool_path:
+            return tool_path
+
+        env = self.env
+        path = "PATH" in env and env["PATH"] or ""
+        path = [d.strip()
+                for d in path.split(os.pathsep)
+                if d.strip()]
+
+        tool_name = tool
+        if tool_name == "golang":
+            tool_name = "go"
+
+        try:
+            return which.which(tool_name, path=path)
+        except which.WhichError:
+            pass
+
+        go_exe = None
+        if tool != "golang":
+            go_exe = self.get_tool("golang")
+
+        ext = sys.platform.startswith("win") and ".exe" or ""
+
+        if go_exe:
+            tool_path = os.path.join(os.path.dirname(go_exe), tool_name + ext)
+            if os.path.exists(tool_path):
+                return tool_path
+
+        go_path = "GOPATH" in env and env["GOPATH"] or None
+        if go_path:
+            tool_path = os.path.join(go_path, "bin", tool_name + ext)
+            if os.path.exists(tool_path):
+                return tool_path
+
+        return tool # go for broke
+
+def _get_prefs():
+    prefs = None
+
+    project = cc["@activestate.com/koPartService;1"]\
+            .getService(ci.koIPartService).currentProject
+    if project:
+        prefs = project.prefset
+
+    if not prefs:
+        prefs = cc["@activestate.com/koPrefService;1"].getService(ci.koIPrefService).prefs
+
+    return prefs
+
+def _get_view_prefs():
+    view = cc["@activestate.com/koViewService;1"]\
+           .getService(ci.koIViewService).currentView
+    if view:
+        return view.QueryInterface(ci.koIScintillaView).prefs
+
+def _get_user_env():
+    ret = {}
+    userEnvSvc = cc["@activestate.com/koUserEnviron;1"].getService()
+    for piece in userEnvSvc.GetEnvironmentStrings():
+        equalSign = piece.find('=')
+        ret[piece[:equalSign]] = piece[equalSign+1:]
+    return ret
+
+class _EnvironmentCache(object):
+    _com_interfaces_ = [components.interfaces.nsIObserver]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._environments = {}     # file path -> GoEnvironment
+        self._generation = 0
+        self._observed_prefsets = set()
+        self._observing_user_env = False
+        self._user_env = None
+
+    def observe(self, subject, topic, data):
+        log.debug("%s changed, dropping cached Go environments", topic)
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._environments.clear()
+            self._user_env = None
+            self._generation += 1
+
+    def _watch(self, prefs):
+        """Observe the watched prefs on `prefs` (main thread only)."""
+        if prefs is None:
+            return
+        try:
+            prefset_id = prefs.id
+        except Exception:
+            prefset_id = None
+        if prefset_id in self._observed_prefsets:
+            return
+        try:
+            observerSvc = prefs.prefObserverService
+            for name in watched_pref_names:
+                observerSvc.addObserver(self, name, 0)
+        except Exception, e:
+            log.warn("Unable to observe Go prefs: %s", e)
+            return
+        if prefset_id is not None:
+            self._observed_prefsets.add(prefset_id)
+
+    @components.ProxyToMainThread
+    def _observe_environment(self):
+        if self._observing_user_env:
+            return
+        self._observing_user_env = True
+        try:
+            obsSvc = components.classes["@mozilla.org/observer-service;1"].\
+                        getService(components.interfaces.nsIObserverService)
+            obsSvc.addObserver(self, "user_environment_changed", False)
+            obsSvc.addObserver(self, "current_project_changed", False)
+        except Exception, e:
+            log.warn("Unable to observe environment changes: %s", e)
+        self._watch(cc["@activestate.com/koPrefService;1"].
+                        getService(ci.koIPrefService).prefs)
+
+    @components.ProxyToMainThread
+    def _resolve(self):
+        """Read the prefs and environment (on the main thread)."""
+        self._observe_environment()
+
+        env = _get_user_env()
+        view_prefs = _get_view_prefs()
+        if view_prefs is not None:
+            self._watch(view_prefs)
+            envStr = view_prefs.getString("userEnvironmentStartupOverride", "")
+            for entry in envStr.split('\n'):
+                entry = entry.split("=", 1)
+                if len(entry) != 2:
+                    continue
+                key, value = entry
+                env[key] = value
+
+        prefs = _get_prefs()
+        self._watch(prefs)
+        tool_prefs = {}
+        for tool, pref_name in tool_pref_names.items():
+            tool_prefs[tool] = prefs.getString(pref_name, "")
+        timeouts = {}
+        for pref_name, default in timeout_prefs.items():
+            timeout = prefs.getLong(pref_name, default)
+            # Non-positive values disable the deadline.
+            timeouts[pref_name] = timeout > 0 and timeout / 1000.0 or None
+        return env, tool_prefs, timeouts
+
+    def get(self, path):
+        goenv = self._environments.get(path)
+        if goenv is None:
+            generation = self._generation
+            env, tool_prefs, timeouts = self._resolve()
+            goenv = GoEnvironment(env, tool_prefs, timeouts)
+            with self._lock:
+                # Don't cache a result that raced with an invalidation.
+                if generation == self._generation:
+                    self._environments[path] = goenv
+        return goenv
+
+    def get_user_env(self):
+        env = self._user_env
+        if env is None:
+            if not self._observing_user_env:
+                self._observe_environment()
+            generation = self._generation
+            env = dict((k, v) for k, v in koprocessutils.getUserEnv().items()
+                       if isinstance(v, (str, unicode)))
+            with self._lock:
+                if generation == self._generation:
+                    self._user_env = env
+        return env
+
+_cache = _EnvironmentCache()
+
+def get_environment(path):
+    """Return the GoEnvironment to use for the Go file at `path`."""
+    return _cache.get(path)
+
+def get_user_env():
+    """Return the user environment to run Go tools with.
+
+    The dict is shared: copy it before making changes.
+    """
+    return _cache.get_user_env()
+
+def invalidate():
+    _cache.invalidate()
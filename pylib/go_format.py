@@ -0,0 +1,148 @@
+
+"""Formatting Go buffers with gofmt, changing only what gofmt changes.
+
+Replacing a whole buffer with gofmt's output throws away its undo history,
+markers and folds, and has the editor restyle all of it.  Instead gofmt's
+output is compared line by line with the buffer and only the hunks that
+differ are replaced, as a single undoable edit, so formatting a large file
+costs about as much as the changes gofmt made.
+
+Lines are split after "\n" only: str.splitlines() also splits on form
+feeds and Unicode separators, which Scintilla doesn't take as line ends.
+gofmt's LF-only output is given the buffer's line ends before it is
+compared.  A buffer whose lines can't be matched up with the editor's
+(CR-only line ends) has its whole text replaced instead.
+"""
+
+import difflib
+import logging
+
+import go_lint
+import go_process
+
+log = logging.getLogger("codeintel-go.format")
+
+# Scintilla's SC_EOL_CRLF, SC_EOL_CR and SC_EOL_LF.
+_eol_by_mode = {0: "\r\n", 1: "\r", 2: "\n"}
+
+class FormatError(Exception):
+    """gofmt couldn't format the buffer (e.g. it has syntax errors)."""
+    pass
+
+def run_gofmt(fmt_cmd_start, text, env=None, cwd=None):
+    """Return `text` (UTF-8 bytes) as formatted by gofmt.
+
+    Raises FormatError with gofmt's first diagnostic if it fails.
+    """
+    cmd = list(fmt_cmd_start)
+    request = go_process.runner.submit(go_process.ToolRequest(
+                cmd, input=text, env=env, cwd=cwd,
+                priority=go_process.FORMAT))
+    stdout, stderr = request.wait()
+    if request.returncode:
+        for line in stderr.splitlines():
+            parsed = go_lint.parse_error_line(line)
+            if parsed:
+                desc, lineNo, columnStart, columnEnd = parsed[1]
+                raise FormatError("line %d: %s" % (lineNo, desc))
+        raise FormatError(stderr.strip() or "gofmt failed")
+    return stdout
+
+def diff_hunks(old_lines, new_lines):
+    """Return the hunks turning old_lines into new_lines.
+
+    Each hunk is (start, end, lines): old_lines[start:end] are replaced by
+    `lines`.  The hunks are in order and don't overlap.
+    """
+    # Most lines are unchanged; only diff what lies between the common
+    # prefix and suffix.
+    n = min(len(old_lines), len(new_lines))
+    prefix = 0
+    while prefix < n and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < n - prefix and \
+          old_lines[-suffix-1] == new_lines[-suffix-1]:
+        suffix += 1
+    old_middle = old_lines[prefix:len(old_lines)-suffix]
+    new_middle = new_lines[prefix:len(new_lines)-suffix]
+    hunks = []
+    matcher = difflib.SequenceMatcher(None, old_middle, new_middle,
+                                      autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            hunks.append((prefix + i1, prefix + i2, new_middle[j1:j2]))
+    return hunks
+
+def apply_hunks(old_lines, hunks):
+    """Return old_lines with the hunks applied."""
+    lines = []
+    pos = 0
+    for start, end, new_lines in hunks:
+        lines += old_lines[pos:start]
+        lines += new_lines
+        pos = end
+    return lines + old_lines[pos:]
+
+def split_lines(text):
+    """Split `text` after each "\n", keeping the line ends."""
+    lines = text.split("\n")
+    last = lines.pop()
+    lines = [line + "\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+def _replace_all(scimoz, text):
+    scimoz.beginUndoAction()
+    try:
+        scimoz.targetStart = 0
+        scimoz.targetEnd = scimoz.length
+        scimoz.replaceTarget(len(text), text)
+    finally:
+        scimoz.endUndoAction()
+
+def format_scimoz(scimoz, fmt_cmd_start, env=None, cwd=None):
+    """Format the buffer of `scimoz` in place; return the number of hunks.
+
+    Only the lines gofmt changed are replaced, as one undo action.
+    """
+    text = scimoz.text
+    formatted = run_gofmt(fmt_cmd_start, text.encode("utf-8"), env, cwd)
+    formatted = formatted.decode("utf-8")
+    eol = _eol_by_mode.get(scimoz.eolMode, "\n")
+    if eol != "\n":
+        formatted = formatted.replace("\n", eol)
+    old_lines = split_lines(text)
+    # The editor has one more line than there are line ends.
+    line_ends = len(old_lines)
+    if old_lines and not old_lines[-1].endswith("\n"):
+        line_ends -= 1
+    if eol == "\r" or line_ends + 1 != scimoz.lineCount:
+        if formatted == text:
+            return 0
+        log.debug("gofmt: replacing the whole buffer, its line ends don't "
+                  "match the editor's")
+        _replace_all(scimoz, formatted)
+        return 1
+    hunks = diff_hunks(old_lines, split_lines(formatted))
+    if not hunks:
+        return 0
+    scimoz.beginUndoAction()
+    try:
+        # From the end, so the line numbers of earlier hunks stay valid.
+        for start, end, new_lines in reversed(hunks):
+            start_pos = scimoz.positionFromLine(start)
+            if end < scimoz.lineCount:
+                end_pos = scimoz.positionFromLine(end)
+            else:
+                end_pos = scimoz.length
+            scimoz.targetStart = start_pos
+            scimoz.targetEnd = end_pos
+            replacement = "".join(new_lines)
+            scimoz.replaceTarget(len(replacement), replacement)
+    finally:
+        scimoz.endUndoAction()
+    log.debug("gofmt changed %d hunks (%d lines)", len(hunks),
+              sum(end - start for start, end, lines in hunks))
+    return len(hunks)
@@ -0,0 +1,249 @@
+
+"""Managed gocode daemons used for Go code completion.
+
+gocode is a client/server program: the `autocomplete` client hands the
+buffer over a local socket to a long-running server that keeps the package
+cache warm.  Left to itself, every client invocation may end up starting (or
+racing to start) a shared server with whatever environment it happened to
+be run with.  Here we own that server instead: one daemon per gocode binary
+and Go environment, started on first use, health checked, restarted when it
+dies or when the environment changes, and closed when Komodo shuts down.
+A gocode binary only has the daemon for its latest environment running: the
+one for its previous environment is closed when it is replaced.
+"""
+
+import os
+import socket
+import threading
+import time
+import logging
+
+import process
+import go_process
+from xpcom import components
+
+log = logging.getLogger("codeintel-go.gocode")
+
+# Environment variables that change what gocode sees; a change in any of these
+# requires a different server.
+_env_key_names = ("GOROOT", "GOPATH", "GOOS", "GOARCH", "GO111MODULE",
+                  "GOFLAGS", "CGO_ENABLED")
+
+class Completion(object):
+    """A completion candidate, as reported by gocode."""
+    __slots__ = ("name", "cls", "type")
+
+    def __init__(self, name, cls, type):
+        self.name = name
+        # gocode's class: "func", "type", "const", "var" or "package".
+        self.cls = cls
+        self.type = type
+
+    def __repr__(self):
+        return "<Completion %s %s>" % (self.cls, self.name)
+
+def parse_gocode_csv(output):
+    """Return the Completions in gocode's "class,,name,,type" output."""
+    completions = []
+    for line in output.splitlines():
+        fields = line.split(",,", 3)
+        if len(fields) >= 3 and fields[0] != "PANIC":
+            completions.append(Completion(fields[1], fields[0], fields[2]))
+    return completions
+
+def _free_port():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+class GocodeServer(object):
+    """A gocode daemon for a single gocode binary and Go environment."""
+
+    # Seconds between health checks of a server that appears to be healthy.
+    health_check_interval = 10
+    # Seconds to wait for a freshly started server to accept connections.
+    startup_timeout = 5
+
+    def __init__(self, gocode_path, env):
+        self.gocode_path = gocode_path
+        self.env = env
+        self.addr = None
+        self.last_used = 0
+        self._proc = None
+        self._last_check = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "<GocodeServer %s %s>" % (self.gocode_path, self.addr)
+
+    def _client_cmd(self, *args):
+        return [self.gocode_path, "-sock=tcp", "-addr=%s" % self.addr] + list(args)
+
+    def _can_connect(self):
+        host, port = self.addr.rsplit(":", 1)
+        try:
+            s = socket.create_connection((host, int(port)), 0.5)
+        except socket.error:
+            return False
+        s.close()
+        return True
+
+    def is_alive(self):
+        if self._proc is None or self._proc.poll() is not None:
+            return False
+        return self._can_connect()
+
+    def _start(self):
+        self.addr = "127.0.0.1:%d" % _free_port()
+        cmd = [self.gocode_path, "-s", "-sock=tcp", "-addr=%s" % self.addr]
+        log.debug("starting gocode server %r", cmd)
+        self._proc = process.ProcessOpen(cmd, env=self.env, stdin=None,
+                                         stdout=None, stderr=None)
+        deadline = time.time() + self.startup_timeout
+        while time.time() < deadline:
+            if self._proc.poll() is not None:
+                break
+            if self._can_connect():
+                self._last_check = time.time()
+                return
+            time.sleep(0.05)
+        log.warn("gocode server %r failed to start", cmd)
+        self._stop()
+
+    def _stop(self):
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if proc.poll() is None:
+            try:
+                p = process.ProcessOpen(self._client_cmd("close"),
+                                        env=self.env, stdin=None)
+                p.communicate()
+            except OSError, e:
+                log.warn("Error closing gocode server: %s", e)
+            for i in range(20):
+                if proc.poll() is not None:
+                    break
+                time.sleep(0.05)
+            else:
+                try:
+                    proc.kill()
+                except OSError:
+                    pass
+
+    def ensure_running(self):
+        """Start, or restart, the server if it is not healthy."""
+        with self._lock:
+            now = time.time()
+            if self._proc is not None and self._proc.poll() is None \
+               and now - self._last_check < self.health_check_interval:
+                return True
+            if self.is_alive():
+                self._last_check = now
+                return True
+            if self._proc is not None:
+                log.info("gocode server %s is not responding, restarting", self.addr)
+                self._stop()
+            self._start()
+            return self._proc is not None
+
+    def autocomplete(self, buf, path, pos, timeout=None, slot=None,
+                     priority=go_process.COMPLETION):
+        """Return the (stdout, stderr) of a csv autocomplete request.
+
+        Raises go_process.ToolTimeout or go_process.ToolCancelled if the
+        request takes more than `timeout` seconds, or is superseded by a
+        newer request in the same `slot`.
+        """
+        self.last_used = time.time()
+        for attempt in (1, 2):
+            if not self.ensure_running():
+                return "", "unable to start gocode server"
+            cmd = self._client_cmd("-f=csv", "autocomplete", path, "%s" % pos)
+            log.debug("running [%s]", cmd)
+            request = go_process.runner.submit(go_process.ToolRequest(
+                        cmd, input=buf, env=self.env, slot=slot,
+                        priority=priority))
+            output, error = request.wait(timeout)
+            if request.returncode == 0 or output:
+                return output, error
+            # The server may have died between the health check and our
+            # request - force a full check before retrying.
+            log.debug("gocode client failed (%r), retrying", error)
+            self._last_check = 0
+        return output, error
+
+    def close(self):
+        with self._lock:
+            self._stop()
+
+_servers = {}
+# gocode path -> the key of the server last created for it.
+_latest_keys = {}
+_servers_lock = threading.Lock()
+# Maximum number of concurrently running servers (one per environment).
+max_servers = 4
+
+def _retire(server):
+    threading.Thread(target=server.close, name="gocode server close").start()
+
+def get_server(gocode_path, go_exe, env):
+    """Return the gocode server for the given tools and environment."""
+    if _shutdown_observer is None:
+        _register_shutdown_observer()
+    key = (gocode_path, go_exe) + tuple(env.get(n, "") for n in _env_key_names)
+    with _servers_lock:
+        server = _servers.get(key)
+        if server is None:
+            server_env = env.copy()
+            if go_exe and "GOROOT" not in server_env:
+                server_env["GOROOT"] = os.path.dirname(os.path.dirname(go_exe))
+            server = _servers[key] = GocodeServer(gocode_path, server_env)
+            server.last_used = time.time()
+            # The environment or go tool changed: the server this gocode
+            # ran with before is replaced.
+            replaced_key = _latest_keys.get(gocode_path)
+            _latest_keys[gocode_path] = key
+            replaced = _servers.pop(replaced_key, None)
+            if replaced is not None:
+                log.debug("%r replaces %r", server, replaced)
+                _retire(replaced)
+            # Other gocode binaries: retire the least recently used servers.
+            stale = sorted(_servers.items(), key=lambda kv: kv[1].last_used)
+            for stale_key, stale_server in stale[:-max_servers]:
+                del _servers[stale_key]
+                _retire(stale_server)
+    return server
+
+def shutdown_all():
+    with _servers_lock:
+        servers = _servers.values()
+        _servers.clear()
+        _latest_keys.clear()
+    for server in servers:
+        server.close()
+
+class _ShutdownObserver(object):
+    _com_interfaces_ = [components.interfaces.nsIObserver]
+
+    def observe(self, subject, topic, data):
+        if topic == "quit-application":
+            shutdown_all()
+
+_shutdown_observer = None
+
+@components.ProxyToMainThread
+def _register_shutdown_observer():
+    global _shutdown_observer
+    if _shutdown_observer is not None:
+        return
+    _shutdown_observer = _ShutdownObserver()
+    try:
+        obsSvc = components.classes["@mozilla.org/observer-service;1"].\
+                    getService(components.interfaces.nsIObserverService)
+        obsSvc.addObserver(_shutdown_observer, "quit-application", False)
+    except Exception, e:
+        log.warn("Unable to register gocode shutdown observer: %s", e)
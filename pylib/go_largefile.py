@@ -0,0 +1,91 @@
+
+"""Large-file mode for Go buffers.
+
+Generated Go files (protobuf bindings, embedded data, ...) can be tens of
+megabytes, and linting them on every keystroke, folding them by syntax,
+scanning all of them for sections or sending them to gocode makes the
+editor crawl.  A buffer above either threshold (golangLargeFileSize, in
+KB, or golangLargeFileLines) is in large-file mode:
+
+  - syntax-based folding is turned off when the lexer is set up for it,
+  - it is only linted once saved, not while being edited,
+  - only the sections in its first section_scan_limit bytes are listed,
+  - completions are only given where no gocode run is needed.
+
+Linting, sections and completions decide the mode from the buffer's
+current size every time, so a buffer leaves it as soon as it shrinks below
+the thresholds.  Folding is decided when the lexer is set on a view (when
+the file is opened or its language is set), and changed when a lint finds
+the buffer has entered or left the mode.
+"""
+
+import logging
+
+from xpcom import components
+
+log = logging.getLogger("codeintel-go.largefile")
+
+# Pref name -> default.
+threshold_prefs = {
+    "golangLargeFileSize": 4096,        # KB
+    "golangLargeFileLines": 100000,
+}
+
+# Bytes of a large buffer scanned for sections.
+section_scan_limit = 1024 * 1024
+
+max_bytes = threshold_prefs["golangLargeFileSize"] * 1024
+max_lines = threshold_prefs["golangLargeFileLines"]
+
+def set_thresholds(size_kb, lines):
+    """Set the thresholds; non-positive values disable that threshold."""
+    global max_bytes, max_lines
+    max_bytes = size_kb > 0 and size_kb * 1024 or None
+    max_lines = lines > 0 and lines or None
+
+def is_large_size(length, line_count):
+    """Whether a buffer of this many bytes and lines is large."""
+    return (max_bytes is not None and length > max_bytes) or \
+           (max_lines is not None and line_count > max_lines)
+
+def is_large(text):
+    """Whether the buffer `text` is large."""
+    if max_bytes is not None and len(text) > max_bytes:
+        return True
+    # There can't be more lines than characters.
+    if max_lines is None or len(text) <= max_lines:
+        return False
+    return text.count("\n") >= max_lines
+
+class _PrefObserver(object):
+    _com_interfaces_ = [components.interfaces.nsIObserver]
+
+    def __init__(self, prefs):
+        self.prefs = prefs
+
+    def observe(self, subject, topic, data):
+        self.update()
+
+    def update(self):
+        set_thresholds(*[self.prefs.getLong(name, threshold_prefs[name])
+                         for name in ("golangLargeFileSize",
+                                      "golangLargeFileLines")])
+        log.debug("large-file thresholds: %s bytes, %s lines", max_bytes,
+                  max_lines)
+
+_observer = None
+
+def watch_prefs():
+    """Follow the threshold prefs; call on the main thread."""
+    global _observer
+    if _observer is not None:
+        return
+    try:
+        prefs = components.classes["@activestate.com/koPrefService;1"].\
+                    getService(components.interfaces.koIPrefService).prefs
+        _observer = _PrefObserver(prefs)
+        _observer.update()
+        for name in threshold_prefs:
+            prefs.prefObserverService.addObserver(_observer, name, 0)
+    except Exception, e:
+        log.warn("Unable to observe the large-file prefs: %s", e)
@@ -0,0 +1,162 @@
+
+"""Parsing of Go tool diagnostics, and project-wide gofmt lint scans."""
+
+import os
+import re
+import Queue
+import hashlib
+import threading
+import logging
+import multiprocessing
+
+import go_cache
+import go_process
+import go_stats
+
+log = logging.getLogger("koGoLanguage.lint")
+
+ptn_err = re.compile(r'^(.*?):(\d+):(\d+):\s*(.*)')
+problem_token = re.compile(r"found\s+'.*?'\s+((?:\".*?\")|\S+)")
+
+def parse_error_line(line):
+    """Parse a "file:line:col: message" diagnostic.
+
+    Returns (filename, (description, line, columnStart, columnEnd)), or
+    None if `line` is not a diagnostic.
+    """
+    m = ptn_err.match(line.rstrip("\r\n"))
+    if not m:
+        return None
+    lineNo = int(m.group(2))
+    columnStart = int(m.group(3))
+    desc = m.group(4)
+    m1 = problem_token.search(desc)
+    if m1:
+        columnEnd = columnStart + len(m1.group(1))
+    else:
+        columnEnd = columnStart + 1
+    return m.group(1), (desc, lineNo, columnStart, columnEnd)
+
+class ProjectLintScanner(object):
+    """Syntax check every .go file below a set of directories with gofmt.
+
+    Files are handed to gofmt in batches (it accepts many paths at once),
+    and batches are run concurrently, one gofmt process per CPU (within
+    go_process's limit, as background work). Problems
+    found are remembered per file, with the file's mtime and size, in the
+    given cache file, so a rescan only runs gofmt on the files that changed.
+    """
+
+    # Number of files given to one gofmt invocation.
+    batch_size = 64
+    # Directory names that are never scanned.
+    skip_dir_names = ("testdata", "vendor")
+
+    def __init__(self, fmt_cmd_start, cache_path, env=None, num_workers=None):
+        self.fmt_cmd_start = fmt_cmd_start
+        self.cache_path = cache_path
+        self.env = env
+        if num_workers is None:
+            try:
+                num_workers = multiprocessing.cpu_count()
+            except NotImplementedError:
+                num_workers = 2
+        self.num_workers = num_workers
+
+    def _find_go_files(self, roots):
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames[:] = [d for d in dirnames
+                               if not d.startswith((".", "_"))
+                               and d not in self.skip_dir_names]
+                for name in filenames:
+                    if name.endswith(".go"):
+                        yield os.path.join(dirpath, name)
+
+    def _lint_batch(self, paths):
+        """Run gofmt over `paths`, returning {path: [problem, ...]}, or
+        None if gofmt couldn't be run."""
+        results = dict((path, []) for path in paths)
+        cmd = self.fmt_cmd_start + ['-l'] + paths
+        try:
+            stdout, stderr = go_process.run(cmd, env=self.env,
+                                            priority=go_process.BACKGROUND)
+        except (go_process.ToolTimeout, go_process.ToolCancelled, OSError), e:
+            log.error("Failed to run %s: %s", cmd[0], e)
+            return None
+        with go_stats.parse_timer(go_stats.tool_name(cmd)):
+            for line in stderr.splitlines():
+                parsed = parse_error_line(line)
+                if parsed and parsed[0] in results:
+                    results[parsed[0]].append(parsed[1])
+        return results
+
+    def scan(self, roots, callback=None):
+        """Lint all the Go files under `roots`.
+
+        `callback(results)`, if given, is called with a {path: problems}
+        dict for the unchanged files first and then as each batch
+        finishes; batches finish on worker threads. Each problem is a
+        (description, line, columnStart, columnEnd) tuple. Returns the
+        results for all the files.
+        """
+        cache = go_cache.read_json(self.cache_path) or {}
+        all_results = {}
+        unchanged = {}
+        changed = []
+        for path in self._find_go_files(roots):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamp = [st.st_mtime, st.st_size]
+            entry = cache.get(path)
+            if entry is not None and entry[0] == stamp:
+                unchanged[path] = [tuple(problem) for problem in entry[1]]
+            else:
+                changed.append((path, stamp))
+        all_results.update(unchanged)
+        if callback and unchanged:
+            callback(unchanged)
+        log.debug("lint scan: %d unchanged, %d to check",
+                  len(unchanged), len(changed))
+
+        stamps = dict(changed)
+        batches = Queue.Queue()
+        paths = [path for path, stamp in changed]
+        for i in range(0, len(paths), self.batch_size):
+            batches.put(paths[i:i+self.batch_size])
+        lock = threading.Lock()
+
+        def work():
+            while True:
+                try:
+                    batch = batches.get_nowait()
+                except Queue.Empty:
+                    return
+                results = self._lint_batch(batch)
+                if results is None:
+                    # Left out of the cache, to be checked by the next scan.
+                    continue
+                with lock:
+                    all_results.update(results)
+                if callback:
+                    callback(results)
+
+        workers = [threading.Thread(target=work, name="Go lint scan")
+                   for i in range(min(self.num_workers, batches.qsize()))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        new_cache = {}
+        for path, problems in all_results.iteritems():
+            stamp = stamps.get(path) or cache[path][0]
+            new_cache[path] = [stamp, problems]
+        go_cache.write_json(self.cache_path, new_cache)
+        return all_results
+
+def get_scan_cache_path(roots):
+    digest = hashlib.sha1(repr(sorted(roots))).hexdigest()
+    return os.path.join(go_cache.get_cache_dir(), "lint-scan-%s.json" % digest)
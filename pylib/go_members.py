@@ -0,0 +1,152 @@
+
+"""An on-disk cache of the members of imported packages, for completions.
+
+The completions after "pkg." are the same every time for a given version
+of the package, so gocode's answer is kept on disk, keyed by the import
+path, the Go toolchain and (outside GOROOT) the names, mtimes and sizes of
+the package's source files, and served again without running gocode, in
+this session or a later one.
+
+Each entry is a JSON file in the "members" directory of the extension's
+cache.  Reading an entry touches its file; when the files take more than
+max_size bytes, the least recently used ones are removed.
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+
+import go_cache
+
+log = logging.getLogger("codeintel-go.members")
+
+def source_stamp(pkg_dir):
+    """Return a hash of the names, mtimes and sizes of pkg_dir's sources."""
+    stamps = []
+    try:
+        names = os.listdir(pkg_dir)
+    except OSError:
+        return None
+    for name in sorted(names):
+        if not name.endswith(".go") or name.endswith("_test.go"):
+            continue
+        try:
+            st = os.stat(os.path.join(pkg_dir, name))
+        except OSError:
+            continue
+        stamps.append((name, st.st_mtime, st.st_size))
+    return hashlib.sha1(repr(stamps)).hexdigest()
+
+def package_key(import_path, pkg_dir, goroot, version):
+    """Return the cache key of a package's members, or None.
+
+    Std packages only change with the toolchain; other packages also
+    change with their sources.
+    """
+    goroot_src = os.path.join(goroot, "src") + os.sep
+    if pkg_dir.startswith(goroot_src):
+        return ["std", import_path, goroot, version]
+    stamp = source_stamp(pkg_dir)
+    if stamp is None:
+        return None
+    return ["pkg", import_path, pkg_dir, version, stamp]
+
+class MemberCache(object):
+    """Package member lists on disk, least recently used evicted first."""
+
+    # Maximum total size of the cache files, in bytes.
+    max_size = 16 * 1024 * 1024
+
+    def __init__(self, cache_dir=None):
+        self._lock = threading.Lock()
+        self._cache_dir = cache_dir
+        self._size = None   # total size of the files, once known
+
+    def _dir(self):
+        if self._cache_dir is None:
+            self._cache_dir = os.path.join(go_cache.get_cache_dir(), "members")
+        if not os.path.isdir(self._cache_dir):
+            try:
+                os.makedirs(self._cache_dir)
+            except OSError:
+                pass
+        return self._cache_dir
+
+    def _path(self, key):
+        digest = hashlib.sha1(json.dumps(key)).hexdigest()
+        return os.path.join(self._dir(), digest + ".json")
+
+    def _entries(self):
+        """Return [(mtime, size, path)] of the cache files, least recently
+        used first."""
+        entries = []
+        cache_dir = self._dir()
+        for name in os.listdir(cache_dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(cache_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        return entries
+
+    def get(self, key):
+        """Return the [(name, class, type)] members stored for key, or None."""
+        path = self._path(key)
+        data = go_cache.read_json(path)
+        if not data or data.get("key") != key:
+            return None
+        try:
+            os.utime(path, None)    # most recently used
+        except OSError:
+            pass
+        return [tuple(member) for member in data["members"]]
+
+    def put(self, key, members):
+        """Store the [(name, class, type)] members of key."""
+        path = self._path(key)
+        data = json.dumps({"key": key, "members": [list(m) for m in members]})
+        with self._lock:
+            try:
+                if self._size is None:
+                    self._size = sum(size for mtime, size, p in self._entries())
+                if os.path.exists(path):
+                    self._size -= os.path.getsize(path)
+                tmp_path = "%s.%d.tmp" % (path, os.getpid())
+                with open(tmp_path, "wb") as fout:
+                    fout.write(data)
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(tmp_path, path)
+                self._size += len(data)
+                if self._size > self.max_size:
+                    self._evict()
+            except (IOError, OSError), e:
+                log.warn("Unable to cache the members of %r: %s", key[1], e)
+                self._size = None
+
+    def _evict(self):
+        for mtime, size, path in self._entries():
+            if self._size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+
+    def clear(self):
+        with self._lock:
+            for mtime, size, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size = 0
+
+member_cache = MemberCache()
@@ -0,0 +1,390 @@
+
+"""Package indexes used for Go import completions.
+
+The standard library package list only changes with the Go toolchain, so it
+is computed once per GOROOT and Go version, kept in memory as a sorted,
+prefix-searchable list and persisted in Komodo's cache directory for later
+sessions.  When the go binary changes on disk the index is rebuilt in the
+background while the previous one keeps serving completions.
+
+Third-party packages (GOPATH, vendor directories and the module cache) are
+indexed by walking those trees on a worker thread, see
+WorkspacePackageIndexer.
+"""
+
+import os
+import re
+import time
+import Queue
+import bisect
+import hashlib
+import threading
+import logging
+
+import go_cache
+import go_process
+from xpcom.components import interfaces as ci
+from xpcom.components import classes as cc
+
+log = logging.getLogger("codeintel-go.pkgindex")
+
+class PrefixIndex(object):
+    """A sorted list of names supporting case-insensitive prefix lookups."""
+
+    def __init__(self, names):
+        pairs = sorted(set((name.lower(), name) for name in names))
+        self._keys = [lower for lower, name in pairs]
+        self._names = [name for lower, name in pairs]
+
+    def __len__(self):
+        return len(self._names)
+
+    def names(self):
+        return list(self._names)
+
+    def search(self, prefix):
+        """Return the names starting with `prefix`, ignoring case."""
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self._keys, prefix)
+        if not prefix:
+            return self._names[:]
+        # Every key starting with prefix sorts before prefix + the largest
+        # character.
+        end = bisect.bisect_left(self._keys, prefix + u"\uffff", start)
+        return self._names[start:end]
+
+def get_goroot(go_exe, env):
+    return env.get("GOROOT") or \
+           os.path.dirname(os.path.dirname(os.path.realpath(go_exe)))
+
+# go_exe -> the GOPATH it uses when the environment doesn't set one.
+_default_gopaths = {}
+def get_gopaths(env, go_exe=None):
+    """Return the GOPATH directories of this environment.
+
+    Without a GOPATH in the environment, go's own (from `go env GOPATH`,
+    which also knows about `go env -w`) is used, or else ~/go.
+    """
+    gopath = env.get("GOPATH")
+    if not gopath:
+        gopath = _default_gopaths.get(go_exe)
+        if gopath is None:
+            gopath = ""
+            if go_exe:
+                try:
+                    output, error = go_process.run([go_exe, "env", "GOPATH"],
+                                                   env=env,
+                                                   priority=go_process.PROBE)
+                    gopath = output.strip()
+                except (go_process.ToolTimeout, go_process.ToolCancelled,
+                        OSError), e:
+                    log.warn("Unable to run %r env GOPATH: %s", go_exe, e)
+            if not gopath:
+                gopath = os.path.join(os.path.expanduser("~"), "go")
+            _default_gopaths[go_exe] = gopath
+    return [p for p in gopath.split(os.pathsep) if p]
+
+class StdPackageIndexes(object):
+    """Standard library package indexes, keyed by GOROOT and Go version."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (goroot, version) -> PrefixIndex
+        self._indexes = {}
+        # go_exe -> ((mtime, size), goroot, version)
+        self._toolchains = {}
+        self._building = set()
+
+    def _get_version(self, go_exe):
+        infoEx = cc["@activestate.com/koAppInfoEx?app=Go;1"].\
+                    getService(ci.koIAppInfoEx)
+        return infoEx.getVersionForBinary(go_exe)
+
+    def _cache_path(self, key):
+        digest = hashlib.sha1(repr(key)).hexdigest()
+        return os.path.join(go_cache.get_cache_dir(), "std-packages-%s.json" % digest)
+
+    def _build(self, key, go_exe, env):
+        goroot, version = key
+        cmd = [go_exe, 'list', 'std']
+        env = env.copy()
+        env["GOROOT"] = goroot
+        log.debug("running cmd %r", cmd)
+        request = go_process.runner.submit(go_process.ToolRequest(
+                    cmd, cwd=goroot, env=env, priority=go_process.BACKGROUND))
+        output, error = request.wait()
+        if request.returncode:
+            log.warn("cmd %r error [%s]", cmd, error)
+            return None
+        package_names = [x.strip() for x in output.splitlines() if x.strip()]
+        log.debug("retrieved %d package names", len(package_names))
+        go_cache.write_json(self._cache_path(key), {
+            "goroot": goroot,
+            "version": version,
+            "packages": package_names,
+        })
+        return PrefixIndex(package_names)
+
+    def _load(self, key):
+        data = go_cache.read_json(self._cache_path(key))
+        if data and data.get("goroot") == key[0] \
+           and data.get("version") == key[1]:
+            return PrefixIndex(data["packages"])
+        return None
+
+    def _build_in_background(self, key, go_exe, env):
+        def build():
+            try:
+                index = self._build(key, go_exe, env)
+            except Exception:
+                log.exception("Unable to build std package index")
+                index = None
+            with self._lock:
+                self._building.discard(key)
+                if index is not None:
+                    self._indexes[key] = index
+        with self._lock:
+            if key in self._building:
+                return
+            self._building.add(key)
+        t = threading.Thread(target=build, name="Go std package index")
+        t.setDaemon(True)
+        t.start()
+
+    def toolchain_key(self, go_exe, env):
+        """Return the (goroot, version) of this go binary, or None."""
+        try:
+            st = os.stat(go_exe)
+        except OSError:
+            return None
+        stamp = (st.st_mtime, st.st_size)
+        goroot = get_goroot(go_exe, env)
+        previous = self._toolchains.get(go_exe)
+        if previous and previous[0] == stamp and previous[1] == goroot:
+            return (goroot, previous[2])
+        try:
+            version = self._get_version(go_exe)
+        except Exception, e:
+            log.warn("Unable to determine the version of %r: %s", go_exe, e)
+            return None
+        self._toolchains[go_exe] = (stamp, goroot, version)
+        return (goroot, version)
+
+    def get(self, go_exe, env):
+        """Return the PrefixIndex of std packages for this go binary.
+
+        Returns None if no index is available yet.
+        """
+        previous = self._toolchains.get(go_exe)
+        key = self.toolchain_key(go_exe, env)
+        if key is None:
+            return None
+
+        index = self._indexes.get(key)
+        if index is not None:
+            return index
+        index = self._load(key)
+        if index is None:
+            stale = previous and self._indexes.get((previous[1], previous[2]))
+            if stale is not None:
+                # The toolchain changed - keep serving the old list until
+                # the new one is ready.
+                self._build_in_background(key, go_exe, env)
+                return stale
+            index = self._build(key, go_exe, env)
+            if index is None:
+                return None
+        with self._lock:
+            self._indexes[key] = index
+        return index
+
+std_indexes = StdPackageIndexes()
+
+def _decode_module_path(path):
+    """Undo the module cache's case encoding ("!a" stands for "A")."""
+    if "!" not in path:
+        return path
+    return re.sub(r"!([a-z])", lambda m: m.group(1).upper(), path)
+
+def _import_path(rel, kind):
+    """Return the import path of the package at `rel` within a root."""
+    if kind == "mod":
+        parts = [p.split("@", 1)[0] for p in rel.split("/")]
+        return _decode_module_path("/".join(parts))
+    return rel
+
+class _RootScan(object):
+    """Package directories found under one root, with directory mtimes."""
+
+    def __init__(self, root, kind):
+        self.root = root
+        self.kind = kind
+        # Relative dir path -> [mtime, has_go_files, [subdir names]]
+        self.dirs = {}
+        self.index = PrefixIndex([])
+        self.last_scan = 0
+
+    def _list_dir(self, path):
+        has_go = False
+        subdirs = []
+        for name in os.listdir(path):
+            if name.startswith((".", "_")) or name == "testdata":
+                continue
+            if name.endswith(".go"):
+                if not name.endswith("_test.go"):
+                    has_go = True
+            elif os.path.isdir(os.path.join(path, name)):
+                subdirs.append(name)
+        return has_go, subdirs
+
+    def scan(self):
+        """Update self.dirs, only listing directories that have changed."""
+        old_dirs = self.dirs
+        dirs = {}
+        listed = 0
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            path = rel and os.path.join(self.root, rel) or self.root
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            entry = old_dirs.get(rel)
+            if entry is None or entry[0] != mtime:
+                try:
+                    has_go, subdirs = self._list_dir(path)
+                except OSError:
+                    continue
+                entry = [mtime, has_go, subdirs]
+                listed += 1
+            dirs[rel] = entry
+            for name in entry[2]:
+                if not rel and self.kind == "mod" and name == "cache":
+                    continue    # the module download cache, not packages
+                if name == "vendor":
+                    # Vendored packages are only importable below the
+                    # vendor directory's parent: the vendor directories
+                    # visible from a file are roots of their own.
+                    continue
+                stack.append(rel and rel + "/" + name or name)
+        self.dirs = dirs
+        self.index = PrefixIndex(_import_path(rel, self.kind)
+                                 for rel, entry in dirs.iteritems()
+                                 if entry[1] and rel)
+        self.last_scan = time.time()
+        log.debug("scanned %r: %d dirs (%d listed), %d packages",
+                  self.root, len(dirs), listed, len(self.index))
+
+    def to_json(self):
+        return {"root": self.root, "kind": self.kind, "dirs": self.dirs}
+
+class WorkspacePackageIndexer(object):
+    """Background indexer of GOPATH, vendor and module cache packages.
+
+    Roots are scanned on a single worker thread. The directory listing of
+    every root is persisted, so later scans (including those of the next
+    session) only list the directories whose mtime changed.
+    """
+
+    # Minimum number of seconds between two scans of the same root.
+    rescan_interval = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._roots = {}    # root -> _RootScan
+        self._queue = Queue.Queue()
+        self._queued = set()
+        self._thread = None
+
+    def _cache_path(self, root):
+        digest = hashlib.sha1(root.encode("utf-8")).hexdigest()
+        return os.path.join(go_cache.get_cache_dir(), "packages-%s.json" % digest)
+
+    def _load(self, root, kind):
+        scan = _RootScan(root, kind)
+        data = go_cache.read_json(self._cache_path(root))
+        if data and data.get("root") == root and data.get("kind") == kind:
+            scan.dirs = data["dirs"]
+        return scan
+
+    def _run(self):
+        while True:
+            root = self._queue.get()
+            scan = self._roots[root]
+            try:
+                scan.scan()
+                go_cache.write_json(self._cache_path(root), scan.to_json())
+            except Exception:
+                log.exception("Error indexing Go packages in %r", root)
+            with self._lock:
+                self._queued.discard(root)
+
+    def request_scan(self, roots):
+        """Queue a scan of each (root, kind) pair that is due for one.
+
+        `kind` is "src" for GOPATH and vendor trees, "mod" for the module
+        cache.
+        """
+        now = time.time()
+        with self._lock:
+            for root, kind in roots:
+                scan = self._roots.get(root)
+                if scan is None:
+                    scan = self._roots[root] = self._load(root, kind)
+                if root in self._queued \
+                   or now - scan.last_scan < self.rescan_interval:
+                    continue
+                self._queued.add(root)
+                self._queue.put(root)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="Go package indexer")
+                self._thread.setDaemon(True)
+                self._thread.start()
+
+    def search(self, prefix, roots):
+        """Return the import paths indexed so far that start with `prefix`."""
+        names = set()
+        for root, kind in roots:
+            scan = self._roots.get(root)
+            if scan is not None:
+                names.update(scan.index.search(prefix))
+        return sorted(names)
+
+def get_workspace_roots(env, parentPath=None, go_exe=None):
+    """Return the (root, kind) pairs to index for this environment.
+
+    The vendor directories included are those visible from the directory
+    `parentPath`.
+    """
+    roots = []
+    gopaths = get_gopaths(env, go_exe)
+    for gopath in gopaths:
+        src = os.path.join(gopath, "src")
+        if os.path.isdir(src):
+            roots.append((src, "src"))
+    modcache = env.get("GOMODCACHE") or \
+               (gopaths and os.path.join(gopaths[0], "pkg", "mod"))
+    if modcache and os.path.isdir(modcache):
+        roots.append((modcache, "mod"))
+    if parentPath:
+        roots += [(d, "src") for d in find_vendor_dirs(parentPath)]
+    return roots
+
+_vendor_dirs_cache = {}
+def find_vendor_dirs(path):
+    """Return the vendor directories visible from the directory `path`."""
+    vendor_dirs = _vendor_dirs_cache.get(path)
+    if vendor_dirs is None:
+        vendor_dirs = []
+        parent = os.path.dirname(path)
+        if parent and parent != path:
+            vendor_dirs = find_vendor_dirs(parent)
+        vendor_dir = os.path.join(path, "vendor")
+        if os.path.isdir(vendor_dir):
+            vendor_dirs = [vendor_dir] + vendor_dirs
+        _vendor_dirs_cache[path] = vendor_dirs
+    return vendor_dirs
+
+workspace_indexer = WorkspacePackageIndexer()
@@ -0,0 +1,271 @@
+
+"""Running Go tools (gofmt, gocode, godef, go, ...) with deadlines,
+cancellation and a limit on how many run at once.
+
+Every Go tool process the extension starts (except the long-running gocode
+daemon) goes through the runner here.  At most `max_processes` tools run at
+once; further requests are queued, most urgent first: completion, then go
+to definition, then formatting, then version probes, then linting, then
+background work (vet, builds, package listing, project scans).  Linting
+and background work may not take the last `reserved_processes` of the
+slots, so a burst of edits or a project scan can't make a completion wait
+for a free slot.
+
+The requesting thread waits for the result for at most the request's
+deadline, after which the tool's process is killed: a hung gocode or godef
+can no longer stall codeintel.  Requests can also be given a slot (for
+example the kind of request and the file it is for); a newer request in
+the same slot cancels, and kills, the one it supersedes.  Long-running
+tools (builds and tests) can have their output handed over a line at a
+time, as it is written, rather than all at once when they exit.
+"""
+
+import heapq
+import threading
+import logging
+import multiprocessing
+
+import process
+import go_stats
+
+log = logging.getLogger("codeintel-go.process")
+
+# Request priorities, most urgent first.
+COMPLETION = 0
+DEFINITION = 1
+FORMAT = 2
+PROBE = 3
+LINT = 4
+BACKGROUND = 5
+
+priority_names = ("completion", "definition", "format", "probe", "lint",
+                  "background")
+
+class ToolTimeout(Exception):
+    pass
+
+class ToolCancelled(Exception):
+    pass
+
+class ToolRequest(object):
+    """A request to run one tool process."""
+
+    def __init__(self, cmd, input=None, env=None, cwd=None, slot=None,
+                 priority=BACKGROUND, on_line=None):
+        self.cmd = cmd
+        self.input = input
+        self.env = env
+        self.cwd = cwd
+        self.slot = slot
+        self.priority = priority
+        # on_line(line, stream name), called as output lines arrive.
+        self.on_line = on_line
+        self.queue_depth = 0
+        self.submitted = None
+        self.cancelled = False
+        self.timed_out = False
+        self.returncode = None
+        self.stdout = None
+        self.stderr = None
+        self.error = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def __repr__(self):
+        return "<ToolRequest %r>" % (self.cmd, )
+
+    def run(self):
+        """Run the process; called on a worker thread."""
+        invocation = go_stats.start(self.cmd, self.input,
+                                    queued_since=self.submitted,
+                                    queue_depth=self.queue_depth)
+        try:
+            with self._lock:
+                if self.cancelled:
+                    invocation.failed(go_stats.CANCELLED)
+                    return
+                # Without input the tool must not wait on a pipe nobody
+                # writes to.
+                stdin = self.input is not None and process.PIPE or None
+                self._process = process.ProcessOpen(self.cmd, cwd=self.cwd,
+                                                    env=self.env, stdin=stdin)
+            invocation.spawned()
+            if self.on_line is not None:
+                self.stdout, self.stderr = self._stream()
+            else:
+                self.stdout, self.stderr = self._process.communicate(self.input)
+            self.returncode = self._process.returncode
+            if self.timed_out:
+                outcome = go_stats.TIMEOUT
+            elif self.cancelled:
+                outcome = go_stats.CANCELLED
+            else:
+                outcome = go_stats.OK
+            invocation.finished(self.stdout, self.stderr, outcome)
+        except Exception, e:
+            invocation.failed()
+            self.error = e
+        finally:
+            self._done.set()
+
+    def _stream(self):
+        """Read the process's output a line at a time, handing each line to
+        on_line; returns the whole (stdout, stderr)."""
+        p = self._process
+        stderr_lines = []
+        def read_stderr():
+            for line in iter(p.stderr.readline, ""):
+                stderr_lines.append(line)
+                self.on_line(line, "stderr")
+        stderr_reader = threading.Thread(target=read_stderr,
+                                         name="Go tool stderr")
+        stderr_reader.setDaemon(True)
+        stderr_reader.start()
+        if p.stdin is not None:
+            if self.input:
+                p.stdin.write(self.input)
+            p.stdin.close()
+        stdout_lines = []
+        for line in iter(p.stdout.readline, ""):
+            stdout_lines.append(line)
+            self.on_line(line, "stdout")
+        stderr_reader.join()
+        p.wait()
+        return "".join(stdout_lines), "".join(stderr_lines)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            p = self._process
+        if p is not None and p.poll() is None:
+            log.debug("killing %r", self)
+            try:
+                p.kill()
+            except OSError:
+                pass
+        self._done.set()
+
+    def wait(self, timeout=None):
+        """Wait for the tool, returning its (stdout, stderr).
+
+        Raises ToolTimeout if it takes more than `timeout` seconds (the
+        process is killed), ToolCancelled if a newer request superseded
+        this one, or the OSError raised trying to run it.
+        """
+        if not self._done.wait(timeout):
+            self.timed_out = True
+            self.cancel()
+            raise ToolTimeout("%s took more than %ss" % (self.cmd[0], timeout))
+        if self.cancelled:
+            raise ToolCancelled("%s was superseded" % (self.cmd[0], ))
+        if self.error is not None:
+            raise self.error
+        return self.stdout, self.stderr
+
+def _default_max_processes():
+    try:
+        return min(max(multiprocessing.cpu_count(), 2), 8)
+    except NotImplementedError:
+        return 2
+
+class ToolRunner(object):
+    """Runs tool requests on a pool of worker threads, most urgent first."""
+
+    # Slots that only requests more urgent than LINT may use.
+    reserved_processes = 1
+
+    def __init__(self, max_processes=None):
+        if max_processes is None:
+            max_processes = _default_max_processes()
+        self.max_processes = max_processes
+        self._cond = threading.Condition()
+        self._queue = []        # heap of (priority, sequence, request)
+        self._sequence = 0
+        self._slots = {}
+        self._workers = []
+        self._running = 0
+        self._running_background = 0
+
+    def _can_start(self, request):
+        if request.priority < LINT:
+            return True
+        return self._running_background < \
+               self.max_processes - self.reserved_processes
+
+    def _next(self):
+        """Wait for, and take, the next request that may run."""
+        with self._cond:
+            while not self._queue or not self._can_start(self._queue[0][2]):
+                self._cond.wait()
+            request = heapq.heappop(self._queue)[2]
+            self._running += 1
+            if request.priority >= LINT:
+                self._running_background += 1
+            return request
+
+    def _work(self):
+        while True:
+            request = self._next()
+            try:
+                request.run()
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    if request.priority >= LINT:
+                        self._running_background -= 1
+                    if self._slots.get(request.slot) is request:
+                        del self._slots[request.slot]
+                    self._cond.notify_all()
+
+    def queue_depth(self):
+        """Return the number of queued requests, by priority name."""
+        with self._cond:
+            depth = dict((name, 0) for name in priority_names)
+            for priority, sequence, request in self._queue:
+                depth[priority_names[priority]] += 1
+            return depth
+
+    def status(self):
+        """Return the number of running tools and of queued requests."""
+        depth = self.queue_depth()
+        with self._cond:
+            return {"running": self._running,
+                    "running_background": self._running_background,
+                    "max_processes": self.max_processes,
+                    "queued": depth}
+
+    def submit(self, request):
+        with self._cond:
+            if request.slot is not None:
+                superseded = self._slots.get(request.slot)
+                self._slots[request.slot] = request
+            else:
+                superseded = None
+            if len(self._workers) < self.max_processes:
+                worker = threading.Thread(target=self._work,
+                                          name="Go tool runner")
+                worker.setDaemon(True)
+                worker.start()
+                self._workers.append(worker)
+            request.submitted = go_stats.clock()
+            request.queue_depth = len(self._queue)
+            self._sequence += 1
+            heapq.heappush(self._queue,
+                           (request.priority, self._sequence, request))
+            if request.queue_depth:
+                log.debug("queued %r behind %d requests", request,
+                          request.queue_depth)
+            self._cond.notify_all()
+        if superseded is not None:
+            superseded.cancel()
+        return request
+
+runner = ToolRunner()
+
+def run(cmd, input=None, env=None, cwd=None, timeout=None, slot=None,
+        priority=BACKGROUND):
+    """Run `cmd` on the tool runner, returning its (stdout, stderr)."""
+    request = runner.submit(ToolRequest(cmd, input=input, env=env, cwd=cwd,
+                                        slot=slot, priority=priority))
+    return request.wait(timeout)
@@ -0,0 +1,472 @@
+
+"""A lightweight, single-pass scanner for Go source.
+
+tokenize() splits Go source into tokens.  scan_declarations() finds the
+top-level declarations of a file (package clause, funcs, methods, types,
+consts and vars, including grouped declarations) without building a syntax
+tree: function bodies and other brace blocks are skipped over with a cheap
+regex that only looks for braces, comments and literals, so the cost is
+linear in the size of the file and mostly spent in the regex engine.
+"""
+
+import re
+
+# Token kinds.
+NEWLINE = "newline"
+COMMENT = "comment"
+IDENT = "ident"
+KEYWORD = "keyword"
+NUMBER = "number"
+CHAR = "char"
+STRING = "string"
+RAW_STRING = "raw"
+OP = "op"
+# A comment or literal missing its closing delimiter; it runs to the end of
+# the line (strings, runes) or of the text (block comments, raw strings).
+UNTERMINATED = "unterminated"
+ILLEGAL = "illegal"
+# A whole {...} block, as returned by scan_top_level().
+BLOCK = "block"
+
+keywords = frozenset("""
+    break        default      func         interface    select
+    case         defer        go           map          struct
+    chan         else         goto         package      switch
+    const        fallthrough  if           range        type
+    continue     for          import       return       var
+""".split())
+
+_token_re = re.compile(r"""
+    [ \t\r\f]*
+    (?:(?P<newline>\n)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<ident>[^\W\d]\w*)
+  | (?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+  | (?P<char>'(?:[^'\\\n]|\\.)*')
+  | (?P<string>"(?:[^"\\\n]|\\.)*")
+  | (?P<raw>`[^`]*`)
+  | (?P<unterminated>/\*|["'`])
+  | (?P<op><<=|>>=|&\^=|\.\.\.|&&|\|\||<-|\+\+|--|[-+*/%&|^<>=!:]=|<<|>>|&\^
+           |[-+*/%&|^<>=!~(){}\[\],;.:])
+  | (?P<illegal>[^ \t\r\f]))
+""", re.X | re.S | re.U)
+
+def _unterminated_end(text, start, endpos):
+    if text.startswith("/*", start) or text[start] == "`":
+        return endpos
+    end = text.find("\n", start, endpos)
+    return end < 0 and endpos or end
+
+def tokenize(text, pos=0, endpos=None):
+    """Generate the (kind, start, end) tokens of `text`.
+
+    Whitespace other than newlines is skipped.
+    """
+    if endpos is None:
+        endpos = len(text)
+    match = _token_re.match
+    while pos < endpos:
+        m = match(text, pos, endpos)
+        if m is None:
+            return  # trailing whitespace
+        kind = m.lastgroup
+        pos, end = m.span(kind)
+        if kind == IDENT and text[pos:end] in keywords:
+            kind = KEYWORD
+        elif kind == UNTERMINATED:
+            end = _unterminated_end(text, pos, endpos)
+        yield kind, pos, end
+        pos = end
+
+# Used inside brace blocks, where only braces (and whatever could hide a
+# brace) matter.
+_skip_re = re.compile(r"""
+    [^{}"'`/\n]+
+  | (?P<newline>\n)
+  | //[^\n]*
+  | /\*.*?\*/
+  | "(?:[^"\\\n]|\\.)*"
+  | '(?:[^'\\\n]|\\.)*'
+  | `[^`]*`
+  | (?P<unterminated>/\*|`)
+  | (?P<open>\{)
+  | (?P<close>\})
+  | .
+""", re.X | re.S)
+
+def skip_block(text, pos, endpos, line):
+    """Skip the brace block whose "{" is at text[pos].
+
+    Returns (end, line): the offset after the matching "}" (or endpos if
+    there is none, in which case the block is unterminated) and the line
+    number there.
+    """
+    depth = 0
+    match = _skip_re.match
+    while pos < endpos:
+        m = match(text, pos, endpos)
+        end = m.end()
+        group = m.lastgroup
+        if group == "open":
+            depth += 1
+        elif group == "close":
+            depth -= 1
+            if depth == 0:
+                return end, line
+        elif group == "newline":
+            line += 1
+        elif group == "unterminated":
+            # Runs to the end of the text, and so does the block.
+            return endpos, line + text.count("\n", pos, endpos)
+        elif end - pos > 1 and text[pos] in "/`":
+            line += text.count("\n", pos, end)
+        pos = end
+    return endpos, line
+
+def scan_top_level(text, pos=0, endpos=None, line=1):
+    """Return the top-level tokens of `text` as (kind, start, end, line).
+
+    Brace blocks are returned as single BLOCK tokens, comments are left
+    out. Also returns {last line: (start, end, first line)} for the
+    comments that start their line, for finding doc comments, and whether
+    a block, block comment or raw string was cut off by endpos.
+    """
+    if endpos is None:
+        endpos = len(text)
+    tokens = []
+    comments = {}
+    truncated = False
+    line_has_code = False
+    while pos < endpos:
+        for kind, start, end in tokenize(text, pos, endpos):
+            if kind == NEWLINE:
+                tokens.append((kind, start, end, line))
+                line += 1
+                line_has_code = False
+            elif kind == COMMENT or (kind == UNTERMINATED and text[start] in "/`"):
+                if kind == UNTERMINATED:
+                    truncated = True
+                lines = text.count("\n", start, end)
+                if not line_has_code:
+                    comments[line + lines] = (start, end, line)
+                line += lines
+            elif kind == OP and text[start] == "{":
+                end, end_line = skip_block(text, start, endpos, line)
+                if end == endpos:
+                    # Unterminated, or at least not followed by anything.
+                    truncated = True
+                tokens.append((BLOCK, start, end, line))
+                line = end_line
+                line_has_code = True
+                # Carry on tokenizing after the block.
+                pos = end
+                break
+            else:
+                tokens.append((kind, start, end, line))
+                if kind == RAW_STRING:
+                    line += text.count("\n", start, end)
+                line_has_code = True
+        else:
+            break
+    return tokens, comments, truncated
+
+class Declaration(object):
+    """A top-level Go declaration."""
+    __slots__ = ("kind", "name", "receiver", "type_kind", "line", "start",
+                 "name_start", "name_end", "signature", "doc")
+
+    def __init__(self, kind, name, line, start, name_start, name_end,
+                 receiver=None, type_kind=None, signature="", doc=""):
+        # "package", "func", "method", "type", "const" or "var"
+        self.kind = kind
+        self.name = name
+        # The receiver's type name, for methods.
+        self.receiver = receiver
+        # "struct", "interface" or "" for other type declarations.
+        self.type_kind = type_kind
+        self.line = line
+        # Offset of the declaring keyword (or of the spec, in groups).
+        self.start = start
+        self.name_start = name_start
+        self.name_end = name_end
+        self.signature = signature
+        self.doc = doc
+
+    def __repr__(self):
+        return "<Declaration %s %s%s line %d>" % (
+            self.kind, self.receiver and self.receiver + "." or "",
+            self.name, self.line)
+
+# Tokens after which a newline ends a statement (Go's semicolon insertion).
+statement_end_ops = frozenset([")", "]", "}", "++", "--"])
+statement_end_keywords = frozenset(["break", "continue", "fallthrough", "return"])
+
+class _DeclScanner(object):
+    def __init__(self, text, tokens, comments):
+        self.text = text
+        self.tokens = tokens
+        self.comments = comments
+        self.decls = []
+        # (offset, line) of each declaration, including its doc comment:
+        # places where scanning can be resumed.
+        self.checkpoints = []
+        # Whether the last declaration runs past the end of the tokens.
+        self.truncated = False
+
+    def value(self, i):
+        tok = self.tokens[i]
+        return self.text[tok[1]:tok[2]]
+
+    def kind(self, i):
+        if i < len(self.tokens):
+            return self.tokens[i][0]
+        return None
+
+    def is_op(self, i, op):
+        return i < len(self.tokens) and self.tokens[i][0] == OP \
+               and self.value(i) == op
+
+    def skip_newlines(self, i):
+        while self.kind(i) == NEWLINE:
+            i += 1
+        return i
+
+    def ends_statement(self, i):
+        """Whether a newline after token i ends the statement."""
+        kind = self.tokens[i][0]
+        if kind in (IDENT, NUMBER, CHAR, STRING, RAW_STRING, BLOCK):
+            return True
+        if kind == OP:
+            return self.value(i) in statement_end_ops
+        if kind == KEYWORD:
+            return self.value(i) in statement_end_keywords
+        return False
+
+    def spec_end(self, i, stop_at_block=False):
+        """Return the index of the token ending the spec that starts at i.
+
+        That is a ";" or statement-ending newline outside of parens and
+        brackets, the ")" closing an enclosing group, or (if stop_at_block)
+        a function body.
+        """
+        depth = 0
+        prev = None
+        n = len(self.tokens)
+        while i < n:
+            kind = self.tokens[i][0]
+            if kind == OP:
+                op = self.value(i)
+                if op in "([":
+                    depth += 1
+                elif op in ")]":
+                    if depth == 0:
+                        return i
+                    depth -= 1
+                elif op == ";" and depth == 0:
+                    return i
+            elif kind == NEWLINE:
+                if depth == 0 and prev is not None and self.ends_statement(prev):
+                    return i
+                i += 1
+                continue
+            elif kind == BLOCK and stop_at_block and depth == 0 \
+                 and not (prev is not None and self.kind(prev) == KEYWORD
+                          and self.value(prev) in ("struct", "interface")):
+                return i
+            prev = i
+            i += 1
+        self.truncated = True
+        return n
+
+    def checkpoint(self, i):
+        """Record the start of the declaration at token i."""
+        kind, start, end, first_line = self.tokens[i]
+        line = first_line - 1
+        while line in self.comments:
+            start, end, first_line = self.comments[line]
+            line = first_line - 1
+        self.checkpoints.append((start, first_line))
+
+    def doc(self, line):
+        """Return the doc comment ending on the line before `line`."""
+        parts = []
+        line -= 1
+        while line in self.comments:
+            start, end, first_line = self.comments[line]
+            parts.append(self.text[start:end])
+            line = first_line - 1
+        parts.reverse()
+        return "\n".join(parts)
+
+    def add(self, kind, name_index, start_index, end_index, **kwargs):
+        name_tok = self.tokens[name_index]
+        start_tok = self.tokens[start_index]
+        # The signature ends with the spec's last token, leaving out any
+        # trailing comment.
+        last = min(end_index, len(self.tokens)) - 1
+        while last > start_index and self.tokens[last][0] == NEWLINE:
+            last -= 1
+        sig_end = self.tokens[last][2]
+        self.decls.append(Declaration(
+            kind, self.text[name_tok[1]:name_tok[2]], name_tok[3],
+            start_tok[1], name_tok[1], name_tok[2],
+            signature=" ".join(self.text[start_tok[1]:sig_end].split()),
+            doc=self.doc(start_tok[3]), **kwargs))
+
+    def scan_func(self, i):
+        """Scan the func declaration whose keyword is token i."""
+        start = i
+        i += 1
+        receiver = None
+        if self.is_op(i, "("):
+            # A method: the receiver type is the identifier following the
+            # optional receiver name and "*".
+            i += 1
+            idents = []
+            while i < len(self.tokens) and not self.is_op(i, ")"):
+                if self.kind(i) == IDENT:
+                    idents.append(self.value(i))
+                elif self.is_op(i, "["):
+                    break
+                i += 1
+            if idents:
+                receiver = idents[len(idents) > 1 and 1 or 0]
+            while i < len(self.tokens) and not self.is_op(i, ")"):
+                i += 1
+            i += 1
+        end = self.spec_end(i, stop_at_block=True)
+        if self.kind(i) == IDENT:
+            if receiver:
+                self.add("method", i, start, end, receiver=receiver)
+            else:
+                self.add("func", i, start, end)
+        if self.kind(end) == BLOCK:
+            end += 1
+        return end
+
+    def scan_type_spec(self, i, start):
+        end = self.spec_end(i)
+        if self.kind(i) == IDENT:
+            j = i + 1
+            if self.is_op(j, "["):
+                depth = 0
+                while j < end:
+                    if self.is_op(j, "["):
+                        depth += 1
+                    elif self.is_op(j, "]"):
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    j += 1
+                j += 1
+            if self.is_op(j, "="):
+                j += 1
+            type_kind = ""
+            if self.kind(j) == KEYWORD and self.value(j) in ("struct", "interface"):
+                type_kind = self.value(j)
+            self.add("type", i, start, end, type_kind=type_kind)
+        return end
+
+    def scan_value_spec(self, kind, i, start):
+        end = self.spec_end(i)
+        while self.kind(i) == IDENT:
+            self.add(kind, i, start, end)
+            if not self.is_op(i + 1, ","):
+                break
+            i += 2
+        return end
+
+    def scan_decl(self, keyword, i):
+        """Scan the type/const/var declaration whose keyword is token i."""
+        if keyword == "type":
+            scan_spec = self.scan_type_spec
+        else:
+            scan_spec = lambda j, start: self.scan_value_spec(keyword, j, start)
+        i += 1
+        if not self.is_op(i, "("):
+            return scan_spec(i, i - 1)
+        # A grouped declaration: one spec per statement up to the ")".
+        i = self.skip_newlines(i + 1)
+        while i < len(self.tokens) and not self.is_op(i, ")"):
+            i = scan_spec(i, i)
+            if self.is_op(i, ")"):
+                break
+            i = self.skip_newlines(i + 1)
+        if i >= len(self.tokens):
+            self.truncated = True
+        return i + 1
+
+    def scan(self):
+        i = 0
+        n = len(self.tokens)
+        while i < n:
+            kind = self.tokens[i][0]
+            if kind == KEYWORD:
+                keyword = self.value(i)
+                if keyword == "func":
+                    self.checkpoint(i)
+                    i = self.scan_func(i)
+                    continue
+                if keyword in ("type", "const", "var"):
+                    self.checkpoint(i)
+                    i = self.scan_decl(keyword, i)
+                    continue
+                if keyword == "package" and self.kind(i + 1) == IDENT:
+                    self.add("package", i + 1, i, i + 2)
+                    i += 2
+                    continue
+            i += 1
+        return self.decls
+
+def scan_declarations(text, pos=0, endpos=None, line=1):
+    """Return the top-level Declarations in text[pos:endpos].
+
+    `pos` must be at the top level of the file (outside any declaration);
+    `line` is the line number there.
+    """
+    return scan_file(text, pos, endpos, line)[0]
+
+def scan_file(text, pos=0, endpos=None, line=1):
+    """Scan text[pos:endpos] for top-level declarations.
+
+    Returns (declarations, checkpoints, truncated): checkpoints are the
+    (offset, line) starts of the declarations (of their doc comments, if
+    any), from which a later scan may be resumed, and truncated is true
+    when the last declaration or block continues past endpos.
+    """
+    tokens, comments, truncated = scan_top_level(text, pos, endpos, line)
+    scanner = _DeclScanner(text, tokens, comments)
+    decls = scanner.scan()
+    return decls, scanner.checkpoints, truncated or scanner.truncated
+
+def scan_imports(text):
+    """Return the (name or None, import path) pairs imported by `text`.
+
+    Only the start of the text, up to the first declaration, is scanned.
+    """
+    imports = []
+    in_import = grouped = False
+    prev = prev_kind = None
+    for kind, start, end in tokenize(text):
+        if kind == NEWLINE or kind == COMMENT:
+            continue
+        value = text[start:end]
+        if kind == KEYWORD:
+            if value != "import" and value != "package":
+                break   # imports must come first
+            in_import = value == "import"
+            grouped = False
+        elif in_import:
+            if kind == OP and value == "(" and prev == "import":
+                grouped = True
+            elif kind == OP and value == ")":
+                in_import = False
+            elif kind == STRING or kind == RAW_STRING:
+                name = None
+                if prev_kind == IDENT or prev == ".":
+                    name = prev
+                imports.append((name, value[1:-1]))
+                if not grouped:
+                    in_import = False
+        prev, prev_kind = value, kind
+    return imports
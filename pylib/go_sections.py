@@ -0,0 +1,271 @@
+
+"""Go sections (the Sections List and Code Browser outline).
+
+Komodo finds a language's sections by running each of its section_regexes
+over the buffer with finditer().  For Go these are SectionPattern objects
+with the same interface, backed by go_scanner: a single scan of the buffer
+is shared by all the section kinds, comments and literals can't produce
+false sections, and methods and grouped declarations are found.
+
+The scans of the last few buffers are kept.  When a buffer is edited only
+the declarations from the one preceding the edit up to the one following
+it are scanned again; the others are reused, shifted by the size of the
+edit.  Buffers in large-file mode (see go_largefile) are only scanned up to
+go_largefile.section_scan_limit, and their scans aren't reused for edits.
+"""
+
+import bisect
+import threading
+import logging
+
+import go_largefile
+import go_scanner
+
+log = logging.getLogger("codeintel-go.sections")
+
+class _Scan(object):
+    __slots__ = ("text", "decls", "starts", "checkpoints")
+
+    def __init__(self, text, decls, checkpoints):
+        self.text = text
+        self.decls = decls
+        self.starts = [decl.start for decl in decls]
+        self.checkpoints = checkpoints
+
+def _common_prefix_length(a, b, chunk_size=4096):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i:i+chunk_size] == b[i:i+chunk_size]:
+        i += chunk_size
+    if i >= n:
+        return n
+    # The first difference is in this chunk; bisect for it.
+    lo, hi = i, min(i + chunk_size, n)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[i:mid] == b[i:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _common_suffix_length(a, b, limit, chunk_size=4096):
+    """Return the length of the common suffix of a and b, at most limit."""
+    len_a, len_b = len(a), len(b)
+    i = 0
+    while i < limit:
+        size = min(chunk_size, limit - i)
+        if a[len_a-i-size:len_a-i] != b[len_b-i-size:len_b-i]:
+            break
+        i += size
+    else:
+        return limit
+    lo, hi = i, min(i + chunk_size, limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len_a-mid:len_a-i] == b[len_b-mid:len_b-i]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+def _shifted(decl, delta, line_delta):
+    return go_scanner.Declaration(
+        decl.kind, decl.name, decl.line + line_delta, decl.start + delta,
+        decl.name_start + delta, decl.name_end + delta,
+        receiver=decl.receiver, type_kind=decl.type_kind,
+        signature=decl.signature, doc=decl.doc)
+
+class SectionScanner(object):
+    """Scans buffers for declarations, reusing the scans of earlier
+    versions of the buffers."""
+
+    # Number of buffer scans kept.
+    max_scans = 8
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scans = []    # most recently used first
+        self._large_scan = None
+
+    def clear(self):
+        """Forget the kept scans."""
+        with self._lock:
+            self._scans = []
+            self._large_scan = None
+
+    def _scan_large(self, text):
+        """Return the declarations in the first part of a large buffer."""
+        large_scan = self._large_scan
+        if large_scan is not None and large_scan.text == text:
+            return large_scan.decls
+        endpos = min(len(text), go_largefile.section_scan_limit)
+        decls, checkpoints, truncated = go_scanner.scan_file(text, 0, endpos)
+        self._large_scan = _Scan(text, decls, checkpoints)
+        return decls
+
+    def _rescan(self, old, text):
+        """Scan `text`, an edited version of old.text."""
+        old_text = old.text
+        prefix = _common_prefix_length(old_text, text)
+        suffix = _common_suffix_length(old_text, text,
+                                       min(len(old_text), len(text)) - prefix)
+        old_edit_end = len(old_text) - suffix
+        new_edit_end = len(text) - suffix
+        delta = len(text) - len(old_text)
+        line_delta = text.count("\n", prefix, new_edit_end) - \
+                     old_text.count("\n", prefix, old_edit_end)
+        checkpoints = old.checkpoints
+
+        # Resume from the last declaration starting before the edit (the
+        # text before it is unchanged, so that is still the top level)...
+        i = bisect.bisect_left(checkpoints, (prefix + 1, )) - 1
+        if i >= 0:
+            pos, line = checkpoints[i]
+        else:
+            pos, line = 0, 1
+        # ... up to the second declaration starting after it: the first
+        # may have gained or lost a doc comment.
+        j = bisect.bisect_left(checkpoints, (old_edit_end, )) + 1
+        if j < len(checkpoints):
+            sync_offset = checkpoints[j][0]
+            decls, new_checkpoints, truncated = go_scanner.scan_file(
+                text, pos, sync_offset + delta, line)
+            if not truncated:
+                k = bisect.bisect_left(old.starts, sync_offset)
+                if delta or line_delta:
+                    decls += [_shifted(decl, delta, line_delta)
+                              for decl in old.decls[k:]]
+                    new_checkpoints += [(offset + delta, cp_line + line_delta)
+                                        for offset, cp_line in checkpoints[j:]]
+                else:
+                    decls += old.decls[k:]
+                    new_checkpoints += checkpoints[j:]
+            else:
+                # The edit left something open; scan to the end.
+                j = len(checkpoints)
+        if j >= len(checkpoints):
+            decls, new_checkpoints, truncated = go_scanner.scan_file(
+                text, pos, None, line)
+        k = bisect.bisect_left(old.starts, pos)
+        return _Scan(text, old.decls[:k] + decls,
+                     checkpoints[:max(i, 0)] + new_checkpoints)
+
+    def scan(self, text):
+        """Return the top-level go_scanner.Declarations of `text`."""
+        if go_largefile.is_large(text):
+            return self._scan_large(text)
+        with self._lock:
+            scans = self._scans[:]
+        base = None
+        best = len(text) // 2
+        for old in scans:
+            if old.text == text:
+                result = old
+                break
+            n = min(len(old.text), len(text))
+            prefix = _common_prefix_length(old.text, text)
+            unchanged = prefix + _common_suffix_length(old.text, text,
+                                                       n - prefix)
+            if unchanged > best:
+                base, best = old, unchanged
+        else:
+            if base is not None:
+                result = self._rescan(base, text)
+            else:
+                decls, checkpoints, truncated = go_scanner.scan_file(text)
+                result = _Scan(text, decls, checkpoints)
+        with self._lock:
+            if base is not None and base in self._scans:
+                # Keep the edited version rather than the original.
+                self._scans.remove(base)
+            if result in self._scans:
+                self._scans.remove(result)
+            self._scans.insert(0, result)
+            del self._scans[self.max_scans:]
+        return result.decls
+
+section_scanner = SectionScanner()
+
+class SectionMatch(object):
+    """A regex match object for a declaration: group 1 is its name."""
+
+    def __init__(self, pattern, text, decl, pos, endpos):
+        self.re = pattern
+        self.string = text
+        self.decl = decl
+        self.pos = pos
+        self.endpos = endpos
+        self.lastindex = 1
+        self.lastgroup = None
+
+    def span(self, group=0):
+        if group == 0:
+            return self.decl.start, self.decl.name_end
+        if group == 1:
+            return self.decl.name_start, self.decl.name_end
+        raise IndexError("no such group")
+
+    def start(self, group=0):
+        return self.span(group)[0]
+
+    def end(self, group=0):
+        return self.span(group)[1]
+
+    def group(self, *groups):
+        if not groups:
+            groups = (0, )
+        values = tuple(self.string[slice(*self.span(group))]
+                       for group in groups)
+        if len(values) == 1:
+            return values[0]
+        return values
+
+    def groups(self, default=None):
+        return (self.group(1), )
+
+    def groupdict(self, default=None):
+        return {}
+
+class SectionPattern(object):
+    """A stand-in for a compiled section regex matching the declarations
+    accepted by `accept`."""
+
+    flags = 0
+    groups = 1
+    groupindex = {}
+
+    def __init__(self, description, accept, scanner=section_scanner):
+        self.pattern = description
+        self._accept = accept
+        self._scanner = scanner
+
+    def __repr__(self):
+        return "<SectionPattern %s>" % (self.pattern, )
+
+    def finditer(self, text, pos=0, endpos=None):
+        if endpos is None:
+            endpos = len(text)
+        accept = self._accept
+        for decl in self._scanner.scan(text):
+            if decl.start >= pos and decl.name_end <= endpos and accept(decl):
+                yield SectionMatch(self, text, decl, pos, endpos)
+
+    def search(self, text, pos=0, endpos=None):
+        for match in self.finditer(text, pos, endpos):
+            return match
+        return None
+
+    def findall(self, text, pos=0, endpos=None):
+        return [match.group(1) for match in self.finditer(text, pos, endpos)]
+
+section_regexes = [
+    ("function", SectionPattern("func and method declarations",
+        lambda decl: decl.kind in ("func", "method"))),
+    ("object", SectionPattern("type declarations",
+        lambda decl: decl.kind == "type" and decl.type_kind != "interface")),
+    ("interface", SectionPattern("interface type declarations",
+        lambda decl: decl.kind == "type" and decl.type_kind == "interface")),
+    ("class", SectionPattern("const declarations",
+        lambda decl: decl.kind == "const")),
+]
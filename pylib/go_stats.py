@@ -0,0 +1,261 @@
+
+"""Latency statistics of the Go tools run by the extension.
+
+Every external tool invocation (gofmt, gocode, godef, go list, go vet, go
+version, ...) is timed: how long it waited in go_process's queue (and how
+many requests were queued ahead of it), how long spawning the process took,
+the wall time until its output was read, the bytes written to and read
+from it, and how long parsing its output took.  Outcomes other than
+success (timeouts, cancellations, failures to run) are counted.  The most
+recent samples of each measure are kept per tool, for percentiles.
+
+go_process's runner times the tools run through it; their callers only
+time the parsing of the output:
+
+    request = go_process.runner.submit(go_process.ToolRequest(cmd, input))
+    stdout, stderr = request.wait()
+    with go_stats.parse_timer(go_stats.tool_name(cmd)):
+        ...
+
+The statistics can be read with summary() or format(), and written to a
+file by notifying the "golang_tool_stats" topic (the data is the file to
+write, or empty for tool-stats.json in the extension's cache directory),
+as the Tools menu's "Write Go Tool Statistics" command does.
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import logging
+from collections import deque
+
+from xpcom import components
+
+log = logging.getLogger("codeintel-go.stats")
+
+# Number of samples of each measure kept per tool.
+window_size = 1000
+
+# Outcomes of an invocation.
+OK = "ok"
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+ERROR = "error"
+
+if sys.platform.startswith("win"):
+    clock = time.clock
+else:
+    clock = time.time
+
+def _percentile(sorted_samples, fraction):
+    index = int(round(fraction * (len(sorted_samples) - 1)))
+    return sorted_samples[index]
+
+class _Measure(object):
+    """The last window_size samples of one measure."""
+
+    def __init__(self):
+        self.samples = deque(maxlen=window_size)
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return None
+        return {
+            "count": self.count,
+            "mean": self.total / float(self.count),
+            "p50": _percentile(samples, 0.5),
+            "p95": _percentile(samples, 0.95),
+            "p99": _percentile(samples, 0.99),
+            "max": samples[-1],
+        }
+
+class _ToolStats(object):
+    measure_names = ("queue", "spawn", "wall", "parse", "bytes_in",
+                     "bytes_out", "depth")
+    # Measures that aren't times.
+    count_names = ("bytes_in", "bytes_out", "depth")
+
+    def __init__(self):
+        self.measures = dict((name, _Measure()) for name in self.measure_names)
+        self.outcomes = {}
+
+class StatsRegistry(object):
+    """Statistics of all the tools, by tool name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools = {}
+
+    def _get(self, tool):
+        stats = self._tools.get(tool)
+        if stats is None:
+            stats = self._tools[tool] = _ToolStats()
+        return stats
+
+    def record(self, tool, **measures):
+        """Add samples, e.g. record("gofmt", wall=0.05, bytes_in=1200)."""
+        with self._lock:
+            stats = self._get(tool)
+            for name, value in measures.items():
+                if value is not None:
+                    stats.measures[name].add(value)
+
+    def count(self, tool, outcome):
+        with self._lock:
+            stats = self._get(tool)
+            stats.outcomes[outcome] = stats.outcomes.get(outcome, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._tools = {}
+
+    def summary(self):
+        """Return {tool: {"outcomes": {...}, measure: {...}}}.
+
+        Times are in seconds. Each measure has its count, mean, p50, p95,
+        p99 and max.
+        """
+        with self._lock:
+            result = {}
+            for tool, stats in self._tools.items():
+                summary = result[tool] = {"outcomes": dict(stats.outcomes)}
+                for name, measure in stats.measures.items():
+                    measure_summary = measure.summary()
+                    if measure_summary is not None:
+                        summary[name] = measure_summary
+            return result
+
+    def format(self):
+        """Return the statistics as a table, times in milliseconds."""
+        lines = ["%-12s %-9s %7s %9s %9s %9s %9s" % (
+                 "tool", "measure", "count", "p50", "p95", "p99", "max")]
+        for tool, summary in sorted(self.summary().items()):
+            for name in _ToolStats.measure_names:
+                s = summary.get(name)
+                if s is None:
+                    continue
+                scale = name not in _ToolStats.count_names and 1000.0 or 1
+                lines.append("%-12s %-9s %7d %9.1f %9.1f %9.1f %9.1f" % (
+                    tool, name, s["count"], s["p50"] * scale,
+                    s["p95"] * scale, s["p99"] * scale, s["max"] * scale))
+            if summary["outcomes"]:
+                outcomes = ", ".join(
+                    "%s=%d" % kv for kv in sorted(summary["outcomes"].items()))
+                lines.append("%-12s %s" % (tool, outcomes))
+        return "\n".join(lines)
+
+    def dump(self, path=None):
+        """Write the statistics as JSON to `path`, returning the path.
+
+        The current state of go_process's runner, and how long each step
+        of the warm-up took, are included.
+        """
+        import go_process
+        import go_warmup
+        if not path:
+            import go_cache
+            path = os.path.join(go_cache.get_cache_dir(), "tool-stats.json")
+        with open(path, "wb") as fout:
+            json.dump({"time": time.time(), "tools": self.summary(),
+                       "runner": go_process.runner.status(),
+                       "warmup": go_warmup.warm_up.readiness()}, fout,
+                      indent=2, sort_keys=True)
+        return path
+
+stats = StatsRegistry()
+
+def tool_name(cmd):
+    """Return the name statistics are kept under for command `cmd`."""
+    name = os.path.basename(cmd[0])
+    if name.lower().endswith(".exe"):
+        name = name[:-4]
+    if name == "go" and len(cmd) > 1:
+        # "go vet", "go list", ... are quite different tools.
+        name = "go " + cmd[1]
+    return name
+
+class Invocation(object):
+    """The timing of one tool invocation."""
+
+    def __init__(self, tool, bytes_in=0, queued_since=None, queue_depth=None):
+        self.tool = tool
+        self.bytes_in = bytes_in
+        self.start = clock()
+        self.spawn_time = None
+        self.queue_time = None
+        if queued_since is not None:
+            self.queue_time = self.start - queued_since
+        self.queue_depth = queue_depth
+
+    def spawned(self):
+        self.spawn_time = clock() - self.start
+
+    def finished(self, stdout=None, stderr=None, outcome=OK):
+        bytes_out = len(stdout or "") + len(stderr or "")
+        stats.record(self.tool, queue=self.queue_time, spawn=self.spawn_time,
+                     wall=clock() - self.start, bytes_in=self.bytes_in,
+                     bytes_out=bytes_out, depth=self.queue_depth)
+        stats.count(self.tool, outcome)
+
+    def failed(self, outcome=ERROR):
+        stats.record(self.tool, queue=self.queue_time, depth=self.queue_depth)
+        stats.count(self.tool, outcome)
+
+def start(cmd, input=None, queued_since=None, queue_depth=None):
+    """Start timing a run of `cmd`, given `input` on stdin.
+
+    `queued_since` is the clock() time the run was requested at, if it was
+    queued, and `queue_depth` the number of requests queued ahead of it.
+    """
+    return Invocation(tool_name(cmd), input and len(input) or 0,
+                      queued_since, queue_depth)
+
+class parse_timer(object):
+    """Times the parsing of a tool's output (a context manager)."""
+
+    def __init__(self, tool):
+        self.tool = tool
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stats.record(self.tool, parse=clock() - self.start)
+
+class _StatsObserver(object):
+    _com_interfaces_ = [components.interfaces.nsIObserver]
+
+    def observe(self, subject, topic, data):
+        if topic == "golang_tool_stats":
+            try:
+                path = stats.dump(data or None)
+                log.info("Go tool statistics written to %r:\n%s", path,
+                         stats.format())
+            except (IOError, OSError), e:
+                log.warn("Unable to write Go tool statistics: %s", e)
+
+_observer = None
+
+def register_observer():
+    """Listen for "golang_tool_stats" requests; call on the main thread."""
+    global _observer
+    if _observer is not None:
+        return
+    _observer = _StatsObserver()
+    try:
+        obsSvc = components.classes["@mozilla.org/observer-service;1"].\
+                    getService(components.interfaces.nsIObserverService)
+        obsSvc.addObserver(_observer, "golang_tool_stats", False)
+    except Exception, e:
+        log.warn("Unable to register the tool statistics observer: %s", e)
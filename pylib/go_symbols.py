@@ -0,0 +1,220 @@
+
+"""An index of top-level Go declarations, for go to definition.
+
+Files are scanned with go_scanner and re-scanned only when their mtime or
+size changes (e.g. when they are saved), so looking up a package-level
+symbol is a couple of dict lookups.  Identifiers that may be local to the
+function being edited, or that resolve to several declarations, are left
+to godef.
+"""
+
+import os
+import re
+import threading
+import logging
+
+import go_scanner
+import go_pkgindex
+
+log = logging.getLogger("codeintel-go.symbols")
+
+class _FileSymbols(object):
+    __slots__ = ("stamp", "package", "decls", "by_name")
+
+    def __init__(self, stamp, decls):
+        self.stamp = stamp
+        self.decls = decls
+        self.package = None
+        # Name -> package-level (non-method) declarations of that name.
+        self.by_name = {}
+        for decl in decls:
+            if decl.kind == "package":
+                self.package = decl.name
+            elif decl.kind != "method":
+                self.by_name.setdefault(decl.name, []).append(decl)
+
+class SymbolIndex(object):
+    """Top-level declarations of Go files, kept up to date per file."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}    # path -> _FileSymbols
+        self._dirs = {}     # dir -> (mtime, [.go file names])
+
+    def _read(self, path):
+        with open(path, "rb") as fin:
+            return fin.read().decode("utf-8", "replace")
+
+    def get_file(self, path):
+        """Return the _FileSymbols of the file at `path`, or None."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime, st.st_size)
+        entry = self._files.get(path)
+        if entry is None or entry.stamp != stamp:
+            try:
+                text = self._read(path)
+            except (IOError, OSError):
+                return None
+            entry = _FileSymbols(stamp, go_scanner.scan_declarations(text))
+            with self._lock:
+                self._files[path] = entry
+        return entry
+
+    def list_go_files(self, pkg_dir):
+        try:
+            mtime = os.stat(pkg_dir).st_mtime
+        except OSError:
+            return []
+        listing = self._dirs.get(pkg_dir)
+        if listing is None or listing[0] != mtime:
+            names = sorted(name for name in os.listdir(pkg_dir)
+                           if name.endswith(".go"))
+            listing = self._dirs[pkg_dir] = (mtime, names)
+        return listing[1]
+
+    def package_files(self, pkg_dir, include_tests=False):
+        """Generate (path, _FileSymbols) for the files of a package."""
+        for name in self.list_go_files(pkg_dir):
+            if name.endswith("_test.go") and not include_tests:
+                continue
+            path = os.path.join(pkg_dir, name)
+            entry = self.get_file(path)
+            if entry is not None:
+                yield path, entry
+
+    def index_package(self, pkg_dir, include_tests=False):
+        """Bring the index of a package's files up to date; return the
+        number of files indexed."""
+        return len(list(self.package_files(pkg_dir, include_tests)))
+
+    def package_name(self, pkg_dir):
+        for path, entry in self.package_files(pkg_dir):
+            if entry.package and not entry.package.endswith("_test"):
+                return entry.package
+        return None
+
+    def find(self, pkg_dir, name, current_path=None, current_text=None):
+        """Return the (path, Declaration)s of package-level `name`.
+
+        The unsaved `current_text` is used for the file at `current_path`.
+        """
+        matches = []
+        include_tests = current_path is not None \
+                        and current_path.endswith("_test.go")
+        for path, entry in self.package_files(pkg_dir, include_tests):
+            if path == current_path and current_text is not None:
+                continue
+            matches += [(path, decl) for decl in entry.by_name.get(name, ())]
+        if current_text is not None:
+            entry = _FileSymbols(None, go_scanner.scan_declarations(current_text))
+            matches += [(current_path, decl) for decl in entry.by_name.get(name, ())]
+        return matches
+
+symbol_index = SymbolIndex()
+
+def _identifier_at(buf, pos):
+    """Return (start, end) of the identifier at pos, or None."""
+    start = pos
+    while start > 0 and (buf[start-1].isalnum() or buf[start-1] == "_"):
+        start -= 1
+    end = pos
+    while end < len(buf) and (buf[end].isalnum() or buf[end] == "_"):
+        end += 1
+    if start == end or buf[start].isdigit():
+        return None
+    return start, end
+
+def selector_qualifier(buf, start):
+    """Return the identifier before a "." immediately preceding `start`."""
+    if start == 0 or buf[start-1] != ".":
+        return None
+    ident = _identifier_at(buf, start - 1)
+    if ident is None:
+        return None
+    return buf[ident[0]:ident[1]]
+
+_local_decl_template = r"""
+    \b(?:var|const)\s+(?:\w+\s*,\s*)*%(name)s\b              # var x / const x
+  | \b%(name)s\s*(?:,\s*\w+\s*)*:=                            # x := / x, y :=
+  | (?:\(|,)\s*%(name)s(?:\s*,\s*\w+)*\s+(?:[*\[\w.]|<-)       # parameter x T
+"""
+
+def may_be_local(buf, pos, name):
+    """Whether `name` may be declared in the function containing pos."""
+    func_start = buf.rfind("\nfunc", 0, pos)
+    if func_start < 0:
+        return False
+    region = buf[func_start:pos]
+    pattern = re.compile(_local_decl_template % {"name": re.escape(name)},
+                         re.X | re.U)
+    return pattern.search(region) is not None
+
+def _import_dirs(import_path, path, env, go_exe):
+    """Generate the directories that may hold `import_path`."""
+    for vendor_dir in go_pkgindex.find_vendor_dirs(os.path.dirname(path)):
+        yield os.path.join(vendor_dir, import_path)
+    if go_exe:
+        yield os.path.join(go_pkgindex.get_goroot(go_exe, env), "src", import_path)
+    for gopath in go_pkgindex.get_gopaths(env, go_exe):
+        yield os.path.join(gopath, "src", import_path)
+
+def resolve_import(import_path, path, env, go_exe):
+    """Return the directory of `import_path` as imported from `path`, or
+    None."""
+    for pkg_dir in _import_dirs(import_path, path, env, go_exe):
+        if os.path.isdir(pkg_dir):
+            return pkg_dir
+    return None
+
+def find_package(buf, qualifier, path, env, go_exe):
+    """Return the (import path, directory) of the package imported as
+    `qualifier`, or None."""
+    for name, import_path in go_scanner.scan_imports(buf):
+        if name not in (None, qualifier):
+            continue
+        for pkg_dir in _import_dirs(import_path, path, env, go_exe):
+            if not os.path.isdir(pkg_dir):
+                continue
+            if name == qualifier or \
+               symbol_index.package_name(pkg_dir) == qualifier:
+                return import_path, pkg_dir
+            break
+    return None
+
+def _find_package_dir(buf, qualifier, path, env, go_exe):
+    """Return the directory of the package imported as `qualifier`."""
+    package = find_package(buf, qualifier, path, env, go_exe)
+    return package and package[1]
+
+def find_definition(buf, pos, path, env, go_exe):
+    """Find the package-level declaration of the identifier at `pos`.
+
+    Returns (filename, line), or None when the index can't give a single,
+    certain answer.
+    """
+    if not path:
+        return None
+    ident = _identifier_at(buf, pos)
+    if ident is None:
+        return None
+    name = buf[ident[0]:ident[1]]
+    if name in go_scanner.keywords:
+        return None
+    qualifier = selector_qualifier(buf, ident[0])
+    if qualifier is not None:
+        pkg_dir = _find_package_dir(buf, qualifier, path, env, go_exe)
+        if pkg_dir is None or not name[0].isupper():
+            return None     # a field or method, or not in the index
+        matches = symbol_index.find(pkg_dir, name)
+    else:
+        if may_be_local(buf, ident[0], name):
+            return None
+        matches = symbol_index.find(os.path.dirname(path), name,
+                                    current_path=path, current_text=buf)
+    if len(matches) != 1:
+        return None
+    filename, decl = matches[0]
+    return filename, decl.line
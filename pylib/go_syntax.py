@@ -0,0 +1,395 @@
+
+"""An in-process syntax check of Go source.
+
+check() makes a single pass over a buffer and reports the syntax errors
+that are certain without a full parse:
+
+  - illegal characters, and unterminated comments and literals,
+  - malformed number, rune and string literals,
+  - unbalanced or mismatched (), [] and {},
+  - a newline where a comma is needed inside () and [],
+  - a missing package clause, statements outside function bodies, imports
+    after other declarations, "{" on the line after a func signature and
+    "else" on the line after "}".
+
+It needs no gofmt process, so it gives diagnostics when gofmt isn't
+installed, and answers for a small broken buffer sooner than gofmt can.
+It only reports what gofmt would also reject, but doesn't find everything
+gofmt does: a buffer it passes still has to be checked by gofmt.
+
+The buffer is split as go_scanner.tokenize() would, except that runs of
+identifiers, keywords and operators other than brackets are matched
+whole: only their first and last words matter here (for statement starts
+and Go's semicolon insertion), and matching them whole takes a fraction
+of the time.
+
+Problems are (description, line, columnStart, columnEnd) tuples, as
+parsed from gofmt's diagnostics by go_lint.
+"""
+
+import re
+import logging
+
+import go_scanner
+
+log = logging.getLogger("koGoLanguage.syntax")
+
+# gofmt stops after this many errors too.
+max_errors = 10
+
+# Characters beyond ASCII are taken as letters: in a UTF-8 encoded buffer
+# they are bytes that \w doesn't always match.
+_word = r"(?:[^\W\d]\w*|[^\x00-\x7f]+\w*)"
+_run_op_chars = ".,:=+*%&|^<>!~-"
+_run_ops = "[%s]" % (_run_op_chars, )
+
+_chunk_re = re.compile(r"""
+    [ \t\r\f]*
+    (?:(?P<newline>\n)
+  | (?P<run>(?:%(word)s|%(ops)s)(?:[ \t\r\f]*(?:%(word)s|%(ops)s))*)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<number>\.?\d(?:[eEpP][+-]|[\w.])*)
+  | (?P<char>'(?:[^'\\\n]|\\.)*')
+  | (?P<string>"(?:[^"\\\n]|\\.)*")
+  | (?P<raw>`[^`]*`)
+  | (?P<unterminated>/\*|["'`])
+  | (?P<bracket>[(){}\[\]])
+  | (?P<op>;|/=?)
+  | (?P<illegal>[^ \t\r\f]))
+""" % {"word": _word, "ops": _run_ops}, re.X | re.S | re.U)
+
+_first_word_re = re.compile(r"\w+", re.U)
+_last_word_re = re.compile(r"\w+$", re.U)
+
+_number_re = re.compile(r"""
+    (?:0[xX](?:_?[0-9a-fA-F](?:_?[0-9a-fA-F])*)?
+           (?:\.(?:[0-9a-fA-F](?:_?[0-9a-fA-F])*)?)?[pP][+-]?\d(?:_?\d)*
+     | 0[xX]_?[0-9a-fA-F](?:_?[0-9a-fA-F])*
+     | 0[bB]_?[01](?:_?[01])*
+     | 0[oO]_?[0-7](?:_?[0-7])*
+     | (?:\d(?:_?\d)*)?\.(?:\d(?:_?\d)*)?(?:[eE][+-]?\d(?:_?\d)*)?
+     | \d(?:_?\d)*[eE][+-]?\d(?:_?\d)*
+     | \d(?:_?\d)*
+    )i?
+""", re.X)
+
+_escape_re = re.compile(r"""\\(?:[abfnrtv\\'"]|[0-7]{3}|x[0-9a-fA-F]{2}
+                                 |u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8})""", re.X)
+
+_unterminated_messages = {
+    '"': "string literal not terminated",
+    "'": "rune literal not terminated",
+    "`": "raw string literal not terminated",
+    "/": "comment not terminated",
+}
+
+_closers = {"(": ")", "[": "]", "{": "}"}
+# Keywords whose "(" opens a group of specs, one per line.
+_group_keywords = frozenset(["import", "var", "const", "type"])
+_declaration_keywords = frozenset(["func", "var", "const", "type"])
+
+def _is_number(value):
+    m = _number_re.match(value)
+    return m is not None and m.end() == len(value)
+
+def _number_end(text, start, end):
+    """Return where the Go number literal at text[start:end] ends.
+
+    Number tokens run on over dots and signs ("0.Field", "0xe-1"), which
+    go's scanner would end the number before.  A malformed number is
+    returned whole.
+    """
+    m = _number_re.match(text, start, end)
+    if m is None or m.end() == end:
+        return end
+    number_end = m.end()
+    if text[number_end - 1] == "." and number_end - 1 > start and \
+       (text[number_end].isalpha() or text[number_end] == "_"):
+        return number_end - 1   # a selector on an index: a[0].Field
+    if text[number_end] in "+-.":
+        return number_end
+    return end
+
+class _Checker(object):
+    def __init__(self, text):
+        self.text = text
+        self.problems = []
+        self.line = 1
+        self.line_start = 0
+        # The structure is only checked up to its first error.
+        self.structure_ok = True
+        self.stack = []         # (closer, is a group) of the open brackets
+        # Whether a newline after the last token ends the statement, and
+        # the last token, if it was a word.
+        self.prev_ends = False
+        self.prev_word = None
+        self.at_statement_start = True
+        self.newline_ended = False  # the last statement ended with a newline
+        self.seen_package = False
+        self.seen_declaration = False
+
+    def error(self, description, start, end=None):
+        column = start - self.line_start + 1
+        if end is None:
+            end = start + 1
+        line_end = self.text.find("\n", start, end)
+        if line_end >= 0:
+            end = line_end
+        self.problems.append((description, self.line, column,
+                              column + max(end - start, 1)))
+
+    def structure_error(self, description, start, end=None):
+        self.error(description, start, end)
+        self.structure_ok = False
+
+    def advance_lines(self, start, end):
+        newlines = self.text.count("\n", start, end)
+        if newlines:
+            self.line += newlines
+            self.line_start = self.text.rfind("\n", start, end) + 1
+
+    def check_escapes(self, start, end, quote):
+        text = self.text
+        i = text.find("\\", start, end)
+        while i >= 0:
+            m = _escape_re.match(text, i, end)
+            if m is None or (text[i+1] in "'\"" and text[i+1] != quote):
+                if text[i+1] in "xuU01234567":
+                    self.error("illegal character in escape sequence", i, i + 2)
+                else:
+                    self.error("unknown escape sequence", i, i + 2)
+                return False
+            i = text.find("\\", m.end(), end)
+        return True
+
+    def check_rune(self, start, end):
+        text = self.text
+        body = text[start+1:end-1]
+        if not body:
+            self.error("illegal rune literal", start, end)
+        elif body[0] == "\\":
+            if not self.check_escapes(start + 1, end - 1, "'"):
+                return False
+            if _escape_re.match(text, start + 1, end - 1).end() != end - 1:
+                self.error("more than one character in rune literal",
+                           start, end)
+        else:
+            if isinstance(body, str):
+                try:
+                    body = body.decode("utf-8")
+                except UnicodeDecodeError:
+                    return True
+            if len(body) != 1:
+                self.error("more than one character in rune literal",
+                           start, end)
+        return True
+
+    def check_number(self, start, end):
+        value = self.text[start:end]
+        digits = value.replace("_", "")
+        if not _is_number(value):
+            if _is_number(digits):
+                self.error("'_' must separate successive digits", start, end)
+            else:
+                self.error("malformed number literal %s" % (value, ),
+                           start, end)
+            return
+        if len(digits) > 1 and digits[0] == "0" and digits.isdigit():
+            for digit in digits:
+                if digit in "89":
+                    self.error("invalid digit %r in octal literal" % (digit, ),
+                               start, end)
+                    return
+
+    def newline(self, start):
+        """Handle a newline: Go ends the statement after some tokens."""
+        if not self.prev_ends:
+            return
+        if self.structure_ok and self.stack:
+            closer, is_group = self.stack[-1]
+            if closer != "}" and not is_group:
+                self.structure_error("unexpected newline, expected ',' or '%s'"
+                                     % (closer, ), start)
+        self.prev_ends = False
+        self.prev_word = None
+        self.at_statement_start = True
+        self.newline_ended = True
+
+    def top_level_statement(self, value, start, end):
+        if not self.seen_package:
+            if value != "package":
+                self.structure_error("expected 'package', found %s"
+                                     % (value, ), start, end)
+            self.seen_package = True
+        elif value == "package":
+            self.structure_error("expected declaration, found 'package'",
+                                 start, end)
+        elif value == "import":
+            if self.seen_declaration:
+                self.error("imports must appear before other declarations",
+                           start, end)
+        elif value in _declaration_keywords:
+            self.seen_declaration = True
+        elif value == "{" and self.newline_ended:
+            self.structure_error("unexpected semicolon or newline before {",
+                                 start, end)
+        elif value != ";":
+            self.structure_error("non-declaration statement outside "
+                                 "function body", start, end)
+
+    def statement_start(self, value, start, end):
+        """Check the first token of a statement."""
+        if not self.stack:
+            self.top_level_statement(value, start, end)
+        elif value == "else" and self.stack[-1][0] == "}":
+            self.structure_error("expected statement, found 'else'",
+                                 start, end)
+
+    def run(self, start, end):
+        """Handle a run of words and operators."""
+        text = self.text
+        if self.at_statement_start and self.structure_ok:
+            m = _first_word_re.match(text, start, end)
+            if m is not None:
+                self.statement_start(m.group(), start, m.end())
+            else:
+                self.statement_start(text[start], start, start + 1)
+        self.at_statement_start = False
+        self.newline_ended = False
+        if text[end-1] in _run_op_chars:
+            self.prev_word = None
+            self.prev_ends = text[end-2:end] in ("++", "--")
+            return
+        # Keywords are short: only look for them at the end of the run.
+        m = _last_word_re.search(text, max(start, end - 12), end)
+        if m is None:
+            # A long identifier, or letters beyond ASCII.
+            self.prev_word = None
+            self.prev_ends = True
+            return
+        word = m.group()
+        self.prev_word = word
+        self.prev_ends = word not in go_scanner.keywords or \
+                         word in go_scanner.statement_end_keywords
+
+    def bracket(self, value, start, end):
+        stack = self.stack
+        if self.structure_ok:
+            if self.at_statement_start:
+                self.statement_start(value, start, end)
+            if value in _closers:
+                stack.append((_closers[value], value == "(" and
+                              self.prev_word in _group_keywords))
+            elif not stack:
+                self.structure_error("expected declaration, found '%s'"
+                                     % (value, ), start, end)
+            elif stack[-1][0] != value:
+                self.structure_error("expected '%s', found '%s'"
+                                     % (stack[-1][0], value), start, end)
+            else:
+                stack.pop()
+        self.at_statement_start = value == "{"
+        self.newline_ended = False
+        self.prev_ends = value in ")]}"
+        self.prev_word = None
+
+    def literal(self, start, end):
+        if self.at_statement_start and self.structure_ok:
+            self.statement_start(self.text[start:end], start, end)
+        self.at_statement_start = False
+        self.newline_ended = False
+        self.prev_ends = True
+        self.prev_word = None
+
+    def check(self, pos=0):
+        text = self.text
+        endpos = len(text)
+        match = _chunk_re.match
+        problems = self.problems
+        while pos < endpos:
+            if len(problems) >= max_errors:
+                break
+            m = match(text, pos)
+            if m is None:
+                pos = endpos    # trailing whitespace
+                continue
+            kind = m.lastgroup
+            start, end = m.span(kind)
+            pos = end
+            if kind == "run":
+                self.run(start, end)
+            elif kind == "newline":
+                self.newline(start)
+                self.line += 1
+                self.line_start = end
+            elif kind == "bracket":
+                self.bracket(text[start], start, end)
+            elif kind == "comment":
+                if text.count("\n", start, end):
+                    # A comment spanning lines ends the statement as a
+                    # newline would.
+                    self.newline(start)
+                    self.advance_lines(start, end)
+            elif kind == "op":
+                if self.at_statement_start and self.structure_ok:
+                    self.statement_start(text[start:end], start, end)
+                self.at_statement_start = text[start] == ";"
+                self.newline_ended = False
+                self.prev_ends = False
+                self.prev_word = None
+            elif kind == "number":
+                number_end = _number_end(text, start, end)
+                if number_end < end:
+                    pos = end = number_end
+                self.check_number(start, end)
+                self.literal(start, end)
+            elif kind == "string":
+                self.literal(start, end)
+                if not self.check_escapes(start + 1, end - 1, '"'):
+                    self.advance_lines(start, end)  # an escaped newline
+            elif kind == "char":
+                self.literal(start, end)
+                if not self.check_rune(start, end):
+                    self.advance_lines(start, end)
+            elif kind == "raw":
+                self.literal(start, end)
+                self.advance_lines(start, end)
+            elif kind == "unterminated":
+                value = text[start]
+                if value in "/`":
+                    # It runs to the end of the buffer.
+                    self.error(_unterminated_messages[value], start, endpos)
+                    self.structure_ok = False
+                    break
+                end = pos = text.find("\n", start)
+                if end < 0:
+                    end = pos = endpos
+                self.error(_unterminated_messages[value], start, end)
+                self.literal(start, end)
+            else:
+                value = text[start]
+                self.error("illegal character U+%04X %r" % (ord(value), value),
+                           start, end)
+        else:
+            self.end_of_text()
+        return problems
+
+    def end_of_text(self):
+        if not self.structure_ok:
+            return
+        end = len(self.text)
+        if not self.seen_package:
+            self.structure_error("expected 'package', found 'EOF'", end)
+        elif self.stack:
+            self.structure_error("expected '%s', found 'EOF'"
+                                 % (self.stack[-1][0], ), end)
+
+def check(text):
+    """Return the syntax problems found in the Go source `text`."""
+    pos = 0
+    if isinstance(text, unicode):
+        if text.startswith(u"\ufeff"):
+            pos = 1     # byte order mark
+    elif text.startswith("\xef\xbb\xbf"):
+        pos = 3
+    return _Checker(text).check(pos)
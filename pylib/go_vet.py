@@ -0,0 +1,162 @@
+
+"""Background `go vet` (and optional build check) of Go packages.
+
+go vet type checks a whole package, which is far too slow to do while the
+user waits for syntax errors.  Packages are instead queued for a worker
+thread, and the problems found are remembered against a hash of the
+package's file contents: a package is only vetted again once one of its
+files has changed.
+"""
+
+import os
+import re
+import Queue
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+import go_process
+import go_stats
+from xpcom import components
+
+log = logging.getLogger("koGoLanguage.vet")
+
+# Older versions of go vet don't report a column.
+_ptn_vet = re.compile(r'^(.*?\.go):(\d+):(?:(\d+):)?\s*(.*)')
+
+class _PackageState(object):
+    def __init__(self):
+        # File name -> ((mtime, size), content sha1)
+        self.file_hashes = {}
+        self.package_hash = None
+
+class GoVetRunner(object):
+    """Vets packages on a worker thread, caching results by content hash."""
+
+    # Maximum number of package results remembered.
+    cache_size = 128
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._queued = set()
+        self._thread = None
+        self._packages = {}     # package dir -> _PackageState
+        # Package content hash -> {file path: [problem, ...]}
+        self._results = OrderedDict()
+
+    def _hash_package(self, pkg_dir, state):
+        """Update state with the current content hashes of pkg_dir's files."""
+        file_hashes = {}
+        for name in sorted(os.listdir(pkg_dir)):
+            if not name.endswith(".go"):
+                continue
+            path = os.path.join(pkg_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stamp = (st.st_mtime, st.st_size)
+            previous = state.file_hashes.get(name)
+            if previous and previous[0] == stamp:
+                file_hashes[name] = previous
+                continue
+            with open(path, "rb") as fin:
+                file_hashes[name] = (stamp, hashlib.sha1(fin.read()).hexdigest())
+        state.file_hashes = file_hashes
+        state.package_hash = hashlib.sha1(repr(sorted(
+            (name, h[1]) for name, h in file_hashes.items()))).hexdigest()
+
+    def _run_tool(self, cmd, pkg_dir, env, problems):
+        try:
+            stdout, stderr = go_process.run(cmd, cwd=pkg_dir, env=env,
+                                            priority=go_process.BACKGROUND)
+        except OSError, e:
+            log.error("Failed to run %s: %s", cmd, e)
+            return
+        with go_stats.parse_timer(go_stats.tool_name(cmd)):
+            self._parse_problems(stderr, pkg_dir, problems)
+
+    def _parse_problems(self, stderr, pkg_dir, problems):
+        for line in stderr.splitlines():
+            m = _ptn_vet.match(line)
+            if not m:
+                continue
+            path = os.path.normpath(os.path.join(pkg_dir, m.group(1)))
+            lineNo = int(m.group(2))
+            columnStart = m.group(3) and int(m.group(3)) or 1
+            problem = (m.group(4), lineNo, columnStart, columnStart + 1)
+            if problem not in problems.setdefault(path, []):
+                problems[path].append(problem)
+
+    def _vet(self, pkg_dir, go_exe, env, build_check):
+        with self._lock:
+            state = self._packages.setdefault(pkg_dir, _PackageState())
+        self._hash_package(pkg_dir, state)
+        key = (state.package_hash, build_check)
+        with self._lock:
+            if key in self._results:
+                return
+        problems = {}
+        self._run_tool([go_exe, 'vet', '.'], pkg_dir, env, problems)
+        if build_check:
+            self._run_tool([go_exe, 'build', '-o', os.devnull, '.'],
+                           pkg_dir, env, problems)
+        with self._lock:
+            self._results[key] = problems
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        _notify_results(pkg_dir)
+
+    def _run(self):
+        while True:
+            pkg_dir, go_exe, env, build_check = self._queue.get()
+            with self._lock:
+                self._queued.discard(pkg_dir)
+            try:
+                self._vet(pkg_dir, go_exe, env, build_check)
+            except Exception:
+                log.exception("Error vetting %r", pkg_dir)
+
+    def request(self, pkg_dir, go_exe, env, build_check=False):
+        """Queue `pkg_dir` to be vetted, unless it already is."""
+        with self._lock:
+            if pkg_dir in self._queued:
+                return
+            self._queued.add(pkg_dir)
+            self._queue.put((pkg_dir, go_exe, env, build_check))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="Go vet")
+                self._thread.setDaemon(True)
+                self._thread.start()
+
+    def get_problems(self, path, text, build_check=False):
+        """Return the vet problems of the file at `path`, if known.
+
+        Results are only returned when they were computed for exactly
+        `text`; otherwise their line numbers can't be trusted.
+        """
+        pkg_dir, name = os.path.split(path)
+        with self._lock:
+            state = self._packages.get(pkg_dir)
+            if state is None or name not in state.file_hashes:
+                return None
+            if state.file_hashes[name][1] != hashlib.sha1(text).hexdigest():
+                return None
+            problems = self._results.get((state.package_hash, build_check))
+        if problems is None:
+            return None
+        return problems.get(os.path.normpath(path), [])
+
+@components.ProxyToMainThreadAsync
+def _notify_results(pkg_dir):
+    try:
+        obsSvc = components.classes["@mozilla.org/observer-service;1"].\
+                    getService(components.interfaces.nsIObserverService)
+        obsSvc.notifyObservers(None, "golang_vet_results", pkg_dir)
+    except Exception, e:
+        log.debug("Unable to notify vet results: %s", e)
+
+vet_runner = GoVetRunner()
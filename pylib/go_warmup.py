@@ -0,0 +1,186 @@
+
+"""Warming up the Go tooling in the background.
+
+The first completion, go to definition or lint of a session would
+otherwise pay every cold cost at once: resolving the environment and the
+tool locations, probing the go version, starting gocode and loading its
+package cache, and building the std library catalog and package list.
+When a Go file is first seen (it is linted, or codeintel is asked about
+it) these steps are run on a background thread, most needed first:
+
+  environment   the Go environment and the go, gocode and godef locations
+  toolchain     the GOROOT and go version
+  gocode        the gocode server
+  catalog       the std library catalog (member completions)
+  std packages  the std package list (import completions)
+  imports       the packages imported by the file: their declarations
+                (go to definition), and gocode's completions of their
+                members, which also fill the member cache
+  workspace     the GOPATH, vendor and module cache package index
+
+The global steps run once per toolchain, the imports step once per file.
+How long each step took (or why it failed) is kept for readiness(), and
+written out with the tool statistics (see go_stats.dump()).
+"""
+
+import os
+import re
+import time
+import Queue
+import threading
+import logging
+
+import go_catalog
+import go_env
+import go_gocode
+import go_members
+import go_pkgindex
+import go_process
+import go_scanner
+import go_symbols
+
+log = logging.getLogger("codeintel-go.warmup")
+
+# Most imported packages warmed up per file.
+max_imports = 32
+
+_package_re = re.compile(r"^package\s+(\w+)", re.M)
+
+# The buffer gocode completes to list the members of an imported package.
+_warm_buffer_template = """package %(package)s
+
+import _warm "%(import_path)s"
+
+func _() {
+	_warm."""
+
+class WarmUp(object):
+    """Runs the warm-up steps for the Go files seen, on a worker thread."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = Queue.Queue()
+        self._thread = None
+        self._seen_paths = set()
+        self._warm_toolchains = set()
+        self._readiness = {}    # step -> (seconds, error or None)
+
+    def request(self, path, text):
+        """Warm up for the Go file at `path`, with contents `text`.
+
+        Only the first request for each file does anything.
+        """
+        if not path:
+            return
+        with self._lock:
+            if path in self._seen_paths:
+                return
+            self._seen_paths.add(path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="Go warm-up")
+                self._thread.setDaemon(True)
+                self._thread.start()
+        self._queue.put((path, text))
+
+    def readiness(self):
+        """Return {step: (seconds taken, error message or None)}."""
+        with self._lock:
+            return dict(self._readiness)
+
+    def _step(self, name, func, *args):
+        start = time.time()
+        error = None
+        try:
+            result = func(*args)
+        except Exception, e:
+            log.warn("Go warm-up step %r failed: %s", name, e)
+            result = None
+            error = str(e)
+        with self._lock:
+            self._readiness[name] = (time.time() - start, error)
+        return result
+
+    def _run(self):
+        while True:
+            path, text = self._queue.get()
+            try:
+                self._warm_up(path, text)
+            except Exception:
+                log.exception("Error warming up for %r", path)
+
+    def _warm_up(self, path, text):
+        goenv = self._step("environment", self._resolve_tools, path)
+        if goenv is None:
+            return
+        env = goenv.env
+        go_exe = goenv.get_tool("golang")
+        toolchain = self._step("toolchain",
+                               go_pkgindex.std_indexes.toolchain_key,
+                               go_exe, env)
+        gocode_path = goenv.get_tool("gocode")
+        toolchain_env = (go_exe, gocode_path, toolchain,
+                         tuple(sorted(env.items())))
+        if toolchain_env not in self._warm_toolchains:
+            self._warm_toolchains.add(toolchain_env)
+            self._step("gocode", self._start_gocode, gocode_path, go_exe, env)
+            self._step("catalog", go_catalog.std_catalogs.get, go_exe, env)
+            self._step("std packages", go_pkgindex.std_indexes.get,
+                       go_exe, env)
+        if toolchain is not None:
+            self._step("imports", self._warm_imports, path, text, goenv,
+                       toolchain)
+        roots = go_pkgindex.get_workspace_roots(env, os.path.dirname(path),
+                                                go_exe)
+        self._step("workspace", go_pkgindex.workspace_indexer.request_scan,
+                   roots)
+        log.debug("Go warm-up for %r done: %r", path, self.readiness())
+
+    def _resolve_tools(self, path):
+        goenv = go_env.get_environment(path)
+        for tool in ("golang", "gocode", "godef"):
+            goenv.get_tool(tool)
+        return goenv
+
+    def _start_gocode(self, gocode_path, go_exe, env):
+        server = go_gocode.get_server(gocode_path, go_exe, env)
+        if not server.ensure_running():
+            raise RuntimeError("unable to start %s" % (gocode_path, ))
+
+    def _warm_imports(self, path, text, goenv, toolchain):
+        """Index the imported packages, and have gocode load the ones whose
+        members aren't cached."""
+        env = goenv.env
+        go_exe = goenv.get_tool("golang")
+        server = go_gocode.get_server(goenv.get_tool("gocode"), go_exe, env)
+        goroot_src = os.path.join(toolchain[0], "src") + os.sep
+        match = _package_re.search(text)
+        package = match and match.group(1) or "main"
+        for name, import_path in go_scanner.scan_imports(text)[:max_imports]:
+            if import_path == "C":
+                continue
+            pkg_dir = go_symbols.resolve_import(import_path, path, env, go_exe)
+            if pkg_dir is None:
+                continue
+            go_symbols.symbol_index.index_package(pkg_dir)
+            if pkg_dir.startswith(goroot_src):
+                continue    # the catalog has the std packages' members
+            key = go_members.package_key(import_path, pkg_dir, *toolchain)
+            if key is None or go_members.member_cache.get(key) is not None:
+                continue
+            buf = _warm_buffer_template % {"package": package,
+                                           "import_path": import_path}
+            try:
+                output, error = server.autocomplete(buf, path, len(buf),
+                    timeout=goenv.get_timeout("golangCompletionTimeout"),
+                    priority=go_process.BACKGROUND)
+            except (go_process.ToolTimeout, go_process.ToolCancelled,
+                    OSError), e:
+                log.info("gocode warm-up of %r abandoned: %s", import_path, e)
+                continue
+            completions = go_gocode.parse_gocode_csv(output)
+            if completions:
+                go_members.member_cache.put(key,
+                    [(c.name, c.cls, c.type) for c in completions])
+
+warm_up = WarmUp()
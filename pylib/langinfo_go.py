@@ -7,15 +7,26 @@ from xpcom.components import classes as cc
 from xpcom import components
 
 import os
-import sys
-import json
+import heapq
 import logging
 import process
 import time
-import re
-import which
 import tempfile
 
+import go_catalog
+import go_context
+import go_env
+import go_gocode
+import go_largefile
+import go_members
+import go_pkgindex
+import go_process
+import go_scanner
+import go_sections
+import go_stats
+import go_symbols
+import go_warmup
+
 log = logging.getLogger("codeintel-go")
 
 lang = "Go"
@@ -34,212 +45,276 @@ typeMap = {
     "type": "BI"
 }
 
-class GoLangIntel():
-
-    def _get_prefs(self):
-        prefs = None
-        
-        project = cc["@activestate.com/koPartService;1"]\
-                .getService(ci.koIPartService).currentProject
-        if project:
-            prefs = project.prefset
-
-        if not prefs:
-            prefs = Cc["@activestate.com/koPrefService;1"].getService(Ci.koIPrefService).prefs
-
-        return prefs
-
-    @components.ProxyToMainThread
-    def _get_view_prefs(self):
-        view = cc["@activestate.com/koViewService;1"]\
-               .getService(ci.koIViewService).currentView \
-               .QueryInterface(ci.koIScintillaView)
-        if view:
-            return view.prefs
-
-    def _get_env_dict(self):
-        ret = {}
-
-        prefs = self._get_view_prefs()
-        envStr = prefs.getString("userEnvironmentStartupOverride", "")
-        envList = envStr.split('\n')
-
-        userEnvSvc = cc["@activestate.com/koUserEnviron;1"].getService()
-        for piece in userEnvSvc.GetEnvironmentStrings():
-            equalSign = piece.find('=')
-            ret[piece[:equalSign]] = piece[equalSign+1:]
-
-        for entry in envList:
-            try:
-                entry = entry.split("=", 1)
-                if len(entry) != 2:
-                    continue
-                key, value = entry
-                ret[key] = value;
-            except ValueError:
-                log.error("error on value %s" % entry)
-
-        return ret
-
-    def _get_gotool(self, tool, env = {}):
-        prefs = self._get_prefs()
-        tool_path = prefs.getString(tool + "DefaultLocation", "")
-
-        if tool_path and tool_path != "":
-            return tool_path
-
-        path = "PATH" in env and env["PATH"] or ""
-        path = [d.strip()
-                for d in path.split(os.pathsep)
-                if d.strip()]
-
-        tool_name = tool
-        if tool_name == "golang":
-            tool_name = "go"
-
-        try:
-            return which.which(tool_name, path=path)
-        except which.WhichError:
-            pass
-
-        go_exe = None
-        if tool != "golang":
-            go_exe = self._get_gotool("golang", env)
-
-        ext = sys.platform.startswith("win") and ".exe" or ""
-
-        if go_exe:
-            tool_path = os.path.join(os.path.dirname(go_exe), tool_name + ext)
-            if os.path.exists(tool_path):
-                return tool_path
-
-        go_path = "GOPATH" in env and env["GOPATH"] or None
-        if go_path:
-            tool_path = os.path.join(go_path, "bin", tool_name + ext)
-            if os.path.exists(tool_path):
-                return tool_path
+def _match_score(name, query, lower_query):
+    """Return how well `name` matches the typed `query` (lower is better).
+
+    Prefix matches beat case-insensitive prefix matches, which beat fuzzy
+    (subsequence) matches; fuzzy matches are ranked by how spread out the
+    matched characters are. Returns None if `name` doesn't match at all.
+    """
+    if name.startswith(query):
+        return 0
+    lower_name = name.lower()
+    if lower_name.startswith(lower_query):
+        return 1
+    index = -1
+    gaps = 0
+    for ch in lower_query:
+        found = lower_name.find(ch, index + 1)
+        if found < 0:
+            return None
+        gaps += found - index - 1
+        index = found
+    return 2 + gaps
+
+def rank_completions(completion_data, query, limit=None):
+    """Return the best (at most `limit`) Completions matching `query`,
+    best first."""
+    if not query:
+        return completion_data[:limit]
+    lower_query = query.lower()
+    scored = []
+    for i, completion in enumerate(completion_data):
+        score = _match_score(completion.name, query, lower_query)
+        if score is not None:
+            scored.append((score, completion.name.lower(), i, completion))
+    if limit is not None and len(scored) > limit:
+        scored = heapq.nsmallest(limit, scored)
+    else:
+        scored.sort()
+    return [x[3] for x in scored]
+
+# The fields of a completion entry that are the same for every candidate.
+_entry_template = {
+    "source": "buffer",
+    "filename": "",
+    "line": None,
+    "pos": 0,
+    "active": False,
+    "isScope": False,
+    "level": 0,
+    "api": "legacy"
+}
 
-        return tool # go for broke
+class GoLangIntel():
 
     def getCompletions(self, buf, pos, path, parentPath, importPaths):
         log.debug("getCompletions")
-
-        _pos = pos
-        query = ""
-        while re.match(r"\w", buf[_pos-1]):
-            query = buf[_pos-1] + query
-            _pos = _pos - 1
-
-        if not query:
-            _wpos = pos
-            while re.match(r"[\t ]", buf[_wpos-1]):
-                _wpos = _wpos - 1
-            if buf[_wpos-1] == "\n":
-                return
-
-        if buf[_pos-7:_pos-1] == "import":
-            return self._getImportCompletions(query, buf, _pos, path, parentPath, importPaths)
-
-        return self._getCompletions(query, buf, pos, path, parentPath, importPaths)
+        go_warmup.warm_up.request(path, buf)
+
+        # Only ask for completions where some can be given: not in
+        # comments, strings, or after a literal or closing bracket.
+        context = go_context.analyze(buf, pos)
+        log.debug("completion context: %r", context)
+        if context.kind == go_context.IMPORT:
+            return self._getImportCompletions(context.query, buf, context.start, path, parentPath, importPaths)
+        if context.kind in (go_context.SELECTOR, go_context.IDENTIFIER):
+            return self._getCompletions(context.query, buf, pos, path, parentPath, importPaths)
+        return None
+
+    # Seconds for which a gocode result may be refined as the user types.
+    completion_refine_timeout = 30
+    # Maximum number of completions returned.
+    max_completions = 250
+    # (context, time, candidates) of the last gocode request.
+    _last_completions = None
 
     def _getCompletions(self, query, buf, pos, path, parentPath, importPaths):
         log.debug("_getCompletions")
 
-        log.debug(1)
-        env = self._get_env_dict()
-        log.debug(2)
-        go_exe = self._get_gotool("golang", env)
-        log.debug(3)
-        gocode_path = self._get_gotool('gocode', env)
-        log.debug(4)
-
-        # We can't store the path and watch prefs because this isn't a
-        # true xpcom object.
-        cmd = [gocode_path, '-debug', '-f=json', 'autocomplete', path, '%s' % pos]
-        log.debug("running [%s]", cmd)
-        try:
-            p = process.ProcessOpen(cmd, env=env)
-        except OSError, e:
-            log.error("Error executing '%s': %s", cmd[0], e)
-            return
-
-        output, error = p.communicate(buf)
-        if error:
-            log.warn("'%s' stderr: [%s]", cmd[0], error)
-
-        try:
-            completion_data = json.loads(output)
-            log.debug('full completion_data: %r', completion_data)
-            completion_data = completion_data[1]
-        except IndexError:
-            # exit on empty gocode output
-            return
-        except ValueError, e:
-            log.exception('Exception while parsing json')
-            return
+        # gocode is asked for the candidates at the start of the word being
+        # typed, so the same result can be filtered locally for every
+        # further keystroke in that word.
+        start = pos - len(query)
+        line_start = buf.rfind("\n", 0, start) + 1
+        context = (path, start, buf[line_start:start])
+        last = self._last_completions
+        if last is not None and last[0] == context \
+           and time.time() - last[1] < self.completion_refine_timeout:
+            completion_data = last[2]
+        else:
+            completion_data = self._getCatalogCompletions(buf, start, path)
+            member_key = None
+            if completion_data is None:
+                member_key = self._getMemberCacheKey(buf, start, path)
+                if member_key is not None:
+                    members = go_members.member_cache.get(member_key)
+                    if members is not None:
+                        completion_data = [go_gocode.Completion(*member)
+                                           for member in members]
+            if completion_data is None and go_largefile.is_large(buf):
+                log.debug("large-file mode: not running gocode")
+                return
+            if completion_data is None:
+                completion_data = self._runGocode(buf[:start] + buf[pos:], start, path)
+                if completion_data is not None and member_key is not None:
+                    go_members.member_cache.put(member_key,
+                        [(c.name, c.cls, c.type) for c in completion_data])
+            if completion_data is None:
+                return
+            self._last_completions = (context, time.time(), completion_data)
 
-        completion_data = [x for x in completion_data if x['class'] != 'PANIC'] # remove PANIC entries if present
+        # Only the candidates that will be shown are turned into entries.
+        completion_data = rank_completions(completion_data, query,
+                                           self.max_completions)
         if not completion_data:
             return
 
         symbols = []
         for completion in completion_data:
-            typ = completion["class"]
-            if typ in typeMap:
-                typ = typeMap[typ]
-            symbols.append({
-                "name": completion["name"],
-                "typehint": completion["type"],
-                "source": "buffer",
-                "type": typ,
-                "filename": "",
-                "line": None,
-                "pos": 0,
-                "active": False,
-                "isScope": False,
-                "level": 0,
-                "members": [],
-                "api": "legacy"
-            })
+            entry = _entry_template.copy()
+            entry["name"] = completion.name
+            entry["typehint"] = completion.type
+            entry["type"] = typeMap.get(completion.cls, completion.cls)
+            entry["members"] = []
+            symbols.append(entry)
+
+        # Once a std identifier has been typed in full, the catalog has its
+        # signature and doc for the calltip.
+        symbol = signature = docblock = ""
+        member = self._getCatalogMember(buf, start, path, query)
+        if member is not None:
+            symbol = member.name
+            signature = member.signature
+            docblock = member.doc
 
         return {
-            "symbol": "",
+            "symbol": symbol,
             "query": query,
-            "docblock": "",
-            "signature": "",
+            "docblock": docblock,
+            "signature": signature,
             "entries": symbols,
             "language": "Go"
         }
-        
-    def _getImportCompletions(self, query, buf, pos, path, parentPath, env):
+
+    def _getCatalogPackage(self, buf, pos, path):
+        """Return the (catalog, import path) of the std package selected
+        from at `pos`.
+
+        Returns None if `pos` doesn't follow "pkg." for an imported std
+        package, or the catalog isn't available yet.
+        """
+        qualifier = go_symbols.selector_qualifier(buf, pos)
+        if qualifier is None or go_symbols.may_be_local(buf, pos, qualifier):
+            return None
+        goenv = go_env.get_environment(path)
+        go_exe = goenv.get_tool("golang")
+        if not go_exe:
+            return None
+        catalog = go_catalog.std_catalogs.get(go_exe, goenv.env)
+        if catalog is None:
+            return None
+        for name, import_path in go_scanner.scan_imports(buf):
+            if name == qualifier:
+                if not catalog.has_package(import_path):
+                    return None
+                return catalog, import_path
+            if name is None and catalog.package_name(import_path) == qualifier:
+                return catalog, import_path
+        return None
+
+    def _getCatalogCompletions(self, buf, pos, path):
+        """Return the members of the std package selected from at `pos`.
+
+        The members come from the std library catalog; returns None if
+        `pos` doesn't follow "pkg." for an imported std package, or the
+        catalog isn't available yet.
+        """
+        package = self._getCatalogPackage(buf, pos, path)
+        if package is None:
+            return None
+        catalog, import_path = package
+        members = catalog.members(import_path)
+        if members is None:
+            return None
+        return [go_gocode.Completion(member.name, member.kind, member.typehint)
+                for member in members]
+
+    def _getCatalogMember(self, buf, pos, path, name):
+        """Return the catalog's CatalogEntry of `name` in the std package
+        selected from at `pos`, or None."""
+        if not name:
+            return None
+        package = self._getCatalogPackage(buf, pos, path)
+        if package is None:
+            return None
+        return package[0].lookup(package[1], name)
+
+    def _getMemberCacheKey(self, buf, pos, path):
+        """Return the go_members key of the package selected from at `pos`.
+
+        Returns None if `pos` doesn't follow "pkg." for an imported
+        package that can be found on disk.
+        """
+        qualifier = go_symbols.selector_qualifier(buf, pos)
+        if qualifier is None or go_symbols.may_be_local(buf, pos, qualifier):
+            return None
+        goenv = go_env.get_environment(path)
+        go_exe = goenv.get_tool("golang")
+        if not go_exe or not path:
+            return None
+        toolchain = go_pkgindex.std_indexes.toolchain_key(go_exe, goenv.env)
+        if toolchain is None:
+            return None
+        package = go_symbols.find_package(buf, qualifier, path, goenv.env,
+                                          go_exe)
+        if package is None:
+            return None
+        return go_members.package_key(package[0], package[1], *toolchain)
+
+    def _runGocode(self, buf, pos, path):
+        """Return gocode's candidates at `pos`, or None on failure."""
+        goenv = go_env.get_environment(path)
+        env = goenv.env
+        go_exe = goenv.get_tool("golang")
+        gocode_path = goenv.get_tool("gocode")
+
+        # gocode keeps its package cache in a long-running server; reuse the
+        # one we manage for this environment rather than a fresh process.
+        server = go_gocode.get_server(gocode_path, go_exe, env)
+        try:
+            output, error = server.autocomplete(buf, path, pos,
+                timeout=goenv.get_timeout("golangCompletionTimeout"),
+                slot=("completion", path))
+        except (go_process.ToolTimeout, go_process.ToolCancelled), e:
+            log.info("gocode request abandoned: %s", e)
+            return
+        except OSError, e:
+            log.error("Error executing '%s': %s", gocode_path, e)
+            return
+        if error:
+            log.warn("'%s' stderr: [%s]", gocode_path, error)
+
+        # gocode's csv output is much cheaper to parse than its json.
+        with go_stats.parse_timer("gocode"):
+            completion_data = go_gocode.parse_gocode_csv(output)
+        log.debug("%d candidates from gocode", len(completion_data))
+        # exit on empty gocode output
+        return completion_data or None
+
+    def _getImportCompletions(self, query, buf, pos, path, parentPath, importPaths):
         log.debug("_getImportCompletions")
 
-        env = self._get_env_dict(env)
-        go_exe = self._get_gotool("golang", env)
+        goenv = go_env.get_environment(path)
+        env = goenv.env
+        go_exe = goenv.get_tool("golang")
 
         if not go_exe:
             raise CodeIntelGoException("Unable to locate go executable")
 
-        cmd = [go_exe, 'list', 'std']
-        cwd = parentPath
+        index = go_pkgindex.std_indexes.get(go_exe, env)
+        if index is None:
+            raise CodeIntelGoException("Unable to list the packages of %r" % go_exe)
+        package_names = index.search(query)
 
-        log.debug("running cmd %r", cmd)
-        try:
-            p = process.ProcessOpen(cmd, cwd=cwd, env=env)
-        except OSError, e:
-            raise CodeIntelGoException("Error executing '%s': %s" % (cmd, e))
-        output, error = p.communicate()
-        if error:
-            log.warn("cmd %r error [%s]", cmd, error)
-            raise CodeIntelGoException(error)
-        package_names = [x.strip() for x in output.splitlines() if x]
-        log.debug("retrieved %d package names", len(package_names))
+        # Third-party packages come from the background indexer; whatever it
+        # has found so far is used without waiting for it.
+        roots = go_pkgindex.get_workspace_roots(env, parentPath, go_exe)
+        go_pkgindex.workspace_indexer.request_scan(roots)
+        package_names += go_pkgindex.workspace_indexer.search(query, roots)
 
         symbols = []
         for package in package_names:
-            if not package.lower().startswith(query):
-                continue
-
             symbols.append({
                 "name": package,
                 "typehint": None,
@@ -267,34 +342,54 @@ An import declaration states that the source file containing the declaration dep
 
     def getDefinition(self, buf, pos, path, parentPath, importPaths):
         log.debug("getDefinition")
+        go_warmup.warm_up.request(path, buf)
 
-        env = self._get_env_dict()
-        godef_path = self._get_gotool("godef", env)
+        goenv = go_env.get_environment(path)
+        env = goenv.env
 
+        # Package-level declarations are answered from the symbol index;
+        # anything it isn't certain about is left to godef.
+        try:
+            found = go_symbols.find_definition(buf, pos, path, env,
+                                               goenv.get_tool("golang"))
+        except Exception:
+            log.exception("Symbol index lookup failed")
+            found = None
+        if found is not None:
+            return {"filename": found[0], "line": str(found[1])}
+
+        godef_path = goenv.get_tool("godef")
         cmd = [godef_path, '-i=true', '-t=true', '-f=%s' % path, '-o=%s' % pos]
         log.debug("running [%s]", cmd)
-        p = process.ProcessOpen(cmd, env=env)
-
-        output, error = p.communicate(buf)
+        try:
+            output, error = go_process.run(cmd, input=buf, env=env,
+                timeout=goenv.get_timeout("golangDefinitionTimeout"),
+                slot=("definition", path), priority=go_process.DEFINITION)
+        except (go_process.ToolTimeout, go_process.ToolCancelled), e:
+            log.info("godef request abandoned: %s", e)
+            return
+        except OSError, e:
+            log.error("Error executing '%s': %s", godef_path, e)
+            return
         if error:
-            log.debug("'gocode' stderr: [%s]", error)
+            log.debug("'godef' stderr: [%s]", error)
             return
 
-        lines = output.splitlines()
         log.debug(output)
+        with go_stats.parse_timer("godef"):
+            lines = output.splitlines()
 
-        defparts = lines[0].rsplit(":",2)
+            defparts = lines[0].rsplit(":",2)
+
+            if len(defparts) == 2:
+                # current file
+                line = defparts[0]
+            else:
+                # other file
+                path = defparts[0]
+                line = defparts[1]
+            name, typeDesc = lines[1].split(' ', 1)
 
-        if len(defparts) == 2:
-            # current file
-            path = buf.path
-            line = defparts[0]
-        else:
-            # other file
-            path = defparts[0]
-            line = defparts[1]
-        name, typeDesc = lines[1].split(' ', 1)
-        
         return {"filename": path, "line": line}
 
 class GoLangInfo(LangInfo):
@@ -323,24 +418,7 @@ class GoLangInfo(LangInfo):
         """.split())
     default_encoding = "utf-8"
 
-    section_regexes = [
-       ("function", re.compile(r'''
-            [^\n][\s]*                              # Start of line
-            func[ \t]+(\w+)[ \t]*\(                 # The function definition
-            ''', re.M | re.X)),
-       ("object", re.compile(r'''
-            [^\n][\s]*                              # Start of line
-            type[ \t]+(\w+)[ \t]*struct             # object definition
-            ''', re.M | re.X)),
-       ("interface", re.compile(r'''
-            [^\n][\s]*                              # Start of line
-            type[ \t]+(\w+)[ \t]*interface          # interface definition
-            ''', re.M | re.X)),
-       ("class", re.compile(r'''
-            [^\n][\s]*                            # Start of line
-            const\s+(\w+)\s+\w+\s=                # constant
-            ''', re.M | re.X)),
-    ]
+    section_regexes = go_sections.section_regexes
 
     legacy_codeintel = GoLangIntel()
         